@@ -2,11 +2,8 @@
 
 import os, time, sys
 import logging
-import OLEDDisplay
 import threading
 
-from wifi import Cell, Scheme
-
 class EditableOption(object):
     TIMEOUT = 5.0
     def __init__(self, log, cb=None):
@@ -207,7 +204,7 @@ class BBQDisplay(threading.Thread):
     UP_BUTTON = 26
     DOWN_BUTTON = 27
     
-    def __init__(self, log=None):
+    def __init__(self, log=None, display=None):
         '''
         Main Menu
         Header -> Time Date Connected to Wifi Alert
@@ -237,7 +234,11 @@ class BBQDisplay(threading.Thread):
                              "alert": False
                              }
 
-        self.display = OLEDDisplay.OLEDDisplay()
+        if display == None:
+            #PIL and numpy come in with the OLED driver; only pay for them when a display is built
+            from OLEDDisplay import OLEDDisplay
+            display = OLEDDisplay()
+        self.display = display
 
         self.target_temp = 215
 
@@ -288,6 +289,7 @@ class BBQDisplay(threading.Thread):
                            {"name": "Min Temp Alarm", "value": self.min_amb_temp_alarm, "type":"variable", "mode": "rw"}]
 
     def checkWifiState(self):
+        from wifi import Cell
         Cell.all("wlan0")
         self.header_state["wifi"] = True
         self.header_state["wifi_power"] = 90
@@ -368,7 +370,7 @@ if __name__ == "__main__":
 
     disp = BBQDisplay()
     runs = 5
-    for x in xrange(runs):
+    for x in range(runs):
         disp.updateHeader()
         disp.refreshMainMenu()
         disp.updateBody()
@@ -3,141 +3,156 @@
 import os, sys
 import time
 
-import Adafruit_GPIO.SPI as SPI
-import Adafruit_SSD1306
-
-from PIL import Image
-from PIL import ImageDraw
 from PIL import ImageFont
 
 import subprocess
-import threading
 import logging
 
+from oled_renderer import DirtyPageRenderer
+from frame_recorder import FrameRecorder
+from glyph_atlas import GlyphAtlas, TextFramebuffer
+from display_compositor import DisplayCompositor
+
 class OLEDDisplay(object):
     RST = None
     DC = 23
     SPI_PORT = 0
     SPI_DEVICE = 0
 
-    def __init__(self, log=None, address=0x3C):
+    def __init__(self, log=None, address=0x3C, fps=10.0, disp=None):
         self.log = log
         if self.log == None:
             self.log = logging.getLogger("OLEDDisplay")
 
         # Note you can change the I2C address by passing an i2c_address parameter like:
         self.log.info("Initializing OLED Display with address %s" % str(address))
-        self.disp = Adafruit_SSD1306.SSD1306_128_64(rst=OLEDDisplay.RST, i2c_address=address)
+        #disp is any Adafruit_SSD1306 compatible backend, see hal.openFakeDisplay
+        if disp == None:
+            from hal import openDisplay
+            disp = openDisplay(address, rst=OLEDDisplay.RST)
+        self.disp = disp
 
         # Initialize library.
         self.disp.begin()
-        self.display_lock = threading.Lock()
-        self.clearDisplay()
+        #Only the SSD1306 pages that changed are sent over I2C
+        self.renderer = DirtyPageRenderer(self.disp, self.log)
 
-        self.image = Image.new('1', (self.disp.width, self.disp.height))
-        self.draw = ImageDraw.Draw(self.image)
+        #Text is blitted from a pre-rasterized atlas into a packed framebuffer
         self.font = ImageFont.load_default()
+        self.atlas = GlyphAtlas(self.font)
+        self.framebuffer = TextFramebuffer(self.atlas, self.disp.width, self.disp.height)
         self.x_offset = 0
         self.y_offset = 0
 
+        #All drawing, cursor blinking and I2C happens on the compositor thread;
+        #the write methods below only queue scene updates and never block
+        self.compositor = DisplayCompositor(self.framebuffer, self.renderer, fps=fps, log=self.log)
+        self.clearDisplay()
         self.blankImage()
 
         self.header = None
         self.menu = None
-        self.cursor_position = None
+        self._cursor_position = None
         self.cursor_position = (3,8)
-        self.cursor_blink_interval = 0.2
 
-        self._debug_image = True
-        
-        self.cursor_thread = None
-        self.startCursor()
+        #Debug capture of the last frames sent; see startRecording
+        self.recorder = None
+
+        self.compositor.start()
+
+    def close(self):
+        self.compositor.stop()
+
+    @property
+    def cursor_blink_interval(self):
+        return self.compositor.blink_interval
+
+    @cursor_blink_interval.setter
+    def cursor_blink_interval(self, interval):
+        self.compositor.blink_interval = interval
+
+    @property
+    def cursor_position(self):
+        return self._cursor_position
+
+    @cursor_position.setter
+    def cursor_position(self, position):
+        self._cursor_position = position
+        if position:
+            self.drawCursor(position[0], position[1])
+        else:
+            self.compositor.setCursor(0, 0, None)
 
     def startCursor(self):
         if not self.cursor_position:
-            print "Enter cursor_position before starting cursor"
             self.log.error("Enter cursor_position before starting cursor")
-        if self.cursor_thread != None:
-            print "Cursor already enabled"
-            self.log.warn("Cursor already enabled")
-            return
-        self._enableCursor = True
-        self._cursorState = False
-        self.cursor_thread = threading.Thread(target=self.checkCursor)
-        self.cursor_thread.start()
+        self.compositor.setBlink(True)
 
     def stopCursor(self):
-        self._enableCursor = False
-        self.cursor_thread.join(2)
-        self.cursor_thread = None
-
-    def checkCursor(self):
-        self._cursorState = False
-        print "Checking cursor"
-        while self._enableCursor:
-            if not self.cursor_position:
-                time.sleep(0.5)
-                continue
-            if self._cursorState:
-                self._cursorState = False
-                print "Cursor off"
-            else:
-                self._cursorState = True
-                print "Cursor on"
-            with self.display_lock:
-                self.updateDisplay()
-            time.sleep(self.cursor_blink_interval)
-
-    def drawCursor(self, row, col, fill=255):
+        self.compositor.setBlink(False)
+
+    def drawCursor(self, row, col):
         pixels_per_row = 8
         pixels_per_char = 6
-        #self.draw.line([((row+1)*pixels_per_row-1, col*pixels_per_char), ((row+1)*pixels_per_row-1, (col+1)*pixels_per_char-1)], fill=255, width=1)  
-        self.draw.line([(col*pixels_per_char, (row+1)*pixels_per_row+1), ((col+1)*pixels_per_char-1, (row+1)*pixels_per_row+1)], fill=fill, width=1)  
+        self.compositor.setCursor(col*pixels_per_char, (col+1)*pixels_per_char-1, (row+1)*pixels_per_row+1)
 
     def clearDisplay(self):
         self.log.info("Clearing display")
-        with self.display_lock:
-            self.disp.clear()
-            self.disp.display()
+        self.compositor.submit(self._clearPanel)
+
+    def _clearPanel(self):
+        self.disp.clear()
+        self.disp.display()
+        self.renderer.invalidate(blank=True)
 
     def blankImage(self):
         self.blankHeader()
         self.blankMenu()
 
     def blankHeader(self):
-        self.draw.rectangle((0,0,self.disp.width,16), outline=0, fill=0)
+        self.compositor.clearLine("header")
 
     def blankMenu(self):
-        self.draw.rectangle((0,16,self.disp.width, self.disp.height-16), outline=0, fill=0)
+        self.compositor.clearLines(lambda slot: slot != "header")
 
     def writeHeader(self, txt):
         self.header = txt
-        with self.display_lock:
-            self.blankHeader()
-            self.draw.text((self.x_offset, self.y_offset), self.header, font=self.font, fill=255)
-            self.updateDisplay()
+        self.compositor.setLine("header", self.header, self.x_offset, self.y_offset)
 
     def writeMenu(self, lines=None):
         if lines != None:
             self.menu = lines
         if self.menu == None:
-            print "Nothing to write"
+            print("Nothing to write")
             return
-        with self.display_lock:
-            self.blankMenu()
-            for idx, txt in enumerate(self.menu):
-                self.draw.text((self.x_offset, self.y_offset+(idx)*8+ 16), txt, font=self.font, fill=255)
-            self.updateDisplay()
-
-    def updateDisplay(self):
-        if self._cursorState:
-            self.drawCursor(self.cursor_position[0], self.cursor_position[1])
+        #Unchanged lines are skipped; slots past the end of the menu are cleared
+        menu = list(self.menu)
+        for idx, txt in enumerate(menu):
+            self.compositor.setLine(idx, txt, self.x_offset, self.y_offset+(idx)*8+ 16)
+        self.compositor.clearLines(lambda slot: slot != "header" and slot >= len(menu))
+
+    def updateDisplay(self, timeout=2.0):
+        """Waits until every queued update has reached the panel"""
+        return self.compositor.sync(timeout)
+
+    def startRecording(self, capacity=300):
+        self.recorder = FrameRecorder(self.disp.width, self.disp.height, capacity)
+        self.renderer.recorder = self.recorder
+
+    def stopRecording(self):
+        self.renderer.recorder = None
+
+    def dumpRecording(self, path):
+        self.updateDisplay()
+        if self.recorder == None:
+            self.log.error("Recording was never started; nothing to dump")
+            return 0
+        if path.endswith(".gif"):
+            count = self.recorder.dumpGIF(path)
         else:
-            self.drawCursor(self.cursor_position[0], self.cursor_position[1], fill=0)
-        self.disp.image(self.image)
-        self.disp.display()
-        if self._debug_image:
-            self.image.save("/tmp/%s.jpg" % str(time.time()), "JPEG")
+            count = self.recorder.dump(path)
+        self.log.info("Wrote %d display frames to %s" % (count, path))
+        return count
 
 if __name__ == "__main__":
 
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+import os, time, sys
+import logging
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+class ButtonInput(object):
+    """Front panel buttons delivered to the event loop as a stream of pin numbers
+
+    GPIO edge callbacks (see hal.py) run on their own thread, so they only
+    hand the pin over with call_soon_threadsafe; the callbacks registered
+    here then run as part of the button task on the loop.
+    """
+    def __init__(self, callbacks, bouncetime=50, gpio=None, log=None):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.callbacks = dict(callbacks)
+        self.bouncetime = bouncetime
+        self.gpio = gpio
+        self.presses = 0
+        self._loop = None
+        self._queue = None
+
+    def attach(self, loop):
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        if self.gpio == None:
+            return
+        for pin in self.callbacks:
+            self.gpio.watchEdge(pin, self.press, bouncetime=self.bouncetime)
+
+    def detach(self):
+        if self.gpio != None:
+            for pin in self.callbacks:
+                self.gpio.unwatch(pin)
+        self._loop = None
+
+    def press(self, pin):
+        """Safe to call from any thread, including GPIO callbacks"""
+        if self._loop != None:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, pin)
+
+    async def run(self):
+        while True:
+            pin = await self._queue.get()
+            callback = self.callbacks.get(pin)
+            if callback == None:
+                continue
+            self.presses += 1
+            try:
+                callback()
+            except Exception as e:
+                self.log.error("Button %d handler failed: %s" % (pin, str(e)))
+
+class AsyncRuntime(object):
+    """Runs a BBQController, its display and its buttons as tasks on one event loop
+
+    This replaces the sampler, scheduler, status and compositor threads: every
+    probe gets a sampling task whose blocking 1-Wire read goes to a small
+    executor, the ambient task runs the PID step directly on each fresh
+    reading, and the display compositor is woken by its own queue. stop() or
+    the end of duration cancels every task, waits for them and shuts the
+    executor down before run() returns. Python 3 only; the threaded
+    controller start()/stop() keep working everywhere.
+    """
+    def __init__(self, controller, compositor=None, buttons=None, executor_workers=3, log=None):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.controller = controller
+        self.clock = controller.clock
+        self.compositor = compositor
+        self.buttons = buttons
+        self.executor_workers = executor_workers
+        self._loop = None
+        self._stop = None
+        self._display_wake = None
+
+    async def _sleepUntil(self, when):
+        delay = when - self.clock.monotonic()
+        if delay > 0:
+            await asyncio.sleep(self.clock.timeout(delay))
+
+    async def _sampleProbe(self, probe, step=None):
+        #Fixed rate schedule, same as SensorManager
+        probe.next_due = self.clock.monotonic()
+        while True:
+            start_time = self.clock.monotonic()
+            reading = await self._loop.run_in_executor(self._executor, probe.sampler.sample)
+            if reading != None and step != None:
+                try:
+                    step(reading)
+                except Exception as e:
+                    self.log.error("Control step failed: %s" % str(e))
+            next_due = probe.next_due + probe.interval
+            if next_due <= start_time:
+                next_due = start_time + probe.interval
+            probe.next_due = next_due
+            await self._sleepUntil(next_due)
+
+    async def _statusLogger(self):
+        controller = self.controller
+        while True:
+            #As in BBQController.status_logger, one failed update must not end status logging
+            try:
+                status = controller.update_status()
+            except Exception as e:
+                self.log.error("Status update failed: %s" % str(e))
+                status = None
+            if status != None:
+                controller.log_status(status)
+            await asyncio.sleep(self.clock.timeout(controller.status_sleep_time))
+
+    async def _runDisplay(self):
+        compositor = self.compositor
+        while True:
+            self._display_wake.clear()
+            #Flushes block on I2C, so they run on the executor
+            wake_at = await self._loop.run_in_executor(self._executor, compositor.composite)
+            timeout = max(0.0, wake_at - self.clock.monotonic())
+            try:
+                await asyncio.wait_for(self._display_wake.wait(), self.clock.timeout(timeout))
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        """Ends run(); safe to call from any thread"""
+        if self._loop != None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def main(self, duration=None):
+        self._loop = asyncio.get_event_loop()
+        self._stop = asyncio.Event()
+        self._executor = ThreadPoolExecutor(self.executor_workers)
+        controller = self.controller
+        tasks = []
+        try:
+            for probe in controller.sensors.probes:
+                step = controller.run_pid if probe is controller.ambient_probe else None
+                tasks.append(asyncio.ensure_future(self._sampleProbe(probe, step)))
+            tasks.append(asyncio.ensure_future(self._statusLogger()))
+            if self.compositor != None:
+                if self.compositor.compositor_thread:
+                    self.compositor.stop()
+                self._display_wake = asyncio.Event()
+                self.compositor.notify = lambda: self._loop.call_soon_threadsafe(self._display_wake.set)
+                tasks.append(asyncio.ensure_future(self._runDisplay()))
+            if self.buttons != None:
+                self.buttons.attach(self._loop)
+                tasks.append(asyncio.ensure_future(self.buttons.run()))
+            self.log.info("Async runtime started with %d tasks" % len(tasks))
+            if duration == None:
+                await self._stop.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self._stop.wait(), self.clock.timeout(duration))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.buttons != None:
+                self.buttons.detach()
+            if self.compositor != None:
+                self.compositor.notify = None
+                #Push out whatever was queued after the last flush
+                self._executor.submit(self.compositor.composite, True)
+            self._executor.shutdown(wait=True)
+            self._loop = None
+            self.log.info("Async runtime stopped")
+
+    def run(self, duration=None):
+        """Runs until stop() is called or duration clock seconds have passed"""
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.main(duration))
+        finally:
+            loop.close()
+            asyncio.set_event_loop(None)
+
+if __name__ == "__main__":
+
+    import bbq_controller
+    from clocks import ScaledClock
+    from smoker_sim import DEFAULT_SPEEDUP
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    hours = 2.0
+    speedup = DEFAULT_SPEEDUP
+    if len(sys.argv) > 1:
+        hours = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        speedup = float(sys.argv[2])
+    bbq = bbq_controller.BBQController(log=log, simulator=True, clock=ScaledClock(speedup))
+    bbq.set_target_ambient_temp(235)
+    start_time = time.time()
+    AsyncRuntime(bbq, log=log).run(hours*60*60)
+    log.info("Simulated %.1f hour cook in %.1fs, %d samples, final pit %.1fF" % (
+        hours, time.time()-start_time, len(bbq.history), bbq.status["ambient_temp"]))
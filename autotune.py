@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import math
+import json
+from collections import namedtuple
+
+#Kp = kp * Ku, Ti = ti * Pu, Td = td * Pu
+TUNING_RULES = {"ziegler_nichols":    (0.6, 0.5, 0.125),
+                "ziegler_nichols_pi": (0.45, 1 / 1.2, 0.0),
+                "tyreus_luyben":      (1 / 2.2, 2.2, 1 / 6.3),
+                "tyreus_luyben_pi":   (1 / 3.2, 2.2, 0.0)}
+DEFAULT_RULE = "tyreus_luyben_pi"
+
+def tuningGains(ku, pu, rule=DEFAULT_RULE):
+    """(Kp, Ki, Kd) for PID's parallel form from ultimate gain and period"""
+    kp, ti, td = TUNING_RULES[rule]
+    Kp = kp * ku
+    Ki = 0.0
+    if ti > 0:
+        Ki = Kp / (ti * pu)
+    return (Kp, Ki, Kp * td * pu)
+
+class AutotuneResult(namedtuple("AutotuneResult", ["ku", "pu", "amplitude", "bias", "cycles"])):
+    """Ultimate gain and period (seconds) from a relay experiment
+
+    amplitude is the temperature oscillation (half peak to peak) and bias
+    the mean duty cycle over the measured cycles, an estimate of the duty
+    that holds the setpoint.
+    """
+    __slots__ = ()
+
+    def gains(self, rule=DEFAULT_RULE):
+        return tuningGains(self.ku, self.pu, rule)
+
+class RelayAutotune(object):
+    """Astrom-Hagglund relay experiment around a setpoint
+
+    Call update with every pit reading and drive the fan with the duty it
+    returns: high_duty below setpoint - hysteresis, low_duty above setpoint
+    + hysteresis. The fire settles into a limit cycle whose period is the
+    ultimate period Pu and whose amplitude a gives the ultimate gain
+
+        Ku = 4 d / (pi * sqrt(a^2 - hysteresis^2)),  d = (high - low) / 2
+
+    The first settle_cycles cycles (warm up, transients) are discarded and
+    the next cycles are averaged. finished becomes True once they are
+    measured, or after max_time seconds without them (result stays None).
+    """
+    def __init__(self, setpoint, high_duty=100, low_duty=0, hysteresis=2.0, cycles=3,
+                 settle_cycles=1, max_time=4*60*60, log=None):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.setpoint = setpoint
+        self.high_duty = high_duty
+        self.low_duty = low_duty
+        self.hysteresis = hysteresis
+        self.cycles = cycles
+        self.settle_cycles = settle_cycles
+        self.max_time = max_time
+
+        self.start_time = None
+        self.output = None
+        self.finished = False
+        self.result = None
+        #Start time of each high phase, and the peak and trough of each full cycle
+        self.cycle_starts = []
+        self.peaks = []
+        self.troughs = []
+        self._extreme = None
+        #Duty integrated over time since the start of the first measured cycle
+        self._duty_area = 0.0
+        self._last_time = None
+
+    def update(self, temperature, now):
+        """Duty cycle to apply for this reading"""
+        if self.finished:
+            return self.low_duty
+        if self.start_time == None:
+            self.start_time = now
+            self.output = self.high_duty if temperature < self.setpoint else self.low_duty
+            self._extreme = temperature
+        elif now - self.start_time > self.max_time:
+            self.log.error("Autotune found no steady oscillation within %.0fs" % self.max_time)
+            self.finished = True
+            return self.low_duty
+
+        if self._last_time != None and len(self.cycle_starts) > self.settle_cycles:
+            self._duty_area += self.output * (now - self._last_time)
+        self._last_time = now
+
+        if self.output == self.high_duty:
+            self._extreme = min(self._extreme, temperature)
+            if temperature > self.setpoint + self.hysteresis:
+                self.troughs.append(self._extreme)
+                self.output = self.low_duty
+                self._extreme = temperature
+        else:
+            self._extreme = max(self._extreme, temperature)
+            if temperature < self.setpoint - self.hysteresis:
+                self.peaks.append(self._extreme)
+                self.output = self.high_duty
+                self._extreme = temperature
+                self._startCycle(now)
+        return self.output
+
+    def _startCycle(self, now):
+        self.cycle_starts.append(now)
+        measured = len(self.cycle_starts) - 1 - self.settle_cycles
+        if measured > 0:
+            self.log.info("Autotune cycle %d/%d: %.0fs, %.1f-%.1fF" % (
+                measured, self.cycles, now - self.cycle_starts[-2], self.troughs[-1], self.peaks[-1]))
+        if measured < self.cycles:
+            return
+        #Cycle k runs from cycle_starts[k] to cycle_starts[k+1]; its trough comes first
+        first = len(self.cycle_starts) - 1 - self.cycles
+        starts = self.cycle_starts[first:]
+        period = (starts[-1] - starts[0]) / self.cycles
+        amplitudes = [(self.peaks[-self.cycles + k] - self.troughs[-self.cycles + k]) / 2.0 for k in range(self.cycles)]
+        amplitude = sum(amplitudes) / len(amplitudes)
+        d = (self.high_duty - self.low_duty) / 2.0
+        ku = 4.0 * d / (math.pi * math.sqrt(max(amplitude ** 2 - self.hysteresis ** 2, 1e-6)))
+        bias = self._duty_area / (starts[-1] - self.cycle_starts[self.settle_cycles])
+        self.result = AutotuneResult(ku, period, amplitude, bias, self.cycles)
+        self.finished = True
+        self.log.info("Autotune done: Ku %.2f Pu %.0fs amplitude %.1fF bias %.1f%%" % (ku, period, amplitude, bias))
+
+class TuningProfiles(object):
+    """Tuned gains per cooker profile, kept in a small JSON file"""
+    def __init__(self, path, log=None):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.path = path
+        self.profiles = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.profiles = json.load(f)
+
+    def names(self):
+        return sorted(self.profiles)
+
+    def get(self, name):
+        """Stored entry for name: Kp, Ki, Kd, bias, rule, ku, pu, tuned_at; KeyError if unknown"""
+        return self.profiles[name]
+
+    def save(self, name, result, rule=DEFAULT_RULE, tuned_at=None):
+        Kp, Ki, Kd = result.gains(rule)
+        if tuned_at == None:
+            tuned_at = time.time()
+        self.profiles[name] = {"Kp": Kp, "Ki": Ki, "Kd": Kd, "bias": result.bias, "rule": rule,
+                               "ku": result.ku, "pu": result.pu, "amplitude": result.amplitude,
+                               "tuned_at": tuned_at}
+        #Write then rename so a power cut never leaves half a file
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.profiles, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.path)
+        self.log.info("Saved %s gains for profile %s to %s" % (rule, name, self.path))
+        return self.profiles[name]
+
+if __name__ == "__main__":
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    import bbq_controller
+    from clocks import ScaledClock
+    from pid_controller import PID
+    from smoker_sim import simulateLoop, recoveryMetrics
+
+    #Relay experiment through the real controller threads, 600x faster than real time
+    speedup = 600.0
+    if len(sys.argv) > 1:
+        speedup = float(sys.argv[1])
+    path = "/tmp/bbq_profiles.json"
+    profiles = TuningProfiles(path, log=log)
+    quiet = logging.getLogger("autotune.controller")
+    quiet.setLevel(logging.ERROR)
+    clock = ScaledClock(speedup)
+    bbq = bbq_controller.BBQController(log=quiet, simulator=True, clock=clock)
+    bbq.start_autotune("sim", profiles)
+    start_time = time.time()
+    bbq.start()
+    while bbq.autotune != None:
+        time.sleep(0.1)
+    bbq.stop()
+    entry = profiles.get("sim")
+    log.info("Tuned in %.0f simulated minutes (%.1fs): Kp %.2f Ki %.4f Kd %.1f" % (
+        (clock.time() - clock.start_time) / 60, time.time() - start_time, entry["Kp"], entry["Ki"], entry["Kd"]))
+
+    #Every rule against the hand tuned gains, from a cold start and after a 3 minute lid opening,
+    #with the integrator bounded and preloaded the way BBQController.set_pid_gains does it
+    result = AutotuneResult(entry["ku"], entry["pu"], entry["amplitude"], entry["bias"], 0)
+    candidates = [("hand tuned", (6, 0.02, 0.0), 20.0, 0.0)]
+    for rule in sorted(TUNING_RULES):
+        Kp, Ki, Kd = result.gains(rule)
+        candidates.append((rule, (Kp, Ki, Kd), bbq.integral_headroom * result.bias / Ki, result.bias / Ki))
+    for name, (Kp, Ki, Kd), windup, preload in candidates:
+        pid = PID(Kp, Ki, Kd, clock=lambda: 0.0)
+        pid.setWindup(windup)
+        pid.ITerm = preload
+        times, temps, duties = simulateLoop(pid, hours=4.0, events={7200: lambda model, now: model.openLid(now, 180)})
+        warm = recoveryMetrics(times[:7200], temps[:7200], 235, 0)
+        lid = recoveryMetrics(times, temps, 235, 7380)
+        log.info("%-19s Kp %5.2f Ki %.4f Kd %5.1f | cold start overshoot %4.1fF settled %5s | lid %4.1fF %5s | last hour %.1f-%.1fF" % (
+            name, Kp, Ki, Kd, warm["overshoot"], warm["recovery_time"], lid["overshoot"], lid["recovery_time"],
+            min(temps[-3600:]), max(temps[-3600:])))
@@ -3,48 +3,113 @@
 import os, time, sys
 import logging
 import threading
-from w1thermsensor import W1ThermSensor
-from fan_controller import PWMFanController
 from pid_controller import PID
+from sensor_manager import SensorManager
+from control_scheduler import SampleScheduler
+from therm_sampler import DEGREES_F
+from clocks import REAL_CLOCK
+import metrics
 
 class BBQController(object):
-    def __init__ (self, log=None):
+    def __init__ (self, log=None, simulator=False, sensors=None, fan=None, clock=REAL_CLOCK, hardware=None, pid=None):
         #Setup Logging
         if log != None:
             self.log = log
         else:
             self.log = logging.getLogger()
+        self.clock = clock
+
+        #hardware (see hal.py) supplies the GPIO and 1-Wire backends; None means the real devices
+        self.hardware = hardware
+
+        #Set simulator flag (No fan, no temp sensor); the model supplies both backends
+        self.simulator = simulator
+        self.sim = None
+        if self.simulator and (sensors == None or fan == None):
+            from smoker_sim import SmokerSimulation
+            self.sim = SmokerSimulation(self.log, self.clock)
+            if sensors == None:
+                sensors = self.sim.sensors
+            if fan == None:
+                fan = self.sim.fan
+
         #Check for vital pieces
-        try:
-            self.log.info("Checking for 1-Wire Thermometer")
-            self.ambient_therm = W1ThermSensor() 
-            #self.meat_therm = W1ThermSensor()
-        except w1thermsensor.NoThermFound:
-            self.log.error("Could not find any thermometers")
-
-        #Set simulator flag (No fan, no temp sensor)
-        self.simulator = False
-        self.status_lock = threading.Lock()
-       
-
-        #Check for connection to internet
-        noInternet = True
-        if noInternet == True:
-            self.local_status = True
+        #First probe found is the pit, any others are meat probes sampled more slowly
+        self.ambient_sample_interval = 1.0
+        self.meat_sample_interval = 10.0
+        if sensors == None:
+            self.sensors = SensorManager(log=self.log, unit=DEGREES_F, clock=self.clock)
+            therm = None
+            if hardware != None:
+                therm = hardware.therm
+            probes = self.sensors.discover(interval=self.meat_sample_interval, therm=therm)
+        else:
+            self.sensors = sensors
+            probes = list(self.sensors.probes)
+            for probe in probes:
+                self.sensors.setInterval(probe.id, self.meat_sample_interval)
+        if not probes:
+            raise RuntimeError("BBQController needs at least one thermometer")
+        self.meat_probe = None
+        self.ambient_probe = probes[0]
+        self.ambient_probe.name = "ambient"
+        self.sensors.setInterval(self.ambient_probe.id, self.ambient_sample_interval)
+        if len(probes) > 1:
+            self.meat_probe = probes[1]
+            self.meat_probe.name = "meat"
+        self.ambient_therm = self.ambient_probe.sensor
+        self.ambient_sampler = self.ambient_probe.sampler
+
+
+        #Status stays local until an uploader has reached the remote logging endpoint
+        self.local_status = True
+        self.uploader = None
 
         #Set Alg. Variables
         self.temp_loop_time = 2.0
         self.p_gain = 6 
         self.i_gain = 0.02
         self.d_gain = 0.0
-        self.pid = PID(self.p_gain, self.i_gain, self.d_gain)
-        
-        self.fan = PWMFanController(self.log)
+        #pid may be any PID compatible controller (e.g. scheduled_pid.ScheduledPID); it measures
+        #dt on our monotonic clock so wall clock steps never reach it
+        if pid == None:
+            pid = PID(self.p_gain, self.i_gain, self.d_gain, clock=self.clock.monotonic)
+        else:
+            pid.clock = self.clock.monotonic
+            pid.last_time = pid.current_time = self.clock.monotonic()
+        self.pid = pid
+        #A relay autotune experiment, when running, drives the fan instead of the PID
+        self.autotune = None
+        self._autotune_profile = None
+        #With a known steady duty (bias) the integrator may carry this multiple of it
+        self.integral_headroom = 1.25
+        #Learned steady state duty added to the PID output, and dithering below min_duty_cycle
+        self.feed_forward = None
+        self.feed_forward_trim = 1.0
+        self.dither = None
+
+        if fan == None:
+            from fan_controller import PWMFanController
+            gpio = None
+            if hardware != None:
+                gpio = hardware.gpio
+            fan = PWMFanController(self.log, gpio=gpio, clock=self.clock)
+        self.fan = fan
 
         #Setup Default Values
+        #enable_logging prints a text line per sample; start_cook_log records them in binary
         self.enable_logging = False
+        self.cook_log = None
         self.enable_pid = False
-        self.status = {}
+        #status is an immutable StatusSnapshot, replaced as a whole by update_status.
+        #Readers take the reference once and never lock; None until the first sample.
+        #history needs numpy, so it is built by the first update_status rather than
+        #here, keeping that import off the path to the first fan command
+        self.history = None
+        self.status = None
+        self.status_sequence = 0
+        #(p_term, i_term, d_term, output) of the last PID step, published the same way
+        self.pid_terms = (0.0, 0.0, 0.0, 0.0)
 
         self.target_ambient_temp = 235
         self.max_duty_cycle = 100
@@ -54,20 +119,29 @@ class BBQController(object):
         self.run_id = None
         self.pid.SetPoint = self.target_ambient_temp
 
-        #Setup External Values
+        #Setup External Values; serializes setters only, readers never take it
         self.value_lock = threading.Lock()
 
         #Setup Status Thread
         self.status_thread = None
         self.status_sleep_time = 1
 
-        #Setup PID Controll Thread
-        self.pid_thread = None
-        self.pid_sleep_time = 1
+        #Setup PID Controll Thread; one PID update per fresh ambient reading
+        self.pid_scheduler = SampleScheduler(self.ambient_sampler, self.run_pid, self.ambient_sample_interval, log=self.log, clock=self.clock)
+
+        #Hot path instrumentation; no-ops unless metrics are enabled
+        self._status_time = metrics.REGISTRY.histogram("bbq_update_status_seconds", "Time to build and publish one status snapshot")
+        self._pid_time = metrics.REGISTRY.histogram("bbq_pid_step_seconds", "Time for one PID update and fan write")
+        self._pid_sample_age = metrics.REGISTRY.histogram("bbq_pid_sample_age_seconds", "Age of the reading when the PID acted on it")
+        self._pid_output = metrics.REGISTRY.gauge("bbq_pid_output", "Last PID output")
 
         self.log.info("Initialization complete")
 
     def start(self):
+        #Sensors and PID first; status and logging can come up behind them
+        if not self.sensors.scheduler_thread:
+            self.sensors.start()
+        self.pid_scheduler.start()
         if self.status_thread:
             self.log.warn("Status thread already started; skipping")
         else:
@@ -75,13 +149,6 @@ class BBQController(object):
             self.status_thread = threading.Thread(target=self.status_logger)
             self.status_thread.daemon = True
             self.status_thread.start()
-        if self.pid_thread:
-            self.log.warn("Temperature and PID thread already started; skipping")
-        else:
-            self.pid_enable = True
-            self.pid_thread = threading.Thread(target=self.run_pid)
-            self.pid_thread.daemon = True
-            self.pid_thread.start()
 
     def stop(self):
         if not self.status_thread:
@@ -90,18 +157,99 @@ class BBQController(object):
             self.status_enable = False
             self.status_thread.join(2)
             self.status_thread = None
-        if not self.pid_thread:
-            self.log.warn("Temp and PID thread already stopped; skipping")
-        else:
-            self.pid_enable = False
-            self.pid_thread.join(2)
-            self.pid_thread = None
+            if self.cook_log != None:
+                self.cook_log.flush(sync=True)
+        self.pid_scheduler.stop()
+        if self.sensors.scheduler_thread:
+            self.sensors.stop()
 
     def set_target_ambient_temp(self, val):
-        with self.value_lock.acquire():
+        with self.value_lock:
             self.target_ambient_temp = val
             self.pid.SetPoint = val
 
+    def set_pid_gains(self, kp, ki, kd, bias=None):
+        """Applies new gains
+
+        bias, the expected steady duty cycle, preloads the integrator and
+        bounds it at integral_headroom times the bias; without it the
+        integrator may carry the fan to full duty on its own.
+        """
+        with self.value_lock:
+            pid = self.pid
+            pid.setKp(kp)
+            pid.setKi(ki)
+            pid.setKd(kd)
+            if ki > 0:
+                #A ScheduledPID away from its near band integrates at that band's scaled Ki
+                if pid.Ki > 0:
+                    ki_active = float(pid.Ki)
+                else:
+                    ki_active = float(ki)
+                if bias != None:
+                    pid.setWindup(self.integral_headroom * bias / ki_active)
+                    pid.ITerm = bias / ki_active
+                else:
+                    pid.setWindup(self.max_duty_cycle / ki_active)
+            pid.last_error = 0.0
+            pid.last_time = self.clock.monotonic()
+        self.log.info("PID gains set to Kp %.3f Ki %.5f Kd %.3f" % (kp, ki, kd))
+
+    def load_profile(self, profiles, name):
+        """Applies the gains stored for name in an autotune.TuningProfiles"""
+        entry = profiles.get(name)
+        self.set_pid_gains(entry["Kp"], entry["Ki"], entry["Kd"], entry.get("bias"))
+
+    def start_autotune(self, profile=None, profiles=None, rule=None, **tuner_args):
+        """Replaces the PID with a relay experiment at the current target
+
+        When it finishes the gains from rule (autotune.DEFAULT_RULE if None)
+        are applied and, given a profile name and an autotune.TuningProfiles,
+        saved. tuner_args go to autotune.RelayAutotune.
+        """
+        from autotune import RelayAutotune, DEFAULT_RULE
+        if rule == None:
+            rule = DEFAULT_RULE
+        self._autotune_profile = (profile, profiles, rule)
+        self.autotune = RelayAutotune(self.target_ambient_temp, high_duty=self.max_duty_cycle, log=self.log, **tuner_args)
+        self.log.info("Autotune started at %s" % str(self.target_ambient_temp))
+
+    def stop_autotune(self):
+        if self.autotune != None:
+            self.log.info("Autotune stopped")
+        self.autotune = None
+        self.pid.last_time = self.clock.monotonic()
+
+    def _finish_autotune(self, autotune):
+        profile, profiles, rule = self._autotune_profile
+        result = autotune.result
+        if result != None:
+            kp, ki, kd = result.gains(rule)
+            self.set_pid_gains(kp, ki, kd, result.bias)
+            if profile != None and profiles != None:
+                profiles.save(profile, result, rule)
+        self.stop_autotune()
+
+    def start_feed_forward(self, trim=0.5, dither_period=20.0, **model_args):
+        """Adds the duty a learned cooker model predicts for the target to the PID output
+
+        Once the model (feed_forward.CookerModel, built with model_args) is
+        confident, the PID output is scaled by trim and only corrects what
+        the model gets wrong. With dither_period, outputs below
+        min_duty_cycle are burst dithered instead of dropped to zero.
+        """
+        from feed_forward import CookerModel, DutyDither
+        self.feed_forward_trim = trim
+        self.dither = None
+        if dither_period:
+            self.dither = DutyDither(self.min_duty_cycle, self.max_duty_cycle, dither_period)
+        self.feed_forward = CookerModel(log=self.log, **model_args)
+        self.log.info("Feed forward started")
+
+    def stop_feed_forward(self):
+        self.feed_forward = None
+        self.dither = None
+
     def convertPIDOutput(self, x):
         if x < 0:
             return 0
@@ -112,49 +260,154 @@ class BBQController(object):
         else:
             return int(round(x))
 
-    def log_data(self):
-        self.log.info("Current Temp: %f F  Target Temp: %f  Tach Speed: %f" % (self.status["ambient_temp"], self.status["target_ambient_temp"], self.status["fan_speed"]))
+    def log_data(self, status=None):
+        if status == None:
+            status = self.status
+        self.log.info("Current Temp: %f F  Target Temp: %f  Tach Speed: %f" % (status.ambient_temp, status.target_ambient_temp, status.fan_speed))
+
+    def start_cook_log(self, path, **writer_args):
+        from cook_log import CookLogWriter
+        if self.cook_log != None:
+            self.stop_cook_log()
+        self.cook_log = CookLogWriter(path, log=self.log, clock=self.clock, **writer_args)
+        self.log.info("Recording cook log to %s" % path)
+
+    def stop_cook_log(self):
+        cook_log = self.cook_log
+        self.cook_log = None
+        if cook_log != None:
+            cook_log.close()
+
+    def start_uploader(self, url, spool_path, **uploader_args):
+        """Spools every status sample to spool_path and sends them to url in the background"""
+        from uploader import StatusUploader
+        if self.uploader != None:
+            self.stop_uploader()
+        self.uploader = StatusUploader(url, spool_path, log=self.log, clock=self.clock, **uploader_args)
+        self.uploader.start()
 
-    def run_pid(self):
-        while self.pid_enable:
+    def stop_uploader(self):
+        uploader = self.uploader
+        self.uploader = None
+        self.local_status = True
+        if uploader != None:
+            uploader.stop()
+
+    def log_status(self, status):
+        #A full SD card or a broken spool must not stop the status thread
+        cook_log = self.cook_log
+        if cook_log != None:
+            try:
+                cook_log.write(status.sample())
+            except Exception as e:
+                self.log.error("Could not write cook log: %s" % str(e))
+        uploader = self.uploader
+        if uploader != None:
             try:
-                self.status_lock.acquire()
-                self.pid.update(self.status["ambient_temp"])
-                self.fan.setDutyCycle(self.convertPIDOutput(self.pid.output))
-            finally:
-                self.status_lock.release()
-            time.sleep(self.pid_sleep_time)
+                uploader.enqueue(status.sample())
+            except Exception as e:
+                self.log.error("Could not spool status for upload: %s" % str(e))
+            self.local_status = not uploader.connected
+        if self.enable_logging:
+            self.log_data(status)
+
+    def run_pid(self, reading):
+        perf_start = metrics.PERF_CLOCK()
+        self._pid_sample_age.observe(self.clock.monotonic() - reading.monotonic)
+        autotune = self.autotune
+        if autotune != None:
+            #The relay period is measured on the monotonic stamps; a wall clock step would corrupt Pu
+            self.fan.setDutyCycle(autotune.update(reading.temperature, reading.monotonic))
+            if autotune.finished:
+                self._finish_autotune(autotune)
+        else:
+            pid = self.pid
+            pid.update(reading.temperature)
+            output = pid.output
+            feed_forward = self.feed_forward
+            if feed_forward != None:
+                #The fan has run at its current duty since the previous reading
+                feed_forward.update(reading.temperature, self.fan.getDutyCycle(), reading.monotonic)
+                steady_duty = feed_forward.steadyStateDuty(pid.SetPoint)
+                if steady_duty != None:
+                    output = self.feed_forward_trim * output + max(0.0, min(self.max_duty_cycle, steady_duty))
+            self.pid_terms = (pid.PTerm, pid.Ki * pid.ITerm, pid.Kd * pid.DTerm, output)
+            dither = self.dither
+            if dither != None:
+                self.fan.setDutyCycle(dither.convert(output, reading.monotonic))
+            else:
+                self.fan.setDutyCycle(self.convertPIDOutput(output))
+            self._pid_output.set(output)
+        self._pid_time.observeSince(perf_start)
 
     def update_status(self):
-        try:
-            self.status_lock.acquire()
-            self.status = {"timestamp": time.time(),
-                           "ambient_temp": self.ambient_therm.get_temperature(W1ThermSensor.DEGREES_F),
-                           "meat_temp": 0.0, 
-                           "fan_duty_cycle": self.fan.getDutyCycle(),
-                           "max_ambient_temp": self.max_ambient_temp,
-                           "min_ambient_temp": self.min_ambient_temp,
-                           "target_ambient_temp": self.target_ambient_temp,
-                           "fan_speed": self.get_tach()
-                          }
-        finally:
-            self.status_lock.release()
+        """Builds a new StatusSnapshot and publishes it with one reference swap
+
+        Only the status thread calls this. Everything it reads is itself a
+        published reference (sampler readings, pid_terms) or a plain attribute,
+        so no lock is held while the fan and tachometer are queried.
+        """
+        from telemetry import TelemetryHistory, StatusSnapshot
+        perf_start = metrics.PERF_CLOCK()
+        reading = self.ambient_sampler.latest()
+        if reading == None:
+            self.log.debug("No temperature reading available yet")
+            return None
+        if self.history == None:
+            self.history = TelemetryHistory()
+        meat_temp = 0.0
+        if self.meat_probe:
+            meat_reading = self.meat_probe.latest()
+            if meat_reading != None:
+                meat_temp = meat_reading.temperature
+        p_term, i_term, d_term, output = self.pid_terms
+        status = StatusSnapshot(self.clock.time(),
+                                reading.timestamp,
+                                reading.temperature,
+                                meat_temp,
+                                self.fan.getDutyCycle(),
+                                self.get_tach(),
+                                self.target_ambient_temp,
+                                self.max_ambient_temp,
+                                self.min_ambient_temp,
+                                p_term,
+                                i_term,
+                                d_term,
+                                output,
+                                self.status_sequence + 1)
+        self.history.append(*status.sample())
+        self.status_sequence = status.sequence
+        self.status = status
+        self._status_time.observeSince(perf_start)
+        return status
+
+    def get_status(self, last_sequence=0):
+        """Newest snapshot if it is newer than last_sequence, otherwise None"""
+        status = self.status
+        if status == None or status.sequence <= last_sequence:
+            return None
+        return status
 
     def status_logger(self):
         while self.status_enable:
-            self.update_status()
             try:
-                self.status_lock.acquire()
-                if self.enable_logging:
-                    self.log_data()
-            finally:
-                self.status_lock.release()
-            time.sleep(self.status_sleep_time)
+                status = self.update_status()
+            except Exception as e:
+                self.log.error("Status update failed: %s" % str(e))
+                status = None
+            if status != None:
+                self.log_status(status)
+            self.clock.sleep(self.status_sleep_time)
 
     def get_tach(self):
-        #TODO Implement Later
-        return 0
+        return self.fan.getTachSpeed()
 
     def get_ambient_temperature(self):
-        return self.ambient_therm.get_temperature(W1ThermSensor.DEGREES_F)
+        reading = self.ambient_sampler.latest()
+        if reading == None:
+            return self.ambient_therm.get_temperature(DEGREES_F)
+        return reading.temperature
+
+    def get_probe_temperatures(self):
+        return dict((sensor_id, reading.temperature) for sensor_id, reading in self.sensors.read_all().items() if reading != None)
     
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""Fast start entry point: the fan is under PID control before anything else
+
+Only what the control loop needs is imported and built before the first
+fan command: the hardware backends, the probes, the PID and the fan. The
+display, wifi check, status server, cook log, uploader and metrics logger
+are brought up afterwards on a background thread, so slow imports (PIL,
+numpy, wifi) never delay actuation. Startup milestones are measured from
+process start and logged, and exported as bbq_startup_seconds gauges.
+"""
+
+import time
+IMPORT_TIME = time.time()
+
+import os, sys
+import logging
+import threading
+import argparse
+
+import metrics
+
+def processStartTime():
+    """Wall clock time this process was started, from /proc; None where there is no /proc"""
+    try:
+        with open("/proc/self/stat") as f:
+            stat = f.read()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        ticks = os.sysconf("SC_CLK_TCK")
+    except (IOError, OSError, ValueError, AttributeError):
+        return None
+    #starttime is field 22; the command name in field 2 may contain spaces, so count from its ")"
+    start_ticks = float(stat[stat.rindex(")") + 2:].split()[19])
+    return time.time() - (uptime - start_ticks / ticks)
+
+class StartupTimer(object):
+    """Named startup milestones in seconds since start_time
+
+    start_time defaults to the process start time, so interpreter start up
+    and imports are counted, or the import of this module where /proc is
+    not available. mark() may be called from any thread.
+    """
+    def __init__(self, start_time=None):
+        if start_time == None:
+            start_time = processStartTime()
+        if start_time == None:
+            start_time = IMPORT_TIME
+        self.start_time = start_time
+        self.marks = []
+
+    def mark(self, name):
+        elapsed = time.time() - self.start_time
+        self.marks.append((name, elapsed))
+        return elapsed
+
+    def elapsed(self, name):
+        for mark_name, elapsed in self.marks:
+            if mark_name == name:
+                return elapsed
+        return None
+
+    def report(self, log, registry=metrics.REGISTRY):
+        for name, elapsed in self.marks:
+            log.info("Startup %-16s %.3fs" % (name, elapsed))
+            registry.gauge("bbq_startup_seconds", "Seconds from process start to each startup milestone", {"phase": name}).set(elapsed)
+
+class FastStart(object):
+    """Starts a BBQController first and everything around it in the background
+
+    hardware is a hal.Hardware (None means hal.defaultHardware(), unless
+    simulator is set). The optional backends are only imported by the
+    background thread, after the first fan command or after defer_timeout
+    seconds without one. A backend that fails to come up is logged and
+    skipped; it never stops the control loop.
+    """
+    def __init__(self, log=None, hardware=None, simulator=False, display=True, wifi=False,
+                 status_port=None, status_host="127.0.0.1", status_writes=False, cook_log=None, upload_url=None, spool_path=None,
+                 metrics_interval=None, defer_timeout=10.0, pid=None, feed_forward=False, timer=None):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        if timer == None:
+            timer = StartupTimer()
+        self.timer = timer
+        self.hardware = hardware
+        self.simulator = simulator
+        self.display_enabled = display
+        self.wifi = wifi
+        self.status_port = status_port
+        self.status_host = status_host
+        self.status_writes = status_writes
+        self.cook_log = cook_log
+        self.upload_url = upload_url
+        self.spool_path = spool_path
+        self.metrics_interval = metrics_interval
+        self.defer_timeout = defer_timeout
+        self.pid = pid
+        self.feed_forward = feed_forward
+
+        self.bbq = None
+        self.display = None
+        self.status_server = None
+        self.metrics_logger = None
+        self.first_actuation = threading.Event()
+        self._pid_step = None
+        self._stop_event = threading.Event()
+        self.background_thread = None
+
+    def start(self):
+        if self.background_thread:
+            self.log.warn("Background thread already started; skipping")
+            return
+        import bbq_controller
+        if self.hardware == None and not self.simulator:
+            import hal
+            self.hardware = hal.defaultHardware()
+        self.timer.mark("imports")
+        self.bbq = bbq_controller.BBQController(log=self.log, simulator=self.simulator, hardware=self.hardware, pid=self.pid)
+        if self.feed_forward:
+            self.bbq.start_feed_forward()
+        self.timer.mark("controller")
+        #Time the first PID step's fan command, then put the plain step back
+        self._pid_step = self.bbq.pid_scheduler.step
+        self.bbq.pid_scheduler.step = self._firstStep
+        self.bbq.start()
+        self.timer.mark("control_started")
+
+        self._stop_event.clear()
+        self.background_thread = threading.Thread(target=self.run_background)
+        self.background_thread.daemon = True
+        self.background_thread.start()
+
+    def stop(self):
+        if not self.background_thread:
+            self.log.warn("Background thread already stopped; skipping")
+            return
+        self._stop_event.set()
+        self.background_thread.join(2)
+        self.background_thread = None
+        if self.metrics_logger != None:
+            self.metrics_logger.stop()
+        if self.status_server != None:
+            self.status_server.stop()
+        self.bbq.stop()
+        self.bbq.stop_uploader()
+        self.bbq.stop_cook_log()
+        if self.display != None:
+            self.display.display.close()
+
+    def _firstStep(self, reading):
+        self._pid_step(reading)
+        self.bbq.pid_scheduler.step = self._pid_step
+        elapsed = self.timer.mark("first_actuation")
+        self.log.info("First fan command %.3fs after start: %.1fF -> %d%% duty" % (
+            elapsed, reading.temperature, self.bbq.fan.getDutyCycle()))
+        self.first_actuation.set()
+
+    def _bringUp(self, name, func):
+        try:
+            func()
+            self.timer.mark(name)
+        except Exception as e:
+            self.log.error("Could not start %s: %s" % (name, str(e)))
+
+    def _startDisplay(self):
+        from OLEDDisplay import OLEDDisplay
+        from BBQDisplay import BBQDisplay
+        if self.hardware != None:
+            disp = self.hardware.open_display()
+        else:
+            import hal
+            disp = hal.openFakeDisplay()
+        self.display = BBQDisplay(log=self.log, display=OLEDDisplay(log=self.log, disp=disp))
+        self._refreshDisplay()
+
+    def _refreshDisplay(self):
+        self.display.updateHeader()
+        self.display.refreshMainMenu()
+        self.display.updateBody()
+
+    def _startStatusServer(self):
+        from status_server import StatusServer
+        self.status_server = StatusServer(self.bbq, host=self.status_host, port=self.status_port,
+                                          allow_writes=self.status_writes, log=self.log)
+        self.status_server.start()
+
+    def _startMetricsLogger(self):
+        self.metrics_logger = metrics.MetricsLogger(interval=self.metrics_interval, log=self.log)
+        self.metrics_logger.start()
+
+    def run_background(self):
+        if not self.first_actuation.wait(self.defer_timeout):
+            self.log.warn("No fan command after %.1fs; starting the rest anyway" % self.defer_timeout)
+        if self._stop_event.is_set():
+            return
+        if self.cook_log != None:
+            self._bringUp("cook_log", lambda: self.bbq.start_cook_log(self.cook_log))
+        if self.upload_url != None:
+            self._bringUp("uploader", lambda: self.bbq.start_uploader(self.upload_url, self.spool_path))
+        if self.status_port != None:
+            self._bringUp("status_server", self._startStatusServer)
+        if self.metrics_interval != None:
+            self._bringUp("metrics_logger", self._startMetricsLogger)
+        if self.display_enabled:
+            self._bringUp("display", self._startDisplay)
+        if self.wifi and self.display != None:
+            self._bringUp("wifi", self.display.checkWifiState)
+        self.timer.report(self.log)
+
+        while self.display != None and not self._stop_event.wait(1.0):
+            try:
+                self._refreshDisplay()
+            except Exception as e:
+                self.log.error("Display refresh failed: %s" % str(e))
+
+if __name__ == "__main__":
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Start the controller with the fan path first and everything else in the background")
+    parser.add_argument("-s", "--simulator", action="store_true", help="run against the smoker model instead of hardware")
+    parser.add_argument("--no-display", action="store_true", help="do not start the OLED display")
+    parser.add_argument("--wifi", action="store_true", help="scan for wifi once the display is up")
+    parser.add_argument("-p", "--port", type=int, help="start the status server on this port")
+    parser.add_argument("--host", default="127.0.0.1", help="status server address; 0.0.0.0 serves the LAN")
+    parser.add_argument("--allow-target", action="store_true", help="let POST /target on the status server change the pit target")
+    parser.add_argument("--cook-log", help="record a binary cook log to this file")
+    parser.add_argument("--upload", help="status upload URL; needs --spool")
+    parser.add_argument("--spool", default="/tmp/bbq_upload.spool", help="spool file for --upload")
+    parser.add_argument("--metrics", type=float, metavar="SECONDS", help="enable metrics and log them every SECONDS")
+    parser.add_argument("--scheduled-pid", action="store_true", help="use the gain scheduled PID with disturbance detection")
+    parser.add_argument("--feed-forward", action="store_true", help="add a learned steady state duty to the PID and dither below the fan's minimum duty")
+    parser.add_argument("-d", "--duration", type=float, help="stop after this many seconds")
+    args = parser.parse_args()
+
+    if args.metrics != None:
+        metrics.enable()
+    pid = None
+    if args.scheduled_pid:
+        from scheduled_pid import ScheduledPID
+        pid = ScheduledPID(log=log)
+    app = FastStart(log=log, simulator=args.simulator, display=not args.no_display, wifi=args.wifi,
+                    status_port=args.port, status_host=args.host, status_writes=args.allow_target,
+                    cook_log=args.cook_log, upload_url=args.upload,
+                    spool_path=args.spool, metrics_interval=args.metrics, pid=pid,
+                    feed_forward=args.feed_forward)
+    app.start()
+    try:
+        if args.duration != None:
+            time.sleep(args.duration)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    app.stop()
+    app.bbq.fan.setDutyCycle(0)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import json
+import socket
+import platform
+import resource
+import argparse
+import subprocess
+import numpy as np
+
+from clocks import ScaledClock
+import hal
+
+def _percentiles(values, scale=1.0):
+    values = np.asarray(values, dtype=float) * scale
+    if len(values) == 0:
+        return {"count": 0}
+    return {"count": int(len(values)),
+            "mean": float(values.mean()),
+            "p50": float(np.percentile(values, 50)),
+            "p90": float(np.percentile(values, 90)),
+            "p99": float(np.percentile(values, 99)),
+            "max": float(values.max())}
+
+def _cpuTime():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def _maxRSS():
+    #ru_maxrss is KB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss = rss // 1024
+    return int(rss)
+
+def _timeOp(func, runs):
+    start_time = time.time()
+    for x in range(runs):
+        func()
+    return (time.time() - start_time) * 1e9 / runs
+
+def benchPID(runs=100000):
+    from pid_controller import PID
+    pid = PID(6, 0.02, 0.0, clock=lambda: 0.0)
+    pid.SetPoint = 235
+    feedback = [220.0 + (x % 30) for x in range(1024)]
+    state = {"x": 0}
+    def step():
+        x = state["x"] = state["x"] + 1
+        pid.update(feedback[x & 1023], 1.0)
+    samples = np.array(feedback * 10)
+    start_time = time.time()
+    pid.update_many(samples, dt=1.0)
+    batch_ns = (time.time() - start_time) * 1e9 / len(samples)
+    return {"update_ns_per_op": _timeOp(step, runs),
+            "update_many_ns_per_sample": batch_ns}
+
+def benchFan(runs=20000):
+    from fan_controller import PWMFanController
+    log = logging.getLogger("benchmark.fan")
+    gpio = hal.FakeGPIO()
+    fan = PWMFanController(log, gpio=gpio)
+    duty = [25 + (x % 50) for x in range(1024)]
+    state = {"x": 0}
+    def step():
+        x = state["x"] = state["x"] + 1
+        fan.setDutyCycle(duty[(x >> 3) & 1023])
+    result = {"set_duty_cycle_ns_per_op": _timeOp(step, runs)}
+    result.update(fan.getOutputStats())
+    result["tach_callback_ns_per_op"] = _timeOp(lambda: gpio.edge(PWMFanController.TACH_PIN), runs)
+    return result
+
+def benchDisplay(frames=500):
+    from OLEDDisplay import OLEDDisplay
+    display = OLEDDisplay(log=logging.getLogger("benchmark.display"), disp=hal.openFakeDisplay())
+    #Drive the compositor by hand so every frame is timed on this thread
+    display.compositor.stop()
+    compositor = display.compositor
+    compositor.composite(force=True)
+    disp = display.disp
+    frame_times = []
+    frame_bytes = []
+    for x in range(frames):
+        display.writeHeader("12:%02d:%02d Good" % ((x // 60) % 60, x % 60))
+        display.writeMenu(["  Current Temp: %.1f" % (225 + (x % 20) * 0.1),
+                           "  Target Temp: 235",
+                           "  Enable: On",
+                           "  Options"])
+        before = getattr(disp, "data_bytes", 0)
+        start_time = time.time()
+        compositor.composite(force=True)
+        frame_times.append(time.time() - start_time)
+        frame_bytes.append(getattr(disp, "data_bytes", 0) - before)
+    return {"frame_time_us": _percentiles(frame_times, 1e6),
+            "bytes_per_frame": _percentiles(frame_bytes),
+            "renderer": display.renderer.getStats()}
+
+def benchController(seconds=10.0, speedup=20.0):
+    """Runs the threaded controller against the smoker model; times are real seconds"""
+    import bbq_controller
+    clock = ScaledClock(speedup)
+    bbq = bbq_controller.BBQController(log=logging.getLogger("benchmark.controller"), simulator=True, clock=clock)
+    latencies = []
+    step_times = []
+    run_pid = bbq.run_pid
+    def timed_run_pid(reading):
+        run_pid(reading)
+        latencies.append((clock.monotonic() - reading.monotonic) / speedup)
+        step_times.append(time.time())
+    bbq.pid_scheduler.step = timed_run_pid
+    cpu_start = _cpuTime()
+    start_time = time.time()
+    bbq.start()
+    time.sleep(seconds)
+    bbq.stop()
+    elapsed = time.time() - start_time
+    period = bbq.ambient_sample_interval / speedup
+    jitter = np.abs(np.diff(step_times) - period)
+    return {"speedup": speedup,
+            "sensor_to_actuation_ms": _percentiles(latencies, 1e3),
+            "loop_jitter_ms": _percentiles(jitter, 1e3),
+            "scheduler": bbq.pid_scheduler.getStats(),
+            "cpu_percent": 100.0 * (_cpuTime() - cpu_start) / elapsed}
+
+def _gitRevision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.STDOUT).decode("ascii").strip()
+    except Exception:
+        return None
+
+def runAll(quick=False):
+    scale = 10 if quick else 1
+    results = {"meta": {"time": time.time(),
+                        "host": socket.gethostname(),
+                        "machine": platform.machine(),
+                        "python": platform.python_version(),
+                        "revision": _gitRevision()}}
+    cpu_start = _cpuTime()
+    results["pid"] = benchPID(100000 // scale)
+    results["fan"] = benchFan(20000 // scale)
+    results["display"] = benchDisplay(500 // scale)
+    results["controller"] = benchController(10.0 / scale)
+    results["process"] = {"cpu_seconds": _cpuTime() - cpu_start,
+                          "max_rss_kb": _maxRSS()}
+    return results
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def compare(old, new, threshold=0.1):
+    """Lines for every metric that moved by more than threshold; meta is ignored"""
+    old_flat = _flatten(dict((k, v) for k, v in old.items() if k != "meta"))
+    new_flat = _flatten(dict((k, v) for k, v in new.items() if k != "meta"))
+    lines = []
+    for name in sorted(set(old_flat) & set(new_flat)):
+        before, after = old_flat[name], new_flat[name]
+        if before == 0:
+            continue
+        change = (after - before) / abs(before)
+        if abs(change) > threshold:
+            lines.append("%-50s %12.3f -> %12.3f (%+.0f%%)" % (name, before, after, change * 100))
+    return lines
+
+if __name__ == "__main__":
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+    #Keep the components quiet; only the results matter here
+    logging.getLogger("benchmark").setLevel(logging.CRITICAL)
+
+    parser = argparse.ArgumentParser(description="Control loop, PID, fan and display benchmarks")
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    parser.add_argument("-c", "--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("-t", "--threshold", type=float, default=0.1, help="relative change reported by --compare")
+    parser.add_argument("-q", "--quick", action="store_true", help="10x shorter runs")
+    args = parser.parse_args()
+
+    results = runAll(args.quick)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        log.info("Wrote results to %s" % args.output)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        lines = compare(old, results, args.threshold)
+        log.info("%d metrics changed by more than %.0f%% against %s" % (len(lines), args.threshold * 100, args.compare))
+        for line in lines:
+            print(line)
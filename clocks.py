@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+import os, time, sys
+
+# For measuring intervals; wall clock steps must not show up as negative dt
+MONOTONIC_CLOCK = getattr(time, "monotonic", time.time)
+
+class RealClock(object):
+    """Wall clock used by the controller threads on real hardware
+
+    time() is for timestamps; schedules and intervals use monotonic(), which
+    an NTP or RTC step cannot move.
+    """
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return MONOTONIC_CLOCK()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def timeout(self, seconds):
+        """Converts a clock duration into real seconds for Event/Condition waits"""
+        return seconds
+
+REAL_CLOCK = RealClock()
+
+class ScaledClock(RealClock):
+    """Clock that runs speedup times faster than real time
+
+    Sleeps and wait timeouts shrink by the same factor, so the normal threaded
+    code paths can run a long cook in a fraction of the time. monotonic() is
+    scaled the same way, from the same start_time.
+    """
+    def __init__(self, speedup=1.0, start_time=None):
+        self.speedup = float(speedup)
+        self.real_start = time.time()
+        self.monotonic_start = MONOTONIC_CLOCK()
+        if start_time == None:
+            start_time = self.real_start
+        self.start_time = start_time
+
+    def time(self):
+        return self.start_time + (time.time() - self.real_start) * self.speedup
+
+    def monotonic(self):
+        return self.start_time + (MONOTONIC_CLOCK() - self.monotonic_start) * self.speedup
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds / self.speedup)
+
+    def timeout(self, seconds):
+        if seconds == None:
+            return None
+        return seconds / self.speedup
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import threading
+
+from clocks import REAL_CLOCK
+
+class SampleScheduler(object):
+    """Runs a control step exactly once for every fresh sensor reading
+
+    The step is triggered by the sampler publishing a new reading instead of a
+    fixed sleep, so the control loop runs at the sensor's real rate and never
+    reuses a stale temperature. A reading that arrives later than period plus
+    deadline_slack after the previous one counts as a missed deadline.
+    """
+    def __init__(self, sampler, step, period, log=None, deadline_slack=0.5, clock=REAL_CLOCK):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.clock = clock
+        self.sampler = sampler
+        self.step = step
+        self.period = period
+        self.deadline_slack = deadline_slack
+
+        self.step_count = 0
+        self.missed_deadlines = 0
+        self.skipped_samples = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+        self._enable = False
+        self.scheduler_thread = None
+
+    def start(self):
+        if self.scheduler_thread:
+            self.log.warn("Control scheduler thread already started; skipping")
+            return
+        self._enable = True
+        self.scheduler_thread = threading.Thread(target=self.run_scheduler)
+        self.scheduler_thread.daemon = True
+        self.scheduler_thread.start()
+
+    def stop(self):
+        if not self.scheduler_thread:
+            self.log.warn("Control scheduler thread already stopped; skipping")
+            return
+        self._enable = False
+        self.sampler.wake()
+        self.scheduler_thread.join(2)
+        self.scheduler_thread = None
+
+    def _deadline(self):
+        return self.period + self.deadline_slack * self.period
+
+    def run_scheduler(self):
+        last_sequence = 0
+        last_sample_time = None
+        deadline_counted = False
+        reading = self.sampler.latest()
+        if reading != None:
+            # Only act on readings published after we started
+            last_sequence = reading.sequence
+            last_sample_time = reading.monotonic
+        while self._enable:
+            reading = self.sampler.wait_for_reading(last_sequence, timeout=self._deadline())
+            if not self._enable:
+                break
+            if reading == None:
+                if not deadline_counted:
+                    self.missed_deadlines += 1
+                    deadline_counted = True
+                    self.log.warn("No new temperature within %.2fs; %d deadlines missed" % (self._deadline(), self.missed_deadlines))
+                continue
+            if last_sequence and reading.sequence > last_sequence + 1:
+                self.skipped_samples += reading.sequence - last_sequence - 1
+            if not deadline_counted and last_sample_time != None and reading.monotonic - last_sample_time > self._deadline():
+                self.missed_deadlines += 1
+            deadline_counted = False
+            last_sequence = reading.sequence
+            last_sample_time = reading.monotonic
+            try:
+                self.step(reading)
+            except Exception as e:
+                self.log.error("Control step failed: %s" % str(e))
+            self.step_count += 1
+            # Sensor to actuation latency for this sample, on the monotonic clock like the deadlines
+            self.last_latency = self.clock.monotonic() - reading.monotonic
+            if self.last_latency > self.max_latency:
+                self.max_latency = self.last_latency
+
+    def getStats(self):
+        return {"steps": self.step_count,
+                "missed_deadlines": self.missed_deadlines,
+                "skipped_samples": self.skipped_samples,
+                "last_latency": self.last_latency,
+                "max_latency": self.max_latency}
+
+if __name__ == "__main__":
+
+    from hal import FakeThermometer
+    from therm_sampler import ThermSampler
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    sampler = ThermSampler(FakeThermometer("28-000000000001", conversion_time=0.1), interval=0.2, log=log)
+    def step(reading):
+        log.info("Control step for %s" % str(reading))
+    scheduler = SampleScheduler(sampler, step, 0.2, log=log)
+    sampler.start()
+    scheduler.start()
+    time.sleep(2)
+    scheduler.stop()
+    sampler.stop()
+    log.info("Scheduler stats %s" % str(scheduler.getStats()))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import struct
+import threading
+import numpy as np
+
+from telemetry import TelemetryHistory
+from clocks import REAL_CLOCK
+
+MAGIC = b"BBQLOG01"
+#Magic, then the length of the field description that follows it
+PREAMBLE = struct.Struct("<8sH")
+
+def _fieldSpec(fields):
+    return ",".join("%s:%s" % (name, dtype) for name, dtype in fields).encode("ascii")
+
+def _parseFieldSpec(spec):
+    return [tuple(field.split(":")) for field in spec.decode("ascii").split(",")]
+
+def recordDtype(fields):
+    return np.dtype([(name, "<" + dtype) for name, dtype in fields])
+
+class CookLogWriter(object):
+    """Appends fixed width binary status records to a cook log
+
+    A record is the TelemetryHistory fields struct-packed little endian, 60
+    bytes per sample. Records are buffered in memory and written in batches,
+    and the file is fsynced at most every fsync_interval seconds, so the SD
+    card sees a few small sequential writes instead of a text line per second.
+    Reopening an existing log appends to it. write, flush and close may be
+    called from different threads; records written after close are dropped.
+    """
+    def __init__(self, path, fields=TelemetryHistory.FIELDS, batch_records=30, fsync_interval=60.0, log=None, clock=REAL_CLOCK):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.path = path
+        self.fields = list(fields)
+        self.batch_records = batch_records
+        self.fsync_interval = fsync_interval
+        self.clock = clock
+        self.record = struct.Struct("<" + "".join("d" if dtype == "f8" else "f" for name, dtype in self.fields))
+
+        spec = _fieldSpec(self.fields)
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new_file:
+            with open(path, "rb") as f:
+                magic, spec_len = PREAMBLE.unpack(f.read(PREAMBLE.size))
+                if magic != MAGIC or f.read(spec_len) != spec:
+                    raise ValueError("%s is not a cook log with the same fields" % path)
+        self._file = open(path, "ab")
+        if new_file:
+            self._file.write(PREAMBLE.pack(MAGIC, len(spec)) + spec)
+            self._file.flush()
+        else:
+            self._truncatePartial(PREAMBLE.size + len(spec))
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._last_sync = self.clock.time()
+        self.records_written = 0
+        self.syncs = 0
+
+    def _truncatePartial(self, header_size):
+        #A power cut can leave half a record at the end; drop it so appends stay aligned
+        size = os.path.getsize(self.path)
+        partial = (size - header_size) % self.record.size
+        if partial:
+            self.log.warn("Dropping %d bytes of a partial record from %s" % (partial, self.path))
+            self._file.truncate(size - partial)
+
+    def write(self, values):
+        """Queues one record; values are in field order (a StatusSnapshot's sample())"""
+        record = self.record.pack(*values)
+        with self._lock:
+            if self._file == None:
+                return
+            self._buffer.append(record)
+            if len(self._buffer) >= self.batch_records:
+                self._flush()
+
+    def flush(self, sync=False):
+        with self._lock:
+            if self._file != None:
+                self._flush(sync)
+
+    def _flush(self, sync=False):
+        if self._buffer:
+            self._file.write(b"".join(self._buffer))
+            self.records_written += len(self._buffer)
+            self._buffer = []
+            self._file.flush()
+        now = self.clock.time()
+        if sync or now - self._last_sync >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            self._last_sync = now
+            self.syncs += 1
+
+    def close(self):
+        with self._lock:
+            if self._file == None:
+                return
+            self._flush(sync=True)
+            self._file.close()
+            self._file = None
+
+def readCookLog(path):
+    """Memory-maps a cook log; returns a read-only structured array, one row per record"""
+    with open(path, "rb") as f:
+        magic, spec_len = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a cook log" % path)
+        dtype = recordDtype(_parseFieldSpec(f.read(spec_len)))
+    offset = PREAMBLE.size + spec_len
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+def exportCSV(records, out):
+    """Writes records as CSV with a header row to an open text file"""
+    names = records.dtype.names
+    out.write(",".join(names) + "\n")
+    formats = ["%.3f" if records.dtype[name].itemsize == 8 else "%.2f" for name in names]
+    row_format = ",".join(formats) + "\n"
+    #Chunks keep memory flat even for a multi-day log
+    chunk = 4096
+    for start in range(0, len(records), chunk):
+        block = records[start:start+chunk]
+        columns = [block[name].tolist() for name in names]
+        out.write("".join(row_format % row for row in zip(*columns)))
+
+if __name__ == "__main__":
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    #python cook_log.py LOG [CSV] exports LOG to CSV (stdout without CSV)
+    if len(sys.argv) > 1:
+        records = readCookLog(sys.argv[1])
+        if len(sys.argv) > 2:
+            with open(sys.argv[2], "w") as out:
+                exportCSV(records, out)
+            log.info("Exported %d records to %s" % (len(records), sys.argv[2]))
+        else:
+            exportCSV(records, sys.stdout)
+        sys.exit(0)
+
+    path = "/tmp/cook_log_demo.bbqlog"
+    if os.path.exists(path):
+        os.remove(path)
+    writer = CookLogWriter(path, log=log)
+    runs = 24*60*60
+    start_time = time.time()
+    for x in range(runs):
+        writer.write((x, x, 225.0, 150.0, 40.0, 0.0, 235, 265, 205, 1.0, 2.0, 0.0, 3.0))
+    writer.close()
+    log.info("Wrote %d records (%d bytes) in %.2fs with %d fsyncs" % (runs, os.path.getsize(path), time.time()-start_time, writer.syncs))
+    start_time = time.time()
+    records = readCookLog(path)
+    temps = np.array(records["ambient_temp"])
+    log.info("Loaded %d records in %.1f ms, mean pit %.1fF" % (len(records), (time.time()-start_time)*1e3, temps.mean()))
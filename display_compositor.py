@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from clocks import REAL_CLOCK
+import metrics
+
+class DisplayCompositor(object):
+    """Single thread that owns the framebuffer, the cursor blink and the bus
+
+    Writers put scene updates on a queue and return immediately. The
+    compositor applies everything that is queued, then flushes at most one
+    frame per 1/fps seconds, so a header update, a menu update and a cursor
+    blink landing together cost one transfer instead of three.
+    """
+    def __init__(self, framebuffer, renderer, fps=10.0, blink_interval=0.2, log=None, clock=REAL_CLOCK):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.framebuffer = framebuffer
+        self.renderer = renderer
+        self.frame_interval = 1.0 / fps
+        self.blink_interval = blink_interval
+        self.clock = clock
+
+        self.updates = queue.Queue()
+        self.cursor = None
+        self.blink_enabled = True
+        self._cursor_on = False
+        self._running = False
+        self._waiters = []
+        self.compositor_thread = None
+        #Called after every submit; lets an event loop drive composite() instead of the thread
+        self.notify = None
+        #Blinks and flushes run on the monotonic clock so wall clock steps cannot stall them
+        self._next_blink = self.clock.monotonic() + blink_interval
+        self._last_flush = self._next_blink - blink_interval - self.frame_interval
+
+        self.updates_applied = 0
+        self.frames_flushed = 0
+        self.blinks = 0
+        self._flush_time = metrics.REGISTRY.histogram("bbq_display_flush_seconds", "Time to compose and send one display frame")
+        self._flush_bytes = metrics.REGISTRY.counter("bbq_display_bytes_total", "Display data bytes sent")
+
+    def start(self):
+        if self.compositor_thread:
+            self.log.warn("Display compositor thread already started; skipping")
+            return
+        self._running = True
+        self.compositor_thread = threading.Thread(target=self.run_compositor)
+        self.compositor_thread.daemon = True
+        self.compositor_thread.start()
+
+    def stop(self):
+        if not self.compositor_thread:
+            self.log.warn("Display compositor thread already stopped; skipping")
+            return
+        self._running = False
+        self.updates.put(None)
+        self.compositor_thread.join(2)
+        self.compositor_thread = None
+
+    def submit(self, func, *args):
+        """Queues func(*args) to run on the compositor thread; never blocks"""
+        self.updates.put((func, args))
+        if self.notify != None:
+            self.notify()
+
+    def setLine(self, slot, text, x=0, y=0):
+        self.submit(self.framebuffer.setLine, slot, text, x, y)
+
+    def clearLine(self, slot):
+        self.submit(self.framebuffer.clearLine, slot)
+
+    def clearLines(self, predicate):
+        self.submit(self.framebuffer.clearLines, predicate)
+
+    def setCursor(self, x0, x1, y):
+        """Blinking underline from column x0 to x1 at row y, or none when y is None"""
+        self.submit(self._setCursor, None if y == None else (x0, x1, y))
+
+    def setBlink(self, enabled):
+        self.submit(self._setBlink, enabled)
+
+    def sync(self, timeout=2.0):
+        """Waits until everything queued so far has been applied and flushed"""
+        done = threading.Event()
+        self.submit(self._waiters.append, done)
+        return done.wait(timeout)
+
+    def _setCursor(self, cursor):
+        self.cursor = cursor
+        self._drawCursor()
+
+    def _setBlink(self, enabled):
+        self.blink_enabled = enabled
+        self._cursor_on = False
+        self._drawCursor()
+
+    def _drawCursor(self):
+        if self.cursor != None and self._cursor_on:
+            self.framebuffer.setCursor(*self.cursor)
+        else:
+            self.framebuffer.setCursor(0, 0, None)
+
+    def _apply(self, update):
+        func, args = update
+        try:
+            func(*args)
+        except Exception as e:
+            #A failed update (e.g. an I2C error clearing the panel) must not end the compositor
+            self.log.error("Display update %s failed: %s" % (getattr(func, "__name__", str(func)), str(e)))
+            return
+        self.updates_applied += 1
+
+    def composite(self, force=False):
+        """Applies queued updates, blinks and flushes if due, or right away with force
+
+        Returns the monotonic clock time at which it next has work to do, not counting
+        updates that have yet to be submitted.
+        """
+        try:
+            while True:
+                update = self.updates.get_nowait()
+                if update != None:
+                    self._apply(update)
+        except queue.Empty:
+            pass
+
+        now = self.clock.monotonic()
+        if now >= self._next_blink:
+            if self.blink_enabled and self.cursor != None:
+                self._cursor_on = not self._cursor_on
+                self._drawCursor()
+                self.blinks += 1
+            self._next_blink = max(self._next_blink + self.blink_interval, now)
+        if self.framebuffer.isDirty() and (force or now - self._last_flush >= self.frame_interval):
+            perf_start = metrics.PERF_CLOCK()
+            try:
+                self._flush_bytes.inc(self.renderer.renderFrame(self.framebuffer.frame()))
+            except Exception as e:
+                self.log.error("Display flush failed: %s" % str(e))
+            self._flush_time.observeSince(perf_start)
+            self.frames_flushed += 1
+            self._last_flush = now
+        if self._waiters and not self.framebuffer.isDirty():
+            for done in self._waiters:
+                done.set()
+            self._waiters = []
+
+        #Next blink, or the moment a pending frame may be sent
+        wake_at = self._next_blink
+        if self.framebuffer.isDirty():
+            wake_at = min(wake_at, self._last_flush + self.frame_interval)
+        return wake_at
+
+    def run_compositor(self):
+        while self._running:
+            wake_at = self.composite()
+            timeout = max(0.0, wake_at - self.clock.monotonic())
+            try:
+                update = self.updates.get(True, self.clock.timeout(timeout))
+                if update != None:
+                    self._apply(update)
+            except queue.Empty:
+                pass
+
+    def getStats(self):
+        return {"updates_applied": self.updates_applied,
+                "frames_flushed": self.frames_flushed,
+                "blinks": self.blinks,
+                "queued": self.updates.qsize()}
+
+if __name__ == "__main__":
+
+    from glyph_atlas import GlyphAtlas, TextFramebuffer
+    from hal import FakeSSD1306
+    from oled_renderer import DirtyPageRenderer
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    disp = FakeSSD1306()
+    framebuffer = TextFramebuffer(GlyphAtlas())
+    compositor = DisplayCompositor(framebuffer, DirtyPageRenderer(disp, log), fps=10, log=log)
+    compositor.start()
+    compositor.setCursor(12, 17, 33)
+    start_time = time.time()
+    for x in range(100):
+        compositor.setLine("header", time.strftime("%H:%M:%S") + " Good", 0, 0)
+        compositor.setLine(0, "  Current Temp: %.1f" % (225 + x * 0.1), 0, 16)
+        time.sleep(0.02)
+    compositor.sync()
+    log.info("100 header+menu updates in %.1fs, stats %s" % (time.time() - start_time, str(compositor.getStats())))
+    log.info("Bytes on the bus: %d" % disp.data_bytes)
+    compositor.stop()
@@ -2,43 +2,52 @@
 
 import os, time, sys
 import logging
-import wiringpi
-import RPi.GPIO as GPIO
+from tachometer import Tachometer
+from gpio_output import CachedOutput, RelayGovernor
+from clocks import REAL_CLOCK
+import metrics
 
 class PWMFanController(object):
     POWER_PIN = 27
     PWM_PIN = 18
     TACH_PIN = 23
     
-    def __init__(self, logger):
+    def __init__(self, logger, gpio=None, clock=REAL_CLOCK):
         self.log = logger
+        self.clock = clock
 
         self.log.info("Initializeing PWM Controller")
 
         self.duty_cycle = 0
+        self.pwm_value = 0
         self.pwm_range = 128
         self.pwm_clock = 6
-        self.tach_last_time = 0.0
         self.power_state = 0
         self.enable_power_control = True
-        self.min_pwm_val = -1
-        self.tach_speed_calc = 0 
+        self.min_pwm_val = 0
+        #Edge times and relay hold-offs on the monotonic clock, scaled with it in the simulator
+        self.tach = Tachometer(clock=clock.monotonic)
+        self.relay = RelayGovernor(clock=clock.monotonic)
+        self._set_time = metrics.REGISTRY.histogram("bbq_fan_set_duty_seconds", "Time for one setDutyCycle call")
+        self._duty = metrics.REGISTRY.gauge("bbq_fan_duty_cycle", "Fan duty cycle in percent")
+        self._tach_edges = metrics.REGISTRY.counter("bbq_tach_edges_total", "Tachometer edges seen by the GPIO callback")
 
         #Check we are a Raspberry PI
         try:
-            GPIO.setmode(GPIO.BCM)
-            GPIO.setup(PWMFanController.TACH_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-            GPIO.add_event_detect(PWMFanController.TACH_PIN, GPIO.FALLING, callback=self.tachCallback, bouncetime=1)
-            wiringpi.pwmSetMode(wiringpi.PWM_MODE_MS)
-            wiringpi.wiringPiSetupGpio()
-            wiringpi.pinMode(PWMFanController.POWER_PIN, wiringpi.OUTPUT)
+            if gpio == None:
+                from hal import RPiGPIO
+                gpio = RPiGPIO()
+            self.gpio = gpio
+            #Only touch GPIO when the register value changes; keep the relay from chattering
+            self.output = CachedOutput(gpio.pwmWrite, gpio.digitalWrite)
+            # Bounce is rejected when the RPM is read, keeping the callback to one timestamp
+            gpio.watchEdge(PWMFanController.TACH_PIN, self.tachCallback)
+            gpio.setupOutput(PWMFanController.POWER_PIN)
             self.setPowerState(False)
-            wiringpi.pinMode(PWMFanController.PWM_PIN,2)
-            wiringpi.pwmSetRange(self.pwm_range)
-            wiringpi.pwmSetClock(self.pwm_clock) # Equals 19200000 / PWM_CLOCK / PWM_RANGE
-            
+            gpio.setupPWM(PWMFanController.PWM_PIN, self.pwm_range, self.pwm_clock)
+
             self.enabled = True
-        except Exception, e:
+        except Exception as e:
             self.log.error(e)
             self.log.error("Could not initialize PWM controller")
             self.enabled = False
@@ -50,15 +59,17 @@ class PWMFanController(object):
         else:
             self.power_state = 0
         if self.enable_power_control:
-            wiringpi.digitalWrite(PWMFanController.POWER_PIN, self.power_state) # Active Low
+            self.output.digitalWrite(PWMFanController.POWER_PIN, self.power_state) # Active Low
     
-    def tachCallback(self):
-        if self.tach_last_time == 0.0:
-            self.tach_last_time = time.time()
-        else:
-            tmptime = time.time()
-            self.tach_speed_calc = 1.0/(4.0 * (tmptime-self.tach_last_time))
-            self.tach_last_time = tmptime
+    def tachCallback(self, channel=None):
+        self.tach.edge(channel)
+        self._tach_edges.inc()
+
+    def getTachReading(self):
+        return self.tach.getReading()
+
+    def getTachSpeed(self):
+        return self.tach.getRPM()
 
     def setDutyCycle(self, value):
         if self.enabled:
@@ -66,18 +77,15 @@ class PWMFanController(object):
             if value < 0 or value > 100:
                 self.log.error("Invalid duty cycle setting %f; keeping value at current level of %f" % (value, self.duty_cycle))
                 return False
+            perf_start = metrics.PERF_CLOCK()
             new_dc = int(float(value*self.pwm_range)/100.0)
-            if new_dc > self.min_pwm_val:
-                self.setPowerState(True)
-            else:
-                self.setPowerState(False)
-            if new_dc == self.duty_cycle:
-                self.log.info("Current duty is already the same")
-            else:
-                self.log.debug("Setting PWM Duty Cycle to %f" % (float(value)))
-                wiringpi.pwmWrite(PWMFanController.PWM_PIN, new_dc)
-                self.duty_cycle = value
-                self.log.info("Successfully set PWM Duty Cycle to %d" % (self.duty_cycle))
+            self.setPowerState(self.relay.update(new_dc > self.min_pwm_val))
+            if self.output.pwmWrite(PWMFanController.PWM_PIN, new_dc):
+                self.log.debug("Set PWM Duty Cycle to %f (register %d)" % (float(value), new_dc))
+            self.pwm_value = new_dc
+            self.duty_cycle = value
+            self._duty.set(value)
+            self._set_time.observeSince(perf_start)
             return True
         else:
             self.log.error("Cannot set duty cycle since fan was not initialized")
@@ -86,6 +94,14 @@ class PWMFanController(object):
     def getDutyCycle(self):
         return self.duty_cycle
 
+    def getOutputStats(self):
+        if not self.enabled:
+            return {}
+        stats = self.output.getStats()
+        stats["relay_toggles"] = self.relay.toggles
+        stats["relay_toggles_suppressed"] = self.relay.toggles_suppressed
+        return stats
+
 if __name__ == "__main__":
 
     log = logging.getLogger(__name__)
@@ -105,10 +121,10 @@ if __name__ == "__main__":
                 if dc < 0 or dc > 100:
                     raise ValueError("Not inside range of [0,100]")
                 fc.setDutyCycle(dc)
-            except ValueError, e:
+            except ValueError as e:
                 log.error("Value must be between 0 and 100 and must be an integer")
             time.sleep(1)
-            log.info("Measured tach speed is %f" % (fc.tach_speed_calc))
+            log.info("Measured tach reading is %s" % str(fc.getTachReading()))
     except KeyboardInterrupt:
         log.info("Exiting program")
         #fc.setDutyCycle(0)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+
+class CookerModel(object):
+    """Cooker response learned online by recursive least squares
+
+    Every interval seconds the pit temperature and the mean fan duty over
+    the interval are fed to a first order ARX model
+
+        T[k+1] = a T[k] + b1 u[k] + ... + bn u[k-n+1] + c
+
+    The input taps cover the fire's dead time without having to know it.
+    At steady state T = a T + sum(b) u + c, so the duty that holds a
+    setpoint is ((1 - a) setpoint - c) / sum(b). Old samples are forgotten
+    with factor forgetting per interval so a burning down or refuelled
+    fire is tracked; while the pit sits still the covariance is bounded by
+    max_trace instead of growing without limit.
+    """
+    def __init__(self, interval=30.0, input_taps=4, forgetting=0.995, min_samples=20, max_trace=1e6, log=None):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.interval = interval
+        self.input_taps = input_taps
+        self.forgetting = forgetting
+        self.min_samples = min_samples
+        self.max_trace = max_trace
+        n = input_taps + 2
+        self.theta = [0.0] * n
+        self.P = [[1000.0 if i == j else 0.0 for j in range(n)] for i in range(n)]
+        self.samples = 0
+        self.inputs = [0.0] * input_taps
+        self.last_temp = None
+        self.interval_start = None
+        self.duty_area = 0.0
+        self.last_time = None
+
+    def _regressor(self):
+        return [self.last_temp] + self.inputs + [1.0]
+
+    def _learn(self, phi, target):
+        n = len(phi)
+        P, theta = self.P, self.theta
+        Pphi = [sum(P[i][j] * phi[j] for j in range(n)) for i in range(n)]
+        denom = self.forgetting + sum(phi[i] * Pphi[i] for i in range(n))
+        gain = [x / denom for x in Pphi]
+        error = target - sum(theta[i] * phi[i] for i in range(n))
+        for i in range(n):
+            theta[i] += gain[i] * error
+        scale = 1.0 / self.forgetting
+        if sum(P[i][i] for i in range(n)) > self.max_trace:
+            scale = 1.0
+        for i in range(n):
+            Pi = P[i]
+            gi = gain[i]
+            for j in range(n):
+                Pi[j] = (Pi[j] - gi * Pphi[j]) * scale
+        self.samples += 1
+
+    def update(self, temperature, duty, now):
+        """Records one reading and the duty applied since the previous one"""
+        if self.last_time == None:
+            self.interval_start = now
+        else:
+            self.duty_area += duty * (now - self.last_time)
+        self.last_time = now
+        elapsed = now - self.interval_start
+        if elapsed < self.interval:
+            return
+        mean_duty = self.duty_area / elapsed
+        self.inputs = [mean_duty] + self.inputs[:-1]
+        if self.last_temp != None:
+            self._learn(self._regressor(), temperature)
+        self.last_temp = temperature
+        self.interval_start = now
+        self.duty_area = 0.0
+
+    def ready(self):
+        a, b = self.theta[0], sum(self.theta[1:-1])
+        return self.samples >= self.min_samples and 0.0 < a < 1.0 and b > 0.0
+
+    def steadyStateDuty(self, setpoint):
+        """Duty predicted to hold setpoint, or None until the model has learned enough"""
+        if not self.ready():
+            return None
+        a, b, c = self.theta[0], sum(self.theta[1:-1]), self.theta[-1]
+        return ((1.0 - a) * setpoint - c) / b
+
+    def steadyStateTemp(self, duty):
+        if not self.ready():
+            return None
+        a, b, c = self.theta[0], sum(self.theta[1:-1]), self.theta[-1]
+        return (b * duty + c) / (1.0 - a)
+
+class DutyDither(object):
+    """Replaces convertPIDOutput with burst dithering below the fan's minimum duty
+
+    Outputs between 0 and min_duty_cycle used to be dropped to 0. Here the
+    fan runs at min_duty_cycle for output / min_duty_cycle of every period
+    seconds and is off for the rest, so the mean duty matches the output.
+    With period shorter than the fan relay's off delay the relay stays on.
+    """
+    def __init__(self, min_duty_cycle=25, max_duty_cycle=100, period=20.0):
+        self.min_duty_cycle = min_duty_cycle
+        self.max_duty_cycle = max_duty_cycle
+        self.period = period
+        self.period_start = None
+        self.bursts = 0
+
+    def convert(self, output, now):
+        if output >= self.min_duty_cycle:
+            self.period_start = None
+            return int(round(min(output, self.max_duty_cycle)))
+        if output <= 0:
+            self.period_start = None
+            return 0
+        if self.period_start == None or now - self.period_start >= self.period:
+            self.period_start = now
+            self.bursts += 1
+        if now - self.period_start < self.period * output / self.min_duty_cycle:
+            return self.min_duty_cycle
+        return 0
+
+if __name__ == "__main__":
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    from pid_controller import PID
+    from smoker_sim import SmokerModel, convertOutput, recoveryMetrics
+
+    def cook(feed_forward, dither, target=235.0, hours=6.0, fuel=1.5, trim=0.5):
+        """The same steps as BBQController.run_pid with start_feed_forward, on the model at 1s intervals"""
+        model = SmokerModel(0.0)
+        pid = PID(6, 0.02, 0.0, clock=lambda: 0.0)
+        pid.SetPoint = target
+        cooker = CookerModel() if feed_forward else None
+        dither = DutyDither() if dither else None
+        temps, duties = [], []
+        duty = 0
+        changes = 0
+        for now in range(int(hours * 3600)):
+            if now == 3 * 3600:
+                #A fresh load of fuel; holding 235 now needs less than the fan's minimum duty
+                model.setFuel(fuel, now)
+            temp = model.pitTemperature(now)
+            pid.update(temp, 1.0)
+            output = pid.output
+            if cooker != None:
+                cooker.update(temp, duty, now)
+                ff = cooker.steadyStateDuty(target)
+                if ff != None:
+                    output = trim * output + max(0.0, min(100.0, ff))
+            if dither != None:
+                duty = dither.convert(output, now)
+            else:
+                duty = convertOutput(output)
+            if duties and duty != duties[-1]:
+                changes += 1
+            model.setDuty(duty, now)
+            temps.append(temp)
+            duties.append(duty)
+        return temps, duties, changes, cooker
+
+    for name, feed_forward, dither in (("PID", False, False),
+                                       ("PID + dither", False, True),
+                                       ("PID + feed forward + dither", True, True)):
+        start_time = time.time()
+        temps, duties, changes, cooker = cook(feed_forward, dither)
+        times = list(range(len(temps)))
+        warm = recoveryMetrics(times[:3*3600], temps[:3*3600], 235.0, 0)
+        before = temps[2*3600:3*3600]
+        after = temps[-3600:]
+        line = "%-28s warm up settled %5ss | hour 3 %.1f-%.1fF | after refuel %.1f-%.1fF | %d duty changes (%.1fs)" % (
+            name, warm["recovery_time"], min(before), max(before), min(after), max(after), changes, time.time()-start_time)
+        if cooker != None:
+            line += " | learned duty for 235F: %.1f%%" % cooker.steadyStateDuty(235.0)
+        log.info(line)
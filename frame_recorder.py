@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import struct
+import threading
+import numpy as np
+
+from clocks import REAL_CLOCK
+
+class FrameRecorder(object):
+    """Keeps the last N packed 1-bit display frames in a preallocated ring
+
+    record() copies a (pages, width) GRAM frame into an existing slot, so the
+    cost per frame is fixed and nothing touches the disk until dump() or
+    dumpGIF() writes the whole ring out in one go.
+    """
+    MAGIC = b"OLEDREC1"
+    HEADER = struct.Struct("<8sHHI")
+    TIMESTAMP = struct.Struct("<d")
+
+    def __init__(self, width=128, height=64, capacity=300, clock=REAL_CLOCK):
+        self.width = width
+        self.height = height
+        self.capacity = capacity
+        self.clock = clock
+        self._frames = np.zeros((capacity, height // 8, width), dtype=np.uint8)
+        self._timestamps = np.zeros(capacity)
+        self._count = 0
+        self.record_lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def record(self, frame, timestamp=None):
+        if timestamp == None:
+            timestamp = self.clock.time()
+        with self.record_lock:
+            idx = self._count % self.capacity
+            np.copyto(self._frames[idx], frame)
+            self._timestamps[idx] = timestamp
+            self._count += 1
+
+    def frames(self):
+        """Copies of the recorded (timestamps, frames), oldest first"""
+        with self.record_lock:
+            n = len(self)
+            start = self._count - n
+            order = [(start + x) % self.capacity for x in range(n)]
+            return self._timestamps[order], self._frames[order]
+
+    def dump(self, path):
+        """Writes the ring as a header followed by (timestamp, frame) records"""
+        timestamps, frames = self.frames()
+        with open(path, "wb") as f:
+            f.write(FrameRecorder.HEADER.pack(FrameRecorder.MAGIC, self.width, self.height, len(timestamps)))
+            for idx in range(len(timestamps)):
+                f.write(FrameRecorder.TIMESTAMP.pack(timestamps[idx]))
+                f.write(frames[idx].tobytes())
+        return len(timestamps)
+
+    def dumpGIF(self, path):
+        """Writes the ring as an animated GIF with the recorded frame timing"""
+        timestamps, frames = self.frames()
+        if len(timestamps) == 0:
+            return 0
+        images = [unpackFrame(frame, self.width, self.height) for frame in frames]
+        durations = [int(max(10, d * 1000)) for d in np.diff(timestamps)] + [100]
+        images[0].save(path, save_all=True, append_images=images[1:], duration=durations, loop=0)
+        return len(images)
+
+def unpackFrame(frame, width=128, height=64):
+    """Turns a packed GRAM frame back into a mode '1' PIL image"""
+    from PIL import Image
+    bits = np.unpackbits(frame.reshape(height // 8, 1, width), axis=1, bitorder="little")
+    return Image.fromarray(bits.reshape(height, width) * 255).convert('1')
+
+def readFrames(path):
+    """Loads a dump() file; returns (timestamps, frames) arrays"""
+    with open(path, "rb") as f:
+        magic, width, height, count = FrameRecorder.HEADER.unpack(f.read(FrameRecorder.HEADER.size))
+        if magic != FrameRecorder.MAGIC:
+            raise ValueError("%s is not a frame recording" % path)
+        frame_size = width * height // 8
+        record = np.dtype([("timestamp", "<f8"), ("frame", np.uint8, (height // 8, width))])
+        data = np.frombuffer(f.read(count * (8 + frame_size)), dtype=record, count=count)
+    return data["timestamp"], data["frame"]
+
+if __name__ == "__main__":
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    recorder = FrameRecorder(capacity=50)
+    frame = np.zeros((8, 128), dtype=np.uint8)
+    start_time = time.time()
+    runs = 1000
+    for x in range(runs):
+        frame[x % 8, x % 128] ^= 0xff
+        recorder.record(frame, x * 0.2)
+    log.info("record() takes %.2f us per frame" % ((time.time()-start_time)*1e6/runs))
+    path = "/tmp/oled_frames.bin"
+    log.info("Dumped %d frames to %s" % (recorder.dump(path), path))
+    timestamps, frames = readFrames(path)
+    log.info("Read back %d frames spanning %.1fs" % (len(frames), timestamps[-1] - timestamps[0]))
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import numpy as np
+
+class GlyphAtlas(object):
+    """Font pre-rasterized into per-column pixel masks
+
+    Each glyph is stored as one uint64 per column with bit y set for every lit
+    pixel, so a whole 64 pixel tall SSD1306 column fits in one word and a line
+    of text is drawn by shifting and OR-ing words instead of calling PIL.
+    PIL is only used once per character, the first time it is needed.
+
+    Glyphs are rasterized with MARGIN blank columns either side and cropped to
+    their lit columns, so ink left of the origin (a negative left bearing) or
+    past the advance is kept. Each is OR-ed in at its advance within the
+    string plus the offset PIL draws it at after a "|". PIL shifts a whole
+    string by a pixel when its first glyph starts left of the origin, so each
+    glyph also records that shift (lead), applied when it starts a line.
+    """
+    FIRST_CHAR = 32
+    LAST_CHAR = 126
+    MAX_CACHED_LINES = 256
+    MARGIN = 16
+
+    def __init__(self, font=None):
+        from PIL import ImageFont
+        if font == None:
+            font = ImageFont.load_default()
+        self.font = font
+        self.glyphs = {}
+        self._lines = {}
+        for code in range(GlyphAtlas.FIRST_CHAR, GlyphAtlas.LAST_CHAR + 1):
+            self._rasterize(chr(code))
+
+    def _advance(self, text):
+        #Advances in the 1-bit mode the display is drawn in; hinting differs from "L"
+        if hasattr(self.font, "getlength"):
+            return int(round(self.font.getlength(text, mode="1")))
+        return self.font.getsize(text)[0]
+
+    def _columns(self, text, x, width):
+        from PIL import Image, ImageDraw
+        image = Image.new('1', (width, 64))
+        ImageDraw.Draw(image).text((x, 0), text, font=self.font, fill=255)
+        rows = np.array(image, dtype=np.uint64)
+        weights = np.left_shift(np.uint64(1), np.arange(64, dtype=np.uint64))
+        return (rows * weights[:, None]).sum(axis=0, dtype=np.uint64)
+
+    def _rasterize(self, ch):
+        """(offset, masks, lead): lit columns starting offset columns right of the origin"""
+        margin = GlyphAtlas.MARGIN
+        width = self._advance(ch) + 2 * margin
+        #After a "|", as inside a line, with its origin at margin; the bar is then masked out.
+        #Not after a space: PIL draws nothing for a line of only spaces and "_"
+        bar = self._advance("|")
+        columns = self._columns("|" + ch, margin - bar, width)
+        columns[:margin] &= ~self._columns("|", margin - bar, width)[:margin]
+        lit = np.nonzero(columns)[0]
+        if len(lit):
+            offset = int(lit[0]) - margin
+            alone = np.nonzero(self._columns(ch, margin, width))[0]
+            lead = int(alone[0]) - margin - offset if len(alone) else 0
+            glyph = (offset, columns[lit[0]:lit[-1] + 1], lead)
+        else:
+            glyph = (0, columns[:0], 0)
+        self.glyphs[ch] = glyph
+        return glyph
+
+    def renderText(self, text):
+        """(offset, masks) for a whole string, cached by string
+
+        masks[0] is the column offset pixels right of the text origin;
+        offset is negative when the first glyph reaches left of it.
+        """
+        line = self._lines.get(text)
+        if line is None:
+            placed = []
+            lead = 0
+            for idx, ch in enumerate(text):
+                offset, masks, glyph_lead = self.glyphs[ch] if ch in self.glyphs else self._rasterize(ch)
+                if idx == 0:
+                    lead = glyph_lead
+                if len(masks):
+                    placed.append((self._advance(text[:idx]) + offset + lead, masks))
+            if placed:
+                start = min(x for x, masks in placed)
+                end = max(x + len(masks) for x, masks in placed)
+                columns = np.zeros(end - start, dtype=np.uint64)
+                for x, masks in placed:
+                    columns[x - start:x - start + len(masks)] |= masks
+                line = (start, columns)
+            else:
+                line = (0, np.zeros(0, dtype=np.uint64))
+            if len(self._lines) >= GlyphAtlas.MAX_CACHED_LINES:
+                self._lines.clear()
+            self._lines[text] = line
+        return line
+
+class TextFramebuffer(object):
+    """Packed 1-bit framebuffer composed from text lines and a cursor
+
+    Lines are kept by slot. Setting a slot to the text it already shows is a
+    no-op, and the packed frame is only recomposed when something changed.
+    """
+    def __init__(self, atlas, width=128, height=64):
+        if height > 64:
+            raise ValueError("TextFramebuffer supports displays up to 64 pixels tall")
+        self.atlas = atlas
+        self.width = width
+        self.height = height
+        self.pages = height // 8
+        self._lines = {}
+        self._cursor = None
+        self._frame = np.zeros((self.pages, width), dtype=np.uint8)
+        self._dirty = False
+        self.lines_drawn = 0
+        self.lines_skipped = 0
+
+    def setLine(self, slot, text, x=0, y=0):
+        """Places text at pixel (x, y); returns False if the slot already showed it"""
+        entry = (text, x, y)
+        if self._lines.get(slot, (None,))[0:3] == entry:
+            self.lines_skipped += 1
+            return False
+        offset, masks = self.atlas.renderText(text)
+        start = x + offset
+        #Clip to the display the way PIL clips to the image
+        lo = max(0, start)
+        hi = min(self.width, start + len(masks))
+        column = np.zeros(self.width, dtype=np.uint64)
+        if hi > lo:
+            column[lo:hi] = np.left_shift(masks[lo - start:hi - start], np.uint64(y))
+        self._lines[slot] = entry + (column,)
+        self._dirty = True
+        self.lines_drawn += 1
+        return True
+
+    def clearLine(self, slot):
+        if self._lines.pop(slot, None) != None:
+            self._dirty = True
+
+    def clearLines(self, predicate):
+        for slot in [s for s in self._lines if predicate(s)]:
+            self.clearLine(slot)
+
+    def setCursor(self, x0, x1, y):
+        """Underline from column x0 to x1 at row y, or no cursor when y is None"""
+        cursor = None if y == None else (x0, x1, y)
+        if cursor != self._cursor:
+            self._cursor = cursor
+            self._dirty = True
+
+    def isDirty(self):
+        return self._dirty
+
+    def frame(self):
+        """Packed (pages, width) frame, recomposed only when dirty"""
+        if not self._dirty:
+            return self._frame
+        column = np.zeros(self.width, dtype=np.uint64)
+        for text, x, y, masks in self._lines.values():
+            column |= masks
+        if self._cursor != None:
+            x0, x1, y = self._cursor
+            column[x0:x1+1] |= np.uint64(1 << y)
+        for page in range(self.pages):
+            self._frame[page] = (column >> np.uint64(8 * page)) & np.uint64(0xff)
+        self._dirty = False
+        return self._frame
+
+if __name__ == "__main__":
+
+    from PIL import Image, ImageDraw, ImageFont
+    from oled_renderer import packImage
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    font = ImageFont.load_default()
+    lines = ["  Current Temp: 225.0", "  Target Temp: 235", "  Enable: Off", "  Options"]
+    atlas = GlyphAtlas(font)
+    fb = TextFramebuffer(atlas)
+
+    image = Image.new('1', (128, 64))
+    draw = ImageDraw.Draw(image)
+    runs = 200
+    start_time = time.time()
+    for x in range(runs):
+        draw.rectangle((0, 0, 128, 64), outline=0, fill=0)
+        for idx, txt in enumerate(lines):
+            draw.text((0, idx*8 + 16), txt, font=font, fill=255)
+        pil_frame = packImage(image)
+    pil_time = (time.time() - start_time) / runs
+    start_time = time.time()
+    for x in range(runs):
+        for idx, txt in enumerate(lines):
+            fb.setLine(idx, txt, 0, idx*8 + 16)
+        atlas_frame = fb.frame()
+    atlas_time = (time.time() - start_time) / runs
+    log.info("Menu redraw with PIL %.1f us, with cached atlas lines %.1f us" % (pil_time*1e6, atlas_time*1e6))
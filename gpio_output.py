@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import os, time, sys
+
+from clocks import MONOTONIC_CLOCK
+
+class CachedOutput(object):
+    """Write-through cache in front of the GPIO write calls
+
+    Remembers the last register value sent to every pin and only calls the
+    underlying write when the value actually changes. Counters show how many
+    writes were performed and how many were avoided.
+    """
+    def __init__(self, pwm_write, digital_write):
+        self._pwm_write = pwm_write
+        self._digital_write = digital_write
+        self._pwm_values = {}
+        self._digital_values = {}
+        self.writes_performed = 0
+        self.writes_avoided = 0
+
+    def pwmWrite(self, pin, value):
+        if self._pwm_values.get(pin) == value:
+            self.writes_avoided += 1
+            return False
+        self._pwm_write(pin, value)
+        self._pwm_values[pin] = value
+        self.writes_performed += 1
+        return True
+
+    def digitalWrite(self, pin, value):
+        if self._digital_values.get(pin) == value:
+            self.writes_avoided += 1
+            return False
+        self._digital_write(pin, value)
+        self._digital_values[pin] = value
+        self.writes_performed += 1
+        return True
+
+    def invalidate(self, pin=None):
+        """Forgets cached state so the next write always reaches the hardware"""
+        if pin == None:
+            self._pwm_values.clear()
+            self._digital_values.clear()
+        else:
+            self._pwm_values.pop(pin, None)
+            self._digital_values.pop(pin, None)
+
+    def getStats(self):
+        return {"writes_performed": self.writes_performed,
+                "writes_avoided": self.writes_avoided}
+
+class RelayGovernor(object):
+    """Decides the fan relay state with hysteresis and a toggle rate limit
+
+    The relay turns on as soon as there is demand, but only turns off once the
+    demand has been zero for off_delay seconds, and never toggles more often
+    than min_toggle_interval. A 1Hz control loop hovering around the fan's
+    minimum duty therefore does not click the relay every second.
+    """
+    def __init__(self, off_delay=30.0, min_toggle_interval=10.0, clock=MONOTONIC_CLOCK):
+        self.off_delay = off_delay
+        self.min_toggle_interval = min_toggle_interval
+        self.clock = clock
+        self.state = False
+        self.last_toggle = None
+        self.zero_since = None
+        self.toggles = 0
+        self.toggles_suppressed = 0
+
+    def update(self, demand):
+        now = self.clock()
+        if demand:
+            self.zero_since = None
+            wanted = True
+        else:
+            if self.zero_since == None:
+                self.zero_since = now
+            wanted = self.state and now - self.zero_since < self.off_delay
+        if wanted != self.state:
+            if self.last_toggle != None and now - self.last_toggle < self.min_toggle_interval:
+                self.toggles_suppressed += 1
+                return self.state
+            self.state = wanted
+            self.last_toggle = now
+            self.toggles += 1
+        return self.state
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""Hardware backends for the fan, buttons, thermometers and display
+
+Every device the controller touches goes through one of three small
+interfaces:
+
+  GPIO     setupPWM, pwmWrite, setupOutput, digitalWrite, watchEdge, unwatch
+  1-Wire   discover() returning sensors with .id and get_temperature(unit)
+  SSD1306  openDisplay() returning an Adafruit_SSD1306 compatible object
+
+The real backends import wiringpi, RPi.GPIO, w1thermsensor and
+Adafruit_SSD1306 when they are constructed, never at module import, so
+everything else can be imported and run on a machine without them. The
+fakes keep their state in memory and count every call; this module is
+their only home, for tests, demos, benchmarks and the simulator alike.
+"""
+
+import os, time, sys
+import logging
+import threading
+from collections import deque
+
+from therm_sampler import DEGREES_C, DEGREES_F, convertTemperature
+from clocks import REAL_CLOCK
+
+class RPiGPIO(object):
+    """wiringpi for PWM and outputs, RPi.GPIO for edge interrupts"""
+    def __init__(self):
+        import wiringpi
+        import RPi.GPIO as GPIO
+        self.wiringpi = wiringpi
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+        wiringpi.wiringPiSetupGpio()
+
+    def setupPWM(self, pin, pwm_range, pwm_clock):
+        wiringpi = self.wiringpi
+        wiringpi.pwmSetMode(wiringpi.PWM_MODE_MS)
+        wiringpi.pinMode(pin, wiringpi.PWM_OUTPUT)
+        wiringpi.pwmSetRange(pwm_range)
+        wiringpi.pwmSetClock(pwm_clock) # Equals 19200000 / PWM_CLOCK / PWM_RANGE
+
+    def pwmWrite(self, pin, value):
+        self.wiringpi.pwmWrite(pin, value)
+
+    def setupOutput(self, pin):
+        self.wiringpi.pinMode(pin, self.wiringpi.OUTPUT)
+
+    def digitalWrite(self, pin, value):
+        self.wiringpi.digitalWrite(pin, value)
+
+    def watchEdge(self, pin, callback, falling=True, pull_up=True, bouncetime=None):
+        GPIO = self.GPIO
+        GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP if pull_up else GPIO.PUD_DOWN)
+        edge = GPIO.FALLING if falling else GPIO.RISING
+        if bouncetime:
+            GPIO.add_event_detect(pin, edge, callback=callback, bouncetime=bouncetime)
+        else:
+            GPIO.add_event_detect(pin, edge, callback=callback)
+
+    def unwatch(self, pin):
+        self.GPIO.remove_event_detect(pin)
+
+class FakeGPIO(object):
+    """In-memory GPIO that records every call with a timestamp
+
+    pwm and digital hold the last value written to each pin, calls counts
+    every method, and trace keeps the last trace_length (time, call, pin,
+    value) entries. edge(pin) runs the watched callback like an interrupt.
+    """
+    def __init__(self, clock=REAL_CLOCK, trace_length=1024):
+        self.clock = clock
+        self.pwm = {}
+        self.pwm_config = {}
+        self.digital = {}
+        self.outputs = set()
+        self.callbacks = {}
+        self.calls = {}
+        self.trace = deque(maxlen=trace_length)
+        self.call_lock = threading.Lock()
+
+    def _record(self, call, pin, value=None):
+        with self.call_lock:
+            self.calls[call] = self.calls.get(call, 0) + 1
+            self.trace.append((self.clock.time(), call, pin, value))
+
+    def setupPWM(self, pin, pwm_range, pwm_clock):
+        self._record("setupPWM", pin, (pwm_range, pwm_clock))
+        self.pwm_config[pin] = (pwm_range, pwm_clock)
+
+    def pwmWrite(self, pin, value):
+        self._record("pwmWrite", pin, value)
+        self.pwm[pin] = value
+
+    def setupOutput(self, pin):
+        self._record("setupOutput", pin)
+        self.outputs.add(pin)
+
+    def digitalWrite(self, pin, value):
+        self._record("digitalWrite", pin, value)
+        self.digital[pin] = value
+
+    def watchEdge(self, pin, callback, falling=True, pull_up=True, bouncetime=None):
+        self._record("watchEdge", pin)
+        self.callbacks[pin] = callback
+
+    def unwatch(self, pin):
+        self._record("unwatch", pin)
+        self.callbacks.pop(pin, None)
+
+    def edge(self, pin):
+        """Simulates an interrupt on pin; returns False if nothing watches it"""
+        callback = self.callbacks.get(pin)
+        if callback == None:
+            return False
+        callback(pin)
+        return True
+
+    def callCount(self, call):
+        return self.calls.get(call, 0)
+
+class W1Therm(object):
+    """DS18B20 probes found through w1thermsensor"""
+    def discover(self):
+        from w1thermsensor import W1ThermSensor
+        return sorted(W1ThermSensor.get_available_sensors(), key=lambda s: s.id)
+
+class FakeThermometer(object):
+    """W1ThermSensor stand-in holding a settable temperature
+
+    Each read takes conversion_time on the given clock, like the 750ms
+    conversion of a real DS18B20, and is counted and timed. With source,
+    a function of the clock time returning Celsius (smoker_sim's model),
+    the temperature at the end of the conversion is read from it instead.
+    """
+    def __init__(self, sensor_id, celsius=20.0, conversion_time=0.0, clock=REAL_CLOCK, source=None):
+        self.id = sensor_id
+        self.celsius = celsius
+        self.conversion_time = conversion_time
+        self.clock = clock
+        self.source = source
+        self.fail = False
+        self.read_count = 0
+        self.read_time = 0.0
+
+    def setTemperature(self, celsius):
+        self.celsius = celsius
+
+    def get_temperature(self, unit=DEGREES_C):
+        start_time = self.clock.monotonic()
+        if self.conversion_time > 0:
+            self.clock.sleep(self.conversion_time)
+        self.read_count += 1
+        self.read_time += self.clock.monotonic() - start_time
+        if self.fail:
+            raise IOError("Simulated read failure on %s" % self.id)
+        if self.source != None:
+            self.celsius = self.source(self.clock.time())
+        return convertTemperature(self.celsius, unit)
+
+class FakeW1Therm(object):
+    """1-Wire bus with a fixed set of FakeThermometers"""
+    def __init__(self, sensors=None, clock=REAL_CLOCK):
+        if sensors == None:
+            sensors = [FakeThermometer("28-000000000001", clock=clock)]
+        self.sensors = list(sensors)
+        self.discover_count = 0
+
+    def addSensor(self, sensor):
+        self.sensors.append(sensor)
+        return sensor
+
+    def discover(self):
+        self.discover_count += 1
+        return sorted(self.sensors, key=lambda s: s.id)
+
+def openDisplay(address=0x3C, rst=None):
+    """Real SSD1306_128_64 on I2C"""
+    import Adafruit_SSD1306
+    return Adafruit_SSD1306.SSD1306_128_64(rst=rst, i2c_address=address)
+
+class FakeSSD1306(object):
+    """In-memory SSD1306_128_64 that keeps its own GRAM and counts bus bytes
+
+    Like the real backends, numpy and the SSD1306 packing helpers are only
+    imported when one is constructed.
+    """
+    def __init__(self, width=128, height=64, rst=None, i2c_address=0x3C):
+        import numpy as np
+        import oled_renderer
+        self._oled = oled_renderer
+        self.width = width
+        self.height = height
+        self.pages = height // 8
+        self.gram = np.zeros((self.pages, width), dtype=np.uint8)
+        self._buffer = bytearray(width * self.pages)
+        self._pending = []
+        self._window = (0, width - 1, 0, self.pages - 1)
+        self._pointer = (0, 0)
+        self.command_bytes = 0
+        self.data_bytes = 0
+        self.transfers = 0
+
+    def begin(self, vccstate=None):
+        pass
+
+    def command(self, c):
+        COLUMNADDR, PAGEADDR = self._oled.SSD1306_COLUMNADDR, self._oled.SSD1306_PAGEADDR
+        self.command_bytes += 1
+        self._pending.append(c)
+        if len(self._pending) == 3 and self._pending[0] in (COLUMNADDR, PAGEADDR):
+            cmd, start, end = self._pending
+            col_start, col_end, page_start, page_end = self._window
+            if cmd == COLUMNADDR:
+                self._window = (start, end, page_start, page_end)
+                self._pointer = (start, self._pointer[1])
+            else:
+                self._window = (col_start, col_end, start, end)
+                self._pointer = (self._pointer[0], start)
+            self._pending = []
+        elif self._pending[0] not in (COLUMNADDR, PAGEADDR):
+            self._pending = []
+
+    def writeData(self, data):
+        self.transfers += 1
+        col_start, col_end, page_start, page_end = self._window
+        col, page = self._pointer
+        for byte in data:
+            self.gram[page, col] = byte
+            self.data_bytes += 1
+            col += 1
+            if col > col_end:
+                col = col_start
+                page += 1
+                if page > page_end:
+                    page = page_start
+        self._pointer = (col, page)
+
+    def clear(self):
+        self._buffer = bytearray(self.width * self.pages)
+
+    def image(self, image):
+        self._buffer = bytearray(self._oled.packImage(image).tobytes())
+
+    def display(self):
+        for c in (self._oled.SSD1306_COLUMNADDR, 0, self.width - 1, self._oled.SSD1306_PAGEADDR, 0, self.pages - 1):
+            self.command(c)
+        self.writeData(self._buffer)
+
+def openFakeDisplay(address=0x3C, rst=None):
+    """FakeSSD1306 that emulates GRAM and counts bus bytes"""
+    return FakeSSD1306(i2c_address=address)
+
+class Hardware(object):
+    """The GPIO, 1-Wire and display backends one controller runs on"""
+    def __init__(self, gpio, therm, open_display):
+        self.gpio = gpio
+        self.therm = therm
+        self.open_display = open_display
+
+def realHardware():
+    return Hardware(RPiGPIO(), W1Therm(), openDisplay)
+
+def fakeHardware(clock=REAL_CLOCK, sensors=None):
+    return Hardware(FakeGPIO(clock), FakeW1Therm(sensors, clock), openFakeDisplay)
+
+def defaultHardware():
+    """Fakes when BBQ_FAKE_HARDWARE=1, otherwise the real devices"""
+    if os.environ.get("BBQ_FAKE_HARDWARE", "0") == "1":
+        return fakeHardware()
+    return realHardware()
+
+if __name__ == "__main__":
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    from fan_controller import PWMFanController
+    hardware = fakeHardware()
+    fan = PWMFanController(log, gpio=hardware.gpio)
+    for duty in (0, 40, 40, 60, 0):
+        fan.setDutyCycle(duty)
+    for x in range(8):
+        hardware.gpio.edge(PWMFanController.TACH_PIN)
+    log.info("PWM registers %s, relay %s" % (str(hardware.gpio.pwm), str(hardware.gpio.digital)))
+    log.info("GPIO call counts %s" % str(hardware.gpio.calls))
+    log.info("Thermometers %s" % str([(s.id, s.get_temperature(DEGREES_F)) for s in hardware.therm.discover()]))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import threading
+import math
+
+# High resolution interval clock for timing hot paths
+PERF_CLOCK = getattr(time, "perf_counter", time.time)
+
+def _escape(text, quote=True):
+    #Backslash first, or the escapes added for quotes and newlines would be doubled
+    text = str(text).replace("\\", "\\\\").replace("\n", "\\n")
+    if quote:
+        text = text.replace('"', '\\"')
+    return text
+
+def _labelText(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (key, _escape(value)) for key, value in labels)
+
+def _valueText(value):
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+class Counter(object):
+    """Monotonically increasing count"""
+    TYPE = "counter"
+    __slots__ = ("name", "help", "labels", "value")
+
+    def __init__(self, name, help="", labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+class Gauge(object):
+    """Value that can go up and down"""
+    TYPE = "gauge"
+    __slots__ = ("name", "help", "labels", "value")
+
+    def __init__(self, name, help="", labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+class Histogram(object):
+    """Log-linear latency histogram in the style of HdrHistogram
+
+    Every power of two between lowest and highest is split into SUB_BUCKETS
+    linear buckets, so any recorded value is known to within 1/SUB_BUCKETS
+    (12.5%) without storing samples. observe() is a frexp and a list
+    increment. Exported as a Prometheus summary with fixed quantiles.
+    """
+    TYPE = "summary"
+    SUB_BUCKETS = 8
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+    __slots__ = ("name", "help", "labels", "lowest", "counts", "count", "sum", "max")
+
+    def __init__(self, name, help="", labels=(), lowest=1e-6, highest=1e3):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lowest = lowest
+        octaves = int(math.ceil(math.log(highest / lowest, 2)))
+        self.counts = [0] * (octaves * Histogram.SUB_BUCKETS + 2)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        if value > self.lowest:
+            idx = len(self.counts) - 1
+            if not math.isinf(value):
+                mantissa, exponent = math.frexp(value / self.lowest)
+                idx = min(idx, (exponent - 1) * Histogram.SUB_BUCKETS + int((2 * mantissa - 1) * Histogram.SUB_BUCKETS) + 1)
+        else:
+            idx = 0
+        self.counts[idx] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def observeSince(self, start_time):
+        """Records the time elapsed since a PERF_CLOCK() start_time"""
+        self.observe(PERF_CLOCK() - start_time)
+
+    def _upperBound(self, idx):
+        if idx == 0:
+            return self.lowest
+        if idx == len(self.counts) - 1:
+            #Everything above highest lands here
+            return float("inf")
+        octave, sub = divmod(idx - 1, Histogram.SUB_BUCKETS)
+        return self.lowest * (2 ** octave) * (1.0 + float(sub + 1) / Histogram.SUB_BUCKETS)
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q quantile (0 < q <= 1)"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self._upperBound(idx), self.max)
+        return self.max
+
+    def samples(self):
+        samples = [(self.name, self.labels + (("quantile", str(q)),), self.percentile(q)) for q in Histogram.QUANTILES]
+        samples.append((self.name + "_sum", self.labels, self.sum))
+        samples.append((self.name + "_count", self.labels, self.count))
+        return samples
+
+class _NullMetric(object):
+    """Stands in for every metric type while metrics are disabled"""
+    __slots__ = ()
+    count = 0
+    value = 0
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def observeSince(self, start_time):
+        pass
+
+    def percentile(self, q):
+        return 0.0
+
+NULL_METRIC = _NullMetric()
+
+class MetricsRegistry(object):
+    """Named counters, gauges and histograms
+
+    Metrics are looked up once, when a component is built, and then updated
+    directly with no locking. While the registry is disabled every lookup
+    returns the shared no-op NULL_METRIC, so instrumented code pays one empty
+    method call. Enable the registry before building the components to be
+    measured.
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._metrics = {}
+        self.registry_lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        if not self.enabled:
+            return NULL_METRIC
+        labels = tuple(sorted((labels or {}).items()))
+        key = (name, labels)
+        with self.registry_lock:
+            metric = self._metrics.get(key)
+            if metric == None:
+                metric = cls(name, help, labels, **kwargs)
+                self._metrics[key] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError("Metric %s is already registered as a %s" % (name, metric.TYPE))
+        return metric
+
+    def counter(self, name, help="", labels=None):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help="", labels=None):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help="", labels=None, lowest=1e-6, highest=1e3):
+        return self._get(Histogram, name, help, labels, lowest=lowest, highest=highest)
+
+    def metrics(self):
+        with self.registry_lock:
+            return sorted(self._metrics.values(), key=lambda m: (m.name, m.labels))
+
+    def exposition(self):
+        """Prometheus text exposition format, version 0.0.4"""
+        lines = []
+        last_name = None
+        for metric in self.metrics():
+            if metric.name != last_name:
+                lines.append("# HELP %s %s" % (metric.name, _escape(metric.help, quote=False)))
+                lines.append("# TYPE %s %s" % (metric.name, metric.TYPE))
+                last_name = metric.name
+            for name, labels, value in metric.samples():
+                lines.append("%s%s %s" % (name, _labelText(labels), _valueText(value)))
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """One short line per metric, for the log"""
+        lines = []
+        for metric in self.metrics():
+            name = metric.name + _labelText(metric.labels)
+            if isinstance(metric, Histogram):
+                lines.append("%s count=%d p50=%.3gs p99=%.3gs max=%.3gs" % (
+                    name, metric.count, metric.percentile(0.5), metric.percentile(0.99), metric.max))
+            else:
+                lines.append("%s %g" % (name, metric.value))
+        return lines
+
+#Shared registry for the controller; off unless BBQ_METRICS=1 or enable() is called first
+REGISTRY = MetricsRegistry(enabled=os.environ.get("BBQ_METRICS", "0") == "1")
+
+def enable(registry=REGISTRY):
+    registry.enabled = True
+
+class MetricsLogger(object):
+    """Writes the registry summary to the log every interval seconds"""
+    def __init__(self, registry=REGISTRY, interval=60.0, log=None):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.registry = registry
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self.logger_thread = None
+
+    def start(self):
+        if self.logger_thread:
+            self.log.warn("Metrics logger thread already started; skipping")
+            return
+        self._stop_event.clear()
+        self.logger_thread = threading.Thread(target=self.run_logger)
+        self.logger_thread.daemon = True
+        self.logger_thread.start()
+
+    def stop(self):
+        if not self.logger_thread:
+            self.log.warn("Metrics logger thread already stopped; skipping")
+            return
+        self._stop_event.set()
+        self.logger_thread.join(2)
+        self.logger_thread = None
+
+    def run_logger(self):
+        while not self._stop_event.wait(self.interval):
+            for line in self.registry.summary():
+                self.log.info("metric %s" % line)
+
+if __name__ == "__main__":
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    runs = 200000
+    for enabled in (False, True):
+        registry = MetricsRegistry(enabled)
+        hist = registry.histogram("demo_step_seconds", "Demo step time")
+        edges = registry.counter("demo_edges_total", "Demo edges")
+        start_time = time.time()
+        for x in range(runs):
+            hist.observe((x % 1000) * 1e-6)
+            edges.inc()
+        log.info("Enabled=%s: observe+inc %.0f ns" % (enabled, (time.time()-start_time)*1e9/runs))
+    log.info("p50 %.1f us (exact 500), p99 %.1f us (exact 990)" % (hist.percentile(0.5)*1e6, hist.percentile(0.99)*1e6))
+    print(registry.exposition())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import numpy as np
+
+# SSD1306 addressing commands
+SSD1306_COLUMNADDR = 0x21
+SSD1306_PAGEADDR = 0x22
+I2C_DATA_CONTROL = 0x40
+I2C_CHUNK = 16
+
+def packImage(image):
+    """Packs a mode '1' PIL image into SSD1306 GRAM layout, shape (pages, width)
+
+    Each byte holds 8 vertically stacked pixels of one column, LSB on top,
+    which is what Adafruit_SSD1306.image() builds pixel by pixel.
+    """
+    width, height = image.size
+    rows = np.unpackbits(np.frombuffer(image.tobytes(), dtype=np.uint8)).reshape(height, -1)[:, :width]
+    return np.packbits(rows.reshape(height // 8, 8, width), axis=1, bitorder="little").reshape(height // 8, width)
+
+class DirtyPageRenderer(object):
+    """Sends only the SSD1306 pages and columns that changed since the last frame
+
+    The packed frame is diffed against the last one transmitted. For every page
+    with changes, only the span from the first to the last changed column is
+    written, using the COLUMNADDR/PAGEADDR window. A blinking cursor therefore
+    costs a few bytes instead of the full 1KB frame.
+    """
+    def __init__(self, disp, log=None):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.disp = disp
+        self.pages = disp.height // 8
+        self._sent = None
+        self.recorder = None
+
+        self.frames = 0
+        self.frames_skipped = 0
+        self.bytes_sent = 0
+        self.pages_sent = 0
+
+    def invalidate(self, blank=False):
+        """Forget what the panel shows; blank=True means it was just cleared"""
+        if blank:
+            self._sent = np.zeros((self.pages, self.disp.width), dtype=np.uint8)
+        else:
+            self._sent = None
+
+    def render(self, image):
+        """Transmits the changed parts of a PIL image; returns the number of data bytes sent"""
+        return self.renderFrame(packImage(image))
+
+    def renderFrame(self, frame):
+        """Transmits the changed parts of a packed (pages, width) frame"""
+        self.frames += 1
+        if self.recorder != None:
+            self.recorder.record(frame)
+        if self._sent is None:
+            sent = self._writeWindow(0, self.disp.width - 1, 0, self.pages - 1, frame.tobytes())
+            self.pages_sent += self.pages
+            self._sent = frame.copy()
+            return sent
+        changed = frame != self._sent
+        dirty_pages = np.nonzero(changed.any(axis=1))[0]
+        if len(dirty_pages) == 0:
+            self.frames_skipped += 1
+            return 0
+        sent = 0
+        for page in dirty_pages:
+            cols = np.nonzero(changed[page])[0]
+            start, end = int(cols[0]), int(cols[-1])
+            sent += self._writeWindow(start, end, int(page), int(page), frame[page, start:end+1].tobytes())
+        self.pages_sent += len(dirty_pages)
+        # Callers may keep mutating their frame, so keep our own copy of what was sent
+        np.copyto(self._sent, frame)
+        return sent
+
+    def _writeWindow(self, col_start, col_end, page_start, page_end, data):
+        disp = self.disp
+        disp.command(SSD1306_COLUMNADDR)
+        disp.command(col_start)
+        disp.command(col_end)
+        disp.command(SSD1306_PAGEADDR)
+        disp.command(page_start)
+        disp.command(page_end)
+        self._writeData(bytearray(data))
+        self.bytes_sent += len(data)
+        return len(data)
+
+    def _writeData(self, data):
+        disp = self.disp
+        if hasattr(disp, "writeData"):
+            disp.writeData(data)
+        elif getattr(disp, "_i2c", None) != None:
+            for idx in range(0, len(data), I2C_CHUNK):
+                disp._i2c.writeList(I2C_DATA_CONTROL, list(data[idx:idx+I2C_CHUNK]))
+        else:
+            disp._gpio.set_high(disp._dc)
+            disp._spi.write(list(data))
+
+    def getStats(self):
+        return {"frames": self.frames,
+                "frames_skipped": self.frames_skipped,
+                "pages_sent": self.pages_sent,
+                "bytes_sent": self.bytes_sent}
+
+if __name__ == "__main__":
+
+    from PIL import Image, ImageDraw, ImageFont
+    from hal import FakeSSD1306
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    disp = FakeSSD1306()
+    renderer = DirtyPageRenderer(disp, log)
+    image = Image.new('1', (disp.width, disp.height))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    draw.text((0, 0), "12:00:00 Good", font=font, fill=255)
+    draw.text((0, 16), "  Current Temp: 225.0", font=font, fill=255)
+    log.info("First frame sent %d bytes" % renderer.render(image))
+    for x in range(4):
+        draw.line([(18, 33), (23, 33)], fill=255 if x % 2 == 0 else 0, width=1)
+        log.info("Cursor blink sent %d bytes" % renderer.render(image))
+    log.info("GRAM matches image: %s" % str(bool((disp.gram == packImage(image)).all())))
+    log.info("Renderer stats %s" % str(renderer.getStats()))
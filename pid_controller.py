@@ -30,18 +30,30 @@ More information about PID Controller: http://en.wikipedia.org/wiki/PID_controll
 """
 import time
 
-class PID:
+# Wall clock steps (NTP sync at boot) must not show up as huge or negative dt
+MONOTONIC_CLOCK = getattr(time, "monotonic", time.time)
+
+def asList(values):
+    if hasattr(values, "tolist"):
+        return values.tolist()
+    return values
+
+class PID(object):
     """PID Controller
     """
+    __slots__ = ("Kp", "Ki", "Kd", "clock", "sample_time", "current_time", "last_time",
+                 "SetPoint", "PTerm", "ITerm", "DTerm", "last_error", "int_error",
+                 "windup_guard", "output")
 
-    def __init__(self, P=0.2, I=0.0, D=0.0):
+    def __init__(self, P=0.2, I=0.0, D=0.0, clock=MONOTONIC_CLOCK):
 
         self.Kp = P
         self.Ki = I
         self.Kd = D
 
+        self.clock = clock
         self.sample_time = 0.00
-        self.current_time = time.time()
+        self.current_time = self.clock()
         self.last_time = self.current_time
 
         self.clear()
@@ -61,7 +73,7 @@ class PID:
 
         self.output = 0.0
 
-    def update(self, feedback_value):
+    def update(self, feedback_value, dt=None):
         """Calculates PID value for given reference feedback
 
         .. math::
@@ -72,31 +84,109 @@ class PID:
 
            Test PID with Kp=1.2, Ki=1, Kd=0.001 (test_pid.py)
 
+        If dt is given it is used instead of reading the clock.
         """
         error = self.SetPoint - feedback_value
 
-        self.current_time = time.time()
-        delta_time = self.current_time - self.last_time
-        delta_error = error - self.last_error
+        if dt == None:
+            current_time = self.clock()
+            delta_time = current_time - self.last_time
+        else:
+            delta_time = dt
+            current_time = self.last_time + dt
+        self.current_time = current_time
+
+        if delta_time < 0:
+            # Clock went backwards; restart the time base instead of integrating
+            self.last_time = current_time
+            return
 
         if (delta_time >= self.sample_time):
             self.PTerm = self.Kp * error
-            self.ITerm += error * delta_time
+            ITerm = self.ITerm + error * delta_time
+            windup_guard = self.windup_guard
 
-            if (self.ITerm < -self.windup_guard):
-                self.ITerm = -self.windup_guard
-            elif (self.ITerm > self.windup_guard):
-                self.ITerm = self.windup_guard
+            if (ITerm < -windup_guard):
+                ITerm = -windup_guard
+            elif (ITerm > windup_guard):
+                ITerm = windup_guard
+            self.ITerm = ITerm
 
             self.DTerm = 0.0
             if delta_time > 0:
-                self.DTerm = delta_error / delta_time
+                self.DTerm = (error - self.last_error) / delta_time
 
             # Remember last time and last error for next calculation
-            self.last_time = self.current_time
+            self.last_time = current_time
             self.last_error = error
 
-            self.output = self.PTerm + (self.Ki * self.ITerm) + (self.Kd * self.DTerm)
+            self.output = self.PTerm + (self.Ki * ITerm) + (self.Kd * self.DTerm)
+
+    def update_many(self, samples, timestamps=None, dt=None):
+        """Replays a series of feedback values and returns the output after each one
+
+        Pass the sample timestamps (the log becomes the time base, starting at
+        timestamps[0]), a fixed dt between samples or one dt per sample. Any of
+        them may be numpy arrays, e.g. columns of cook_log.readCookLog. State
+        is left as it would be after calling update once per sample.
+        """
+        outputs = [0.0] * len(samples)
+        if len(samples) == 0:
+            return outputs
+        #Python floats keep the loop below fast; numpy scalars are several times slower
+        samples = asList(samples)
+        if timestamps is None:
+            if dt is None:
+                raise ValueError("update_many needs timestamps or dt")
+            last_time = self.last_time
+            times = None
+            if hasattr(dt, "__len__"):
+                times = []
+                current_time = last_time
+                for interval in asList(dt):
+                    current_time += interval
+                    times.append(current_time)
+        else:
+            times = asList(timestamps)
+            last_time = times[0]
+
+        # Keep the hot loop on locals; attributes are written back once at the end
+        Kp, Ki, Kd = self.Kp, self.Ki, self.Kd
+        setpoint = self.SetPoint
+        windup_guard = self.windup_guard
+        sample_time = self.sample_time
+        ITerm, last_error = self.ITerm, self.last_error
+        PTerm, DTerm, output = self.PTerm, self.DTerm, self.output
+        current_time = last_time
+        for idx in range(len(samples)):
+            error = setpoint - samples[idx]
+            if times is None:
+                current_time = last_time + dt
+            else:
+                current_time = times[idx]
+            delta_time = current_time - last_time
+            if delta_time < 0:
+                last_time = current_time
+            elif delta_time >= sample_time:
+                PTerm = Kp * error
+                ITerm += error * delta_time
+                if ITerm < -windup_guard:
+                    ITerm = -windup_guard
+                elif ITerm > windup_guard:
+                    ITerm = windup_guard
+                DTerm = 0.0
+                if delta_time > 0:
+                    DTerm = (error - last_error) / delta_time
+                last_time = current_time
+                last_error = error
+                output = PTerm + Ki * ITerm + Kd * DTerm
+            outputs[idx] = output
+
+        self.PTerm, self.ITerm, self.DTerm, self.output = PTerm, ITerm, DTerm, output
+        self.last_error = last_error
+        self.last_time = last_time
+        self.current_time = current_time
+        return outputs
 
     def setKp(self, proportional_gain):
         """Determines how aggressively the PID reacts to the current error with setting Proportional Gain"""
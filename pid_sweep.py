@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import numpy as np
+
+class BatchPID(object):
+    """Vectorized version of pid_controller.PID that runs N gain sets at once
+
+    The arithmetic matches PID.update, but time is explicit: pass dt to update
+    or inject a clock function. All state is held in arrays of shape (N,).
+    """
+    def __init__(self, Kp, Ki, Kd, windup=20.0, setpoint=0.0, clock=None):
+        self.Kp, self.Ki, self.Kd, self.windup_guard = np.broadcast_arrays(
+            np.asarray(Kp, dtype=float), np.asarray(Ki, dtype=float),
+            np.asarray(Kd, dtype=float), np.asarray(windup, dtype=float))
+        self.SetPoint = setpoint
+        self.clock = clock
+        self.clear()
+
+    def __len__(self):
+        return self.Kp.shape[0]
+
+    def clear(self):
+        shape = self.Kp.shape
+        self.PTerm = np.zeros(shape)
+        self.ITerm = np.zeros(shape)
+        self.DTerm = np.zeros(shape)
+        self.last_error = np.zeros(shape)
+        self.output = np.zeros(shape)
+        self.last_time = None
+        if self.clock != None:
+            self.last_time = self.clock()
+
+    def update(self, feedback_value, dt=None):
+        """feedback_value is a scalar or one value per candidate"""
+        if dt == None:
+            now = self.clock()
+            dt = now - self.last_time
+            self.last_time = now
+        error = self.SetPoint - feedback_value
+        self.PTerm = self.Kp * error
+        self.ITerm = np.clip(self.ITerm + error * dt, -self.windup_guard, self.windup_guard)
+        if dt > 0:
+            self.DTerm = (error - self.last_error) / dt
+        else:
+            self.DTerm = np.zeros_like(self.PTerm)
+        self.last_error = error
+        self.output = self.PTerm + self.Ki * self.ITerm + self.Kd * self.DTerm
+        return self.output
+
+def gainGrid(Kp, Ki, Kd=(0.0,), windup=(20.0,)):
+    """Every combination of the given gain values as flat arrays"""
+    grid = np.meshgrid(np.asarray(Kp, dtype=float), np.asarray(Ki, dtype=float),
+                       np.asarray(Kd, dtype=float), np.asarray(windup, dtype=float), indexing="ij")
+    return [g.ravel() for g in grid]
+
+def convertPIDOutput(x, min_duty_cycle=25, max_duty_cycle=100):
+    """Vectorized BBQController.convertPIDOutput"""
+    duty = np.round(np.minimum(x, max_duty_cycle))
+    duty[x < min_duty_cycle] = 0
+    return duty
+
+class BatchPlant(object):
+    """First order plus dead time smoker model for N independent cookers
+
+    Steady state pit temperature is ambient + idle_rise + gain * duty, reached
+    with time constant tau; the fan's effect shows up dead_time seconds late.
+    """
+    def __init__(self, n, dt, start_temp=70.0, ambient=70.0, idle_rise=40.0, gain=3.5, tau=900.0, dead_time=60.0):
+        self.dt = dt
+        self.ambient = ambient
+        self.idle_rise = idle_rise
+        self.gain = gain
+        self.tau = tau
+        self.temp = np.full(n, float(start_temp))
+        self.delay = np.zeros((max(1, int(round(dead_time/dt))), n))
+        self.delay_idx = 0
+
+    def step(self, duty):
+        # Ring of past duty cycles implements the dead time without allocating
+        effective = self.delay[self.delay_idx].copy()
+        self.delay[self.delay_idx] = duty
+        self.delay_idx = (self.delay_idx + 1) % self.delay.shape[0]
+        target = self.ambient + self.idle_rise + self.gain * effective
+        self.temp += (target - self.temp) * (self.dt / self.tau)
+        return self.temp
+
+def replay(pid, temps, dt):
+    """Open loop: PID outputs of every candidate over a recorded trace, shape (N, T)"""
+    temps = np.asarray(temps, dtype=float)
+    out = np.empty((len(pid), temps.shape[0]))
+    for idx in range(temps.shape[0]):
+        out[:, idx] = pid.update(temps[idx], dt)
+    return out
+
+def simulate(pid, plant, steps, min_duty_cycle=25, max_duty_cycle=100):
+    """Closed loop: temperatures of every candidate driving its own plant, shape (N, T)"""
+    temps = np.empty((len(pid), steps))
+    for idx in range(steps):
+        pid.update(plant.temp, plant.dt)
+        temps[:, idx] = plant.step(convertPIDOutput(pid.output, min_duty_cycle, max_duty_cycle))
+    return temps
+
+def responseMetrics(temps, setpoint, dt, band=5.0):
+    """Overshoot, settling time and integral absolute error for each row of temps
+
+    Settling time is when the response last left setpoint +/- band; it is inf
+    for candidates that never settle.
+    """
+    temps = np.atleast_2d(temps)
+    error = temps - setpoint
+    overshoot = np.maximum(error.max(axis=1), 0.0)
+    outside = np.abs(error) > band
+    steps = temps.shape[1]
+    # Index of the last sample outside the band, -1 if always inside
+    last_outside = steps - 1 - np.argmax(outside[:, ::-1], axis=1)
+    last_outside[~outside.any(axis=1)] = -1
+    settling_time = (last_outside + 1) * dt
+    settling_time[outside[:, -1]] = np.inf
+    iae = np.abs(error).sum(axis=1) * dt
+    return {"overshoot": overshoot, "settling_time": settling_time, "iae": iae}
+
+def sweep(Kp, Ki, Kd=(0.0,), windup=(20.0,), setpoint=235.0, duration=4*60*60, dt=1.0, plant_args=None):
+    """Closed loop grid search; returns gains and metrics sorted by IAE"""
+    kp, ki, kd, wg = gainGrid(Kp, Ki, Kd, windup)
+    pid = BatchPID(kp, ki, kd, wg, setpoint=setpoint)
+    plant = BatchPlant(len(pid), dt, **(plant_args or {}))
+    temps = simulate(pid, plant, int(duration/dt))
+    results = responseMetrics(temps, setpoint, dt)
+    results.update({"Kp": kp, "Ki": ki, "Kd": kd, "windup": wg})
+    order = np.argsort(results["iae"])
+    return dict((key, val[order]) for key, val in results.items())
+
+if __name__ == "__main__":
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    start_time = time.time()
+    results = sweep(Kp=np.linspace(1, 20, 20), Ki=np.linspace(0.0, 0.1, 11), Kd=(0.0, 10.0), windup=(20.0, 100.0))
+    log.info("Evaluated %d candidates in %.2fs" % (len(results["Kp"]), time.time()-start_time))
+    for idx in range(5):
+        log.info("Kp: %.2f Ki: %.3f Kd: %.1f Windup: %.0f -> Overshoot: %.1fF Settling: %.0fs IAE: %.0f" % (
+            results["Kp"][idx], results["Ki"][idx], results["Kd"][idx], results["windup"][idx],
+            results["overshoot"][idx], results["settling_time"][idx], results["iae"][idx]))
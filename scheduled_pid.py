@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+from collections import deque, namedtuple
+
+from pid_controller import PID, MONOTONIC_CLOCK, asList
+
+#Gains used while the pit is at least min_error degrees below the setpoint (negative: above it)
+GainBand = namedtuple("GainBand", ["min_error", "Kp", "Ki", "Kd"])
+
+#Far below target (light up, lid just closed): push hard, no integral to wind up.
+#Near target: gentle proportional with integral to remove the offset.
+#Well above target: more proportional so the fan backs off sooner.
+DEFAULT_BANDS = (GainBand(25.0, 8.0, 0.0, 0.0),
+                 GainBand(-10.0, 1.5, 0.0045, 0.0),
+                 GainBand(float("-inf"), 2.5, 0.0045, 0.0))
+
+class ScheduledPID(PID):
+    """PID with gains scheduled by distance from the setpoint and disturbance detection
+
+    A drop-in replacement for PID in BBQController. On every update:
+
+      * the pit's rate of change is the least squares slope of the last
+        slope_window seconds of readings, and the proportional and
+        derivative terms act on the temperature predicted horizon seconds
+        ahead, so the fan backs off before a recovering pit overshoots
+      * the gains come from the band the error falls in; crossing into
+        another band needs hysteresis degrees of margin, and ITerm is
+        rescaled so the integral contribution does not jump
+      * a pit moving away from the setpoint faster than disturbance_rate
+        degrees per second (an open lid, a flare after refuelling) is a
+        disturbance; the integrator is frozen until the pit is back within
+        settle_band of the setpoint, so it does not wind up and overshoot.
+        Against smoker_sim's model the scheduling does most of the work; the
+        freeze trims a 3 minute lid opening's overshoot from 4.0F to 2.7F but
+        recovery takes 508s instead of 489s (run this module to compare)
+
+    windup_guard bounds ITerm as in PID, but defaults high enough for the
+    integral to carry the steady state duty in the near band.
+
+    setKp, setKi and setKd (BBQController.set_pid_gains, autotune profiles)
+    give the near band, the one holding zero error, the new gain and scale
+    the other bands by the same factor, so band changes keep the shape of
+    the schedule instead of discarding manual gains.
+    """
+    __slots__ = ("bands", "band", "hysteresis", "horizon", "slope_window", "disturbance_rate",
+                 "settle_band", "slope", "disturbance", "disturbance_count", "_window", "_integral_ki", "log")
+
+    def __init__(self, bands=DEFAULT_BANDS, horizon=60.0, slope_window=30.0, disturbance_rate=0.5,
+                 settle_band=10.0, hysteresis=2.0, windup=25000.0, clock=MONOTONIC_CLOCK, log=None):
+        self.bands = sorted(bands, key=lambda b: -b.min_error)
+        self.band = len(self.bands) - 1
+        band = self.bands[self.band]
+        super(ScheduledPID, self).__init__(band.Kp, band.Ki, band.Kd, clock=clock)
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.hysteresis = hysteresis
+        self.horizon = horizon
+        self.slope_window = slope_window
+        self.disturbance_rate = disturbance_rate
+        self.settle_band = settle_band
+        self.windup_guard = windup
+        self.disturbance_count = 0
+        self._integral_ki = band.Ki
+
+    def clear(self):
+        #PID.clear puts windup_guard back to its own default; keep ours
+        windup_guard = getattr(self, "windup_guard", None)
+        super(ScheduledPID, self).clear()
+        if windup_guard != None:
+            self.windup_guard = windup_guard
+        self.slope = 0.0
+        self.disturbance = False
+        self._window = deque()
+
+    def _updateSlope(self, now, value):
+        window = self._window
+        window.append((now, value))
+        while now - window[0][0] > self.slope_window:
+            window.popleft()
+        n = len(window)
+        if n < 3:
+            return 0.0
+        #Least squares slope, times taken relative to the newest sample
+        mean_t = sum(t - now for t, v in window) / n
+        mean_v = sum(v for t, v in window) / n
+        var = sum((t - now - mean_t) ** 2 for t, v in window)
+        if var <= 0:
+            return 0.0
+        return sum((t - now - mean_t) * (v - mean_v) for t, v in window) / var
+
+    def _selectBand(self, error):
+        idx = self.band
+        bands = self.bands
+        #Move up a band (more error) only once past its edge by hysteresis, down likewise
+        while idx > 0 and error >= bands[idx - 1].min_error + self.hysteresis:
+            idx -= 1
+        while idx < len(bands) - 1 and error < bands[idx].min_error - self.hysteresis:
+            idx += 1
+        if idx != self.band:
+            band = bands[idx]
+            #Bumpless transfer: keep the integral's contribution under the new Ki. A band
+            #with Ki 0 holds ITerm as it was, for the next band that integrates again
+            if band.Ki > 0:
+                if self._integral_ki > 0:
+                    self.ITerm = max(-self.windup_guard, min(self.windup_guard, self.ITerm * self._integral_ki / band.Ki))
+                self._integral_ki = band.Ki
+            self.band = idx
+            self.Kp, self.Ki, self.Kd = band.Kp, band.Ki, band.Kd
+
+    def _nearBand(self):
+        for idx in range(len(self.bands)):
+            if self.bands[idx].min_error <= 0:
+                return idx
+        return len(self.bands) - 1
+
+    def _scaleBands(self, name, gain):
+        near = self._nearBand()
+        reference = getattr(self.bands[near], name)
+        bands = []
+        for idx in range(len(self.bands)):
+            band = self.bands[idx]
+            if reference != 0:
+                value = getattr(band, name) * gain / float(reference)
+            elif idx == near:
+                #Nothing to scale from; only the near band takes the new term
+                value = gain
+            else:
+                value = getattr(band, name)
+            bands.append(band._replace(**{name: value}))
+        self.bands = bands
+        setattr(self, name, getattr(bands[self.band], name))
+
+    def setKp(self, proportional_gain):
+        self._scaleBands("Kp", proportional_gain)
+
+    def setKi(self, integral_gain):
+        self._scaleBands("Ki", integral_gain)
+        #ITerm is kept relative to the near band's Ki while the active band does not integrate
+        if self.Ki > 0:
+            self._integral_ki = self.Ki
+        else:
+            self._integral_ki = self.bands[self._nearBand()].Ki
+
+    def setKd(self, derivative_gain):
+        self._scaleBands("Kd", derivative_gain)
+
+    def _checkDisturbance(self, error):
+        rate = self.disturbance_rate
+        if not self.disturbance:
+            #Moving away from the setpoint faster than the fire alone can move the pit
+            if (error > 0 and self.slope < -rate) or (error < 0 and self.slope > rate):
+                self.disturbance = True
+                self.disturbance_count += 1
+                self.log.info("Disturbance: pit moving %.2f deg/s with error %.1f; integrator frozen" % (self.slope, error))
+        elif abs(error) < self.settle_band:
+            self.disturbance = False
+            self.log.info("Disturbance over; integrator released")
+
+    def update(self, feedback_value, dt=None):
+        """Calculates the output for a new reading; dt as in PID.update"""
+        if dt == None:
+            current_time = self.clock()
+            delta_time = current_time - self.last_time
+        else:
+            delta_time = dt
+            current_time = self.last_time + dt
+        self.current_time = current_time
+
+        if delta_time < 0:
+            # Clock went backwards; restart the time base and the slope window
+            self.last_time = current_time
+            self._window.clear()
+            return
+
+        if delta_time >= self.sample_time:
+            error = self.SetPoint - feedback_value
+            self.slope = self._updateSlope(current_time, feedback_value)
+            self._checkDisturbance(error)
+            self._selectBand(error)
+
+            predicted_error = error - self.slope * self.horizon
+            self.PTerm = self.Kp * predicted_error
+            if self.Ki > 0 and not self.disturbance:
+                windup_guard = self.windup_guard
+                self.ITerm = max(-windup_guard, min(windup_guard, self.ITerm + error * delta_time))
+            #Derivative of the error from the fitted slope rather than two noisy samples
+            self.DTerm = -self.slope
+
+            self.last_time = current_time
+            self.last_error = error
+            self.output = self.PTerm + (self.Ki * self.ITerm) + (self.Kd * self.DTerm)
+
+    def update_many(self, samples, timestamps=None, dt=None):
+        """Replays a series of feedback values and returns the output after each one
+
+        timestamps, dt and samples as in PID.update_many.
+        """
+        if timestamps is None and dt is None:
+            raise ValueError("update_many needs timestamps or dt")
+        samples = asList(samples)
+        if timestamps is not None:
+            timestamps = asList(timestamps)
+        elif hasattr(dt, "__len__"):
+            intervals = asList(dt)
+        else:
+            intervals = [dt] * len(samples)
+        outputs = []
+        for idx in range(len(samples)):
+            if timestamps is None:
+                self.update(samples[idx], intervals[idx])
+            elif idx == 0:
+                self.last_time = timestamps[0]
+                self.update(samples[idx], 0.0)
+            else:
+                self.update(samples[idx], timestamps[idx] - timestamps[idx - 1])
+            outputs.append(self.output)
+        return outputs
+
+if __name__ == "__main__":
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    from smoker_sim import simulateLoop, recoveryMetrics
+
+    quiet = logging.getLogger("scheduled_pid.demo")
+    quiet.setLevel(logging.WARNING)
+    target = 235.0
+    scenarios = [("lid open 3 min", {7200: lambda model, now: model.openLid(now, 180)}, 7380),
+                 ("fuel burns down 40%", {7200: lambda model, now: model.setFuel(0.6, now)}, 7200),
+                 ("fresh fuel +20%", {7200: lambda model, now: model.setFuel(1.2, now)}, 7200)]
+    def fixedPID(windup):
+        pid = PID(6, 0.02, 0.0, clock=lambda: 0.0)
+        pid.setWindup(windup)
+        return pid
+    #The fixed PID both with BBQController's windup guard and with ScheduledPID's, so the
+    #comparison is of the scheduling and not of the windup setting
+    controllers = [("fixed PID", lambda: fixedPID(20.0)),
+                   ("fixed PID, windup 25k", lambda: fixedPID(25000.0)),
+                   ("scheduled, no freeze", lambda: ScheduledPID(disturbance_rate=float("inf"), clock=lambda: 0.0, log=quiet)),
+                   ("scheduled", lambda: ScheduledPID(clock=lambda: 0.0, log=quiet))]
+    for scenario, events, after in scenarios:
+        for name, factory in controllers:
+            times, temps, duties = simulateLoop(factory(), hours=5.0, target_temp=target, events=events)
+            result = recoveryMetrics(times, temps, target, after)
+            recovery = "never" if result["recovery_time"] == None else "%.0fs" % result["recovery_time"]
+            log.info("%-20s %-21s startup overshoot %5.1fF  overshoot %5.1fF  back within 5F after %-6s  last hour %.1f-%.1fF" % (
+                scenario, name, max(temps[:after]) - target, result["overshoot"], recovery, min(temps[-3600:]), max(temps[-3600:])))
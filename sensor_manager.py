@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from therm_sampler import ThermSampler, DEGREES_F
+from clocks import REAL_CLOCK
+
+class Probe(object):
+    """One thermometer on the bus with its own sample rate"""
+    def __init__(self, sensor, name, interval, sampler):
+        self.sensor = sensor
+        self.id = sensor.id
+        self.name = name
+        self.interval = interval
+        self.sampler = sampler
+        self.next_due = 0.0
+        self.in_flight = False
+
+    def latest(self):
+        return self.sampler.latest()
+
+class SensorManager(object):
+    """Reads every 1-Wire probe concurrently on a thread pool
+
+    Each probe is scheduled at its own interval, so slow meat probes do not
+    hold up the pit probe and adding probes does not add up conversion times.
+    """
+    def __init__(self, log=None, unit=DEGREES_F, default_interval=5.0, pool_size=4, clock=REAL_CLOCK):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.clock = clock
+        self.unit = unit
+        self.default_interval = default_interval
+        self.pool_size = pool_size
+        self.probes = []
+        self.probe_lock = threading.Lock()
+
+        self.pool = None
+        self.scheduler_thread = None
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+
+    def discover(self, interval=None, therm=None):
+        """Adds every sensor on the 1-Wire backend; hal.W1Therm unless therm is given"""
+        if therm == None:
+            from hal import W1Therm
+            therm = W1Therm()
+        self.log.info("Searching for 1-Wire thermometers")
+        found = []
+        for sensor in therm.discover():
+            if self.getProbe(sensor.id) == None:
+                found.append(self.addProbe(sensor, interval=interval))
+        if not found:
+            self.log.error("Could not find any thermometers")
+        return found
+
+    def addProbe(self, sensor, name=None, interval=None):
+        if interval == None:
+            interval = self.default_interval
+        if name == None:
+            name = sensor.id
+        probe = Probe(sensor, name, interval, ThermSampler(sensor, self.unit, log=self.log, clock=self.clock))
+        with self.probe_lock:
+            self.probes.append(probe)
+        self.log.info("Added thermometer %s (%s) sampling every %.1fs" % (probe.id, name, interval))
+        self._wake_event.set()
+        return probe
+
+    def getProbe(self, key):
+        """Looks a probe up by sensor ID or name"""
+        with self.probe_lock:
+            for probe in self.probes:
+                if probe.id == key or probe.name == key:
+                    return probe
+        return None
+
+    def setInterval(self, key, interval):
+        probe = self.getProbe(key)
+        if probe == None:
+            self.log.error("No thermometer %s to set interval on" % str(key))
+            return False
+        probe.interval = interval
+        probe.next_due = min(probe.next_due, self.clock.monotonic() + interval)
+        self._wake_event.set()
+        return True
+
+    def start(self):
+        if self.scheduler_thread:
+            self.log.warn("Sensor scheduler thread already started; skipping")
+            return
+        self.pool = ThreadPool(self.pool_size)
+        self._stop_event.clear()
+        self.scheduler_thread = threading.Thread(target=self.run_scheduler)
+        self.scheduler_thread.daemon = True
+        self.scheduler_thread.start()
+
+    def stop(self):
+        if not self.scheduler_thread:
+            self.log.warn("Sensor scheduler thread already stopped; skipping")
+            return
+        self._stop_event.set()
+        self._wake_event.set()
+        self.scheduler_thread.join(2)
+        self.scheduler_thread = None
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
+
+    def _sampleProbe(self, probe):
+        start_time = self.clock.monotonic()
+        try:
+            probe.sampler.sample()
+        finally:
+            # Fixed rate schedule so dispatch latency does not accumulate as drift
+            next_due = probe.next_due + probe.interval
+            if next_due <= start_time:
+                next_due = start_time + probe.interval
+            probe.next_due = next_due
+            probe.in_flight = False
+            self._wake_event.set()
+
+    def run_scheduler(self):
+        #Schedule on the monotonic clock; readings are still stamped with wall time
+        while not self._stop_event.is_set():
+            now = self.clock.monotonic()
+            next_wake = now + 1.0
+            with self.probe_lock:
+                probes = list(self.probes)
+            for probe in probes:
+                if probe.in_flight:
+                    continue
+                if probe.next_due <= now:
+                    probe.in_flight = True
+                    self.pool.apply_async(self._sampleProbe, (probe,))
+                else:
+                    next_wake = min(next_wake, probe.next_due)
+            self._wake_event.wait(self.clock.timeout(max(0.0, next_wake - self.clock.monotonic())))
+            self._wake_event.clear()
+
+    def read_all(self):
+        """Snapshot of the newest ThermReading for every probe keyed by sensor ID"""
+        with self.probe_lock:
+            probes = list(self.probes)
+        return dict((probe.id, probe.latest()) for probe in probes)
+
+if __name__ == "__main__":
+
+    from hal import FakeThermometer
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    sensors = [FakeThermometer("28-00000000000%d" % x, conversion_time=0.75) for x in range(4)]
+    manager = SensorManager(log=log)
+    manager.addProbe(sensors[0], name="pit", interval=1.0)
+    manager.addProbe(sensors[1], name="meat1", interval=10.0)
+    manager.addProbe(sensors[2], name="meat2", interval=10.0)
+    manager.addProbe(sensors[3], name="exhaust", interval=5.0)
+    manager.start()
+    try:
+        for x in range(6):
+            time.sleep(1)
+            for sensor_id, reading in sorted(manager.read_all().items()):
+                log.info("%s: %s" % (sensor_id, str(reading)))
+    finally:
+        manager.stop()
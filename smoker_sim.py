@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import math
+import threading
+from collections import deque
+
+from clocks import REAL_CLOCK, ScaledClock
+from sensor_manager import SensorManager
+from therm_sampler import DEGREES_F
+from hal import FakeThermometer
+
+class SmokerModel(object):
+    """First order plus dead time thermal model of a smoker
+
+    Pit temperature settles at ambient + idle_rise + gain * duty with time
+    constant tau, and the fan only affects the fire dead_time seconds after a
+    duty change. Meat follows the pit with its own, much slower, time constant.
+    The model is advanced lazily to whatever time it is asked about.
+
+    Two disturbances can be injected: an open lid pulls the pit towards
+    ambient with the much shorter lid_tau, and fuel scales the fire's
+    contribution (idle_rise and gain) to model burning down or a fresh load.
+    """
+    def __init__(self, start_time, start_temp=70.0, ambient=70.0, idle_rise=40.0, gain=3.5,
+                 tau=900.0, dead_time=60.0, meat_tau=3*60*60, step=1.0, lid_tau=120.0):
+        self.ambient = ambient
+        self.idle_rise = idle_rise
+        self.gain = gain
+        self.tau = tau
+        self.dead_time = dead_time
+        self.meat_tau = meat_tau
+        self.step = step
+        self.lid_tau = lid_tau
+        self.lid_close_time = start_time
+        self.fuel = 1.0
+
+        self.pit_temp = float(start_temp)
+        self.meat_temp = float(start_temp)
+        self.model_time = start_time
+        # (time, duty) changes not yet felt by the fire
+        self.pending_duty = deque()
+        self.effective_duty = 0.0
+        self.model_lock = threading.Lock()
+
+    def setDuty(self, duty, now):
+        with self.model_lock:
+            self.pending_duty.append((now + self.dead_time, float(duty)))
+
+    def openLid(self, now, duration):
+        """Opens the lid at now for duration seconds"""
+        with self.model_lock:
+            self._advance(now)
+            self.lid_close_time = now + duration
+
+    def setFuel(self, fuel, now):
+        """Scales the fire from now on; 1.0 is the fuel the model was built with"""
+        with self.model_lock:
+            self._advance(now)
+            self.fuel = float(fuel)
+
+    def _advance(self, now):
+        while self.model_time < now:
+            dt = min(self.step, now - self.model_time)
+            if self.model_time < self.lid_close_time:
+                dt = min(dt, self.lid_close_time - self.model_time)
+            if self.pending_duty and self.pending_duty[0][0] <= self.model_time + dt:
+                when, duty = self.pending_duty.popleft()
+                dt = max(0.0, when - self.model_time)
+                self._integrate(dt)
+                self.effective_duty = duty
+            else:
+                self._integrate(dt)
+
+    def _integrate(self, dt):
+        if dt <= 0:
+            return
+        if self.model_time < self.lid_close_time:
+            target, tau = self.ambient, self.lid_tau
+        else:
+            target = self.ambient + self.fuel * (self.idle_rise + self.gain * self.effective_duty)
+            tau = self.tau
+        self.pit_temp += (target - self.pit_temp) * (1.0 - math.exp(-dt/tau))
+        self.meat_temp += (self.pit_temp - self.meat_temp) * (1.0 - math.exp(-dt/self.meat_tau))
+        self.model_time += dt
+
+    def pitTemperature(self, now):
+        with self.model_lock:
+            self._advance(now)
+            return self.pit_temp
+
+    def meatTemperature(self, now):
+        with self.model_lock:
+            self._advance(now)
+            return self.meat_temp
+
+def fahrenheitToCelsius(fahrenheit):
+    return (fahrenheit - 32.0) * 5.0 / 9.0
+
+class SimulatedFan(object):
+    """PWMFanController stand-in that drives a SmokerModel"""
+    def __init__(self, log, model, clock=REAL_CLOCK):
+        self.log = log
+        self.model = model
+        self.clock = clock
+        self.duty_cycle = 0
+        self.max_rpm = 3000.0
+        self.write_count = 0
+        self.enabled = True
+
+    def setDutyCycle(self, value):
+        if value < 0 or value > 100:
+            self.log.error("Invalid duty cycle setting %f; keeping value at current level of %f" % (value, self.duty_cycle))
+            return False
+        if value != self.duty_cycle:
+            self.model.setDuty(value, self.clock.time())
+            self.duty_cycle = value
+            self.write_count += 1
+        return True
+
+    def getDutyCycle(self):
+        return self.duty_cycle
+
+    def getTachSpeed(self):
+        return self.max_rpm * self.duty_cycle / 100.0
+
+class SmokerSimulation(object):
+    """Model plus the fake sensor and fan backends BBQController runs against in simulator mode"""
+    PIT_SENSOR_ID = "28-000000000001"
+    MEAT_SENSOR_ID = "28-000000000002"
+
+    def __init__(self, log=None, clock=REAL_CLOCK, model=None, conversion_time=0.75):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.clock = clock
+        if model == None:
+            model = SmokerModel(clock.time())
+        self.model = model
+        self.pit_sensor = FakeThermometer(SmokerSimulation.PIT_SENSOR_ID, conversion_time=conversion_time, clock=clock,
+                                          source=lambda now: fahrenheitToCelsius(model.pitTemperature(now)))
+        self.meat_sensor = FakeThermometer(SmokerSimulation.MEAT_SENSOR_ID, conversion_time=conversion_time, clock=clock,
+                                           source=lambda now: fahrenheitToCelsius(model.meatTemperature(now)))
+        self.sensors = SensorManager(log=self.log, unit=DEGREES_F, clock=clock)
+        self.sensors.addProbe(self.pit_sensor)
+        self.sensors.addProbe(self.meat_sensor)
+        self.fan = SimulatedFan(self.log, model, clock)
+
+def convertOutput(output, min_duty_cycle=25, max_duty_cycle=100):
+    """BBQController.convertPIDOutput for the plain loops below"""
+    if output < min_duty_cycle:
+        return 0
+    return int(round(min(output, max_duty_cycle)))
+
+def simulateLoop(pid, hours=4.0, target_temp=235, dt=1.0, model=None, events=None, convert=convertOutput):
+    """Steps pid against a SmokerModel in a plain loop: no threads, no clock, repeatable
+
+    events maps seconds from the start to a function(model, now), e.g.
+    {7200: lambda model, now: model.openLid(now, 180)}. Returns the lists
+    (times, pit temps, duty cycles), times in seconds from the start.
+    """
+    if model == None:
+        model = SmokerModel(0.0)
+    events = sorted((events or {}).items())
+    pid.SetPoint = target_temp
+    times, temps, duties = [], [], []
+    for idx in range(int(hours*60*60 / dt)):
+        now = idx * dt
+        while events and events[0][0] <= now:
+            events.pop(0)[1](model, now)
+        temp = model.pitTemperature(now)
+        pid.update(temp, dt)
+        duty = convert(pid.output)
+        model.setDuty(duty, now)
+        times.append(now)
+        temps.append(temp)
+        duties.append(duty)
+    return times, temps, duties
+
+def recoveryMetrics(times, temps, target_temp, after, band=5.0):
+    """Overshoot and recovery time of the response after the time after
+
+    Recovery time runs from after until the pit last entered target +/- band;
+    None if it never did.
+    """
+    overshoot = 0.0
+    last_outside = after
+    settled = False
+    for now, temp in zip(times, temps):
+        if now < after:
+            continue
+        overshoot = max(overshoot, temp - target_temp)
+        if abs(temp - target_temp) > band:
+            last_outside = now
+            settled = False
+        else:
+            settled = True
+    recovery_time = None
+    if settled:
+        recovery_time = last_outside - after
+    return {"overshoot": overshoot, "recovery_time": recovery_time}
+
+#The PID scheduler allows half a sample period (0.5s) of lateness. At 60x that is 8ms of
+#real time, above the sleep overshoot of a loaded Pi or VM; at 600x it is under 1ms and
+#5-20% of the steps miss. A 12 hour cook takes 12 minutes.
+DEFAULT_SPEEDUP = 60.0
+
+def runCook(hours=12.0, speedup=DEFAULT_SPEEDUP, target_temp=235, log=None, max_missed=0.01, **controller_args):
+    """Runs BBQController with its normal threads against the model, faster than real time
+
+    Thread wakeups are only as precise as the OS scheduler, so very large
+    speedups add sampling jitter (visible as missed deadlines in the PID
+    scheduler stats). A warning is logged when more than max_missed of the
+    control steps missed their deadline; lower the speedup if it shows up.
+    """
+    import bbq_controller
+    if log == None:
+        log = logging.getLogger(__name__)
+    clock = ScaledClock(speedup)
+    # Shorter GIL switch interval keeps thread wakeups close to their scaled deadlines
+    old_interval = None
+    if hasattr(sys, "setswitchinterval"):
+        old_interval = sys.getswitchinterval()
+        sys.setswitchinterval(0.001)
+    try:
+        bbq = bbq_controller.BBQController(log=log, simulator=True, clock=clock, **controller_args)
+        bbq.set_target_ambient_temp(target_temp)
+        end_time = clock.time() + hours*60*60
+        bbq.start()
+        clock.sleep(end_time - clock.time())
+        bbq.stop()
+    finally:
+        if old_interval != None:
+            sys.setswitchinterval(old_interval)
+    stats = bbq.pid_scheduler.getStats()
+    if stats["missed_deadlines"] > max_missed * max(1, stats["steps"]):
+        log.warn("%d of %d control steps missed their deadline at %.0fx; results are not representative of real time" % (
+            stats["missed_deadlines"], stats["steps"], speedup))
+    return bbq
+
+if __name__ == "__main__":
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    hours = 12.0
+    speedup = DEFAULT_SPEEDUP
+    if len(sys.argv) > 1:
+        hours = float(sys.argv[1])
+    if len(sys.argv) > 2:
+        speedup = float(sys.argv[2])
+    start_time = time.time()
+    bbq = runCook(hours=hours, speedup=speedup, log=log)
+    log.info("Simulated %.1f hour cook in %.1fs" % (hours, time.time()-start_time))
+    temps = bbq.history.column("ambient_temp")
+    log.info("%d samples, final pit %.1fF meat %.1fF, last hour range %.1f-%.1fF" % (
+        len(bbq.history), bbq.status["ambient_temp"], bbq.status["meat_temp"], temps[-3600:].min(), temps[-3600:].max()))
+    log.info("PID scheduler stats %s" % str(bbq.pid_scheduler.getStats()))
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import threading
+import json
+import math
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+import metrics
+
+MIN_TARGET_TEMP = 150
+MAX_TARGET_TEMP = 400
+
+def statusDelta(status, last):
+    """Fields of status that differ from the last dict sent, plus the sequence"""
+    current = dict(zip(status.keys(), status))
+    if last == None:
+        return current
+    delta = dict((key, value) for key, value in current.items() if last.get(key) != value)
+    delta["sequence"] = status.sequence
+    return delta
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def contentLength(headers):
+    """Request body length; raises ValueError when the header is not a count of bytes"""
+    value = headers.get("Content-Length") or "0"
+    if not value.strip().isdigit():
+        raise ValueError("Content-Length must be a non-negative integer")
+    return int(value)
+
+class StatusRequestHandler(BaseHTTPRequestHandler):
+    """Routes for StatusServer; self.server.status_server is the owner
+
+    GET  /status                 newest snapshot
+    GET  /stream?rate=1          Server-Sent Events with changed fields only
+    GET  /history?seconds=600    columns from the in-memory history, &step=N to decimate
+    GET  /metrics                Prometheus text exposition of the metrics registry
+    POST /target {"target": 240} sets the pit target, only with allow_writes
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        self.server.status_server.log.debug("%s %s" % (self.address_string(), format % args))
+
+    def _sendJSON(self, code, body):
+        data = json.dumps(body, separators=(",", ":")).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _sendError(self, code, message):
+        self._sendJSON(code, {"error": message})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            if url.path == "/status":
+                self._getStatus()
+            elif url.path == "/stream":
+                self._stream(float(query.get("rate", ["1"])[0]))
+            elif url.path == "/metrics":
+                self._getMetrics()
+            elif url.path == "/history":
+                self._getHistory(float(query.get("seconds", ["600"])[0]), int(query.get("step", ["1"])[0]))
+            else:
+                self._sendError(404, "No such endpoint %s" % url.path)
+        except ValueError as e:
+            self._sendError(400, str(e))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/target":
+            self._sendError(404, "No such endpoint %s" % url.path)
+            return
+        if not self.server.status_server.allow_writes:
+            self._sendError(403, "Setting the target over HTTP is disabled")
+            return
+        try:
+            length = contentLength(self.headers)
+            body = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+            if not isinstance(body, dict):
+                raise ValueError("body must be a JSON object")
+            target = self.server.status_server.setTarget(body.get("target"))
+        except ValueError as e:
+            self._sendError(400, str(e))
+            return
+        self._sendJSON(200, {"target": target})
+
+    def _getStatus(self):
+        status = self.server.status_server.controller.status
+        if status == None:
+            self._sendError(503, "No status yet")
+            return
+        self._sendJSON(200, dict(zip(status.keys(), status)))
+
+    def _getMetrics(self):
+        data = self.server.status_server.registry.exposition().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _getHistory(self, seconds, step):
+        if seconds <= 0 or step < 1:
+            raise ValueError("seconds must be positive and step at least 1")
+        controller = self.server.status_server.controller
+        if controller.history == None:
+            self._sendError(503, "No history yet")
+            return
+        window = controller.history.since(controller.clock.time() - seconds)[::step]
+        self._sendJSON(200, dict((name, window[name].tolist()) for name in window.dtype.names))
+
+    def _stream(self, rate):
+        owner = self.server.status_server
+        if not rate > 0:
+            raise ValueError("rate must be positive")
+        interval = 1.0 / min(rate, owner.max_rate)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.close_connection = True
+        last = None
+        last_sequence = 0
+        with owner.stream_lock:
+            owner.streams += 1
+        try:
+            while owner.running:
+                #Every client reads the same published snapshot; no client causes sensor reads
+                status = owner.controller.get_status(last_sequence)
+                if status != None:
+                    delta = statusDelta(status, last)
+                    self.wfile.write(("data: %s\n\n" % json.dumps(delta, separators=(",", ":"))).encode("utf-8"))
+                    self.wfile.flush()
+                    last = dict(zip(status.keys(), status))
+                    last_sequence = status.sequence
+                    with owner.stream_lock:
+                        owner.events_sent += 1
+                owner.wait(interval)
+        except (IOError, OSError):
+            #Client went away
+            pass
+        finally:
+            with owner.stream_lock:
+                owner.streams -= 1
+
+class StatusServer(object):
+    """Embedded HTTP server for live controller status
+
+    Everything is served from the controller's published StatusSnapshot and
+    TelemetryHistory, so any number of clients cost no extra sensor reads.
+    Streams use Server-Sent Events and only carry the fields that changed
+    since the client's previous event, at the rate the client asks for.
+
+    There is no authentication, so by default the server only listens on
+    localhost and is read only. Pass host="0.0.0.0" to serve the LAN and
+    allow_writes=True to accept POST /target.
+    """
+    def __init__(self, controller, host="127.0.0.1", port=8080, max_rate=10.0, registry=None, allow_writes=False, log=None):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.controller = controller
+        self.host = host
+        self.port = port
+        self.max_rate = max_rate
+        self.allow_writes = allow_writes
+        if registry == None:
+            registry = metrics.REGISTRY
+        self.registry = registry
+        self.running = False
+        #Every stream runs on its own request thread
+        self.stream_lock = threading.Lock()
+        self.streams = 0
+        self.events_sent = 0
+        self.httpd = None
+        self.server_thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        if self.server_thread:
+            self.log.warn("Status server thread already started; skipping")
+            return
+        self.httpd = _ThreadingHTTPServer((self.host, self.port), StatusRequestHandler)
+        self.httpd.status_server = self
+        self.port = self.httpd.server_address[1]
+        self.running = True
+        self._stop_event.clear()
+        self.server_thread = threading.Thread(target=self.httpd.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.log.info("Status server listening on %s:%d%s" % (self.host, self.port, "" if self.allow_writes else " (read only)"))
+
+    def stop(self):
+        if not self.server_thread:
+            self.log.warn("Status server thread already stopped; skipping")
+            return
+        self.running = False
+        self._stop_event.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.server_thread.join(2)
+        self.server_thread = None
+
+    def wait(self, seconds):
+        self._stop_event.wait(self.controller.clock.timeout(seconds))
+
+    def setTarget(self, value):
+        """Validates and applies a new pit target; raises ValueError when out of range"""
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or math.isnan(value):
+            raise ValueError("target must be a number")
+        if value < MIN_TARGET_TEMP or value > MAX_TARGET_TEMP:
+            raise ValueError("target must be between %d and %d" % (MIN_TARGET_TEMP, MAX_TARGET_TEMP))
+        self.controller.set_target_ambient_temp(value)
+        self.log.info("Target temperature set to %s over HTTP" % str(value))
+        return value
+
+if __name__ == "__main__":
+
+    import bbq_controller
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    port = 8080
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    bbq = bbq_controller.BBQController(log=log, simulator=True)
+    #Simulator only, so let the local curl examples set the target
+    server = StatusServer(bbq, port=port, allow_writes=True, log=log)
+    bbq.start()
+    server.start()
+    log.info("Try: curl localhost:%d/status, curl -N localhost:%d/stream?rate=2" % (server.port, server.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+        bbq.stop()
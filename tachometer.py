@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import random
+from array import array
+from collections import namedtuple
+
+from clocks import MONOTONIC_CLOCK
+
+TachReading = namedtuple("TachReading", ["rpm", "stalled", "confidence", "edges"])
+
+class Tachometer(object):
+    """Fan tach measured from edge timestamps
+
+    edge() is the GPIO callback and only stores a timestamp in a preallocated
+    ring. RPM is worked out when read, from the edge intervals inside the last
+    window seconds, using a median or trimmed mean so a few bounced or missed
+    edges do not throw the estimate off.
+    """
+    def __init__(self, pulses_per_rev=2, window=1.0, capacity=256, stall_timeout=1.0,
+                 max_rpm=10000, method="median", trim=0.2, min_edges=4, clock=MONOTONIC_CLOCK):
+        self.pulses_per_rev = pulses_per_rev
+        self.window = window
+        self.capacity = capacity
+        self.stall_timeout = stall_timeout
+        # Anything faster than max_rpm is contact bounce, not a real pulse
+        self.min_interval = 60.0 / (max_rpm * pulses_per_rev)
+        self.method = method
+        self.trim = trim
+        self.min_edges = min_edges
+        self.clock = clock
+
+        self._edges = array("d", [0.0] * capacity)
+        self._count = 0
+
+    def edge(self, channel=None):
+        self._edges[self._count % self.capacity] = self.clock()
+        self._count += 1
+
+    def _recentIntervals(self, now):
+        count = self._count
+        n = min(count, self.capacity)
+        intervals = []
+        last_edge = None
+        newer = None
+        for offset in range(1, n + 1):
+            stamp = self._edges[(count - offset) % self.capacity]
+            if last_edge == None:
+                last_edge = stamp
+            if now - stamp > self.window:
+                break
+            if newer != None:
+                interval = newer - stamp
+                if interval < self.min_interval:
+                    # Drop the bounce; measure from the earlier edge
+                    continue
+                intervals.append(interval)
+            newer = stamp
+        return intervals, last_edge
+
+    def _filter(self, intervals):
+        intervals.sort()
+        n = len(intervals)
+        if self.method == "median":
+            if n % 2:
+                return intervals[n // 2]
+            return (intervals[n // 2 - 1] + intervals[n // 2]) / 2.0
+        cut = int(n * self.trim)
+        kept = intervals[cut:n - cut] or intervals
+        return sum(kept) / float(len(kept))
+
+    def getReading(self):
+        now = self.clock()
+        intervals, last_edge = self._recentIntervals(now)
+        if last_edge == None or now - last_edge > self.stall_timeout:
+            return TachReading(0.0, True, 1.0 if last_edge != None else 0.0, 0)
+        if not intervals:
+            return TachReading(0.0, False, 0.0, 1)
+        interval = self._filter(intervals)
+        rpm = 60.0 / (interval * self.pulses_per_rev)
+        # Confidence drops with few edges and with scattered intervals (IQR over the estimate)
+        n = len(intervals)
+        spread = (intervals[(3 * n) // 4] - intervals[n // 4]) / interval if n > 1 else 1.0
+        confidence = min(1.0, len(intervals) / float(self.min_edges)) / (1.0 + spread)
+        return TachReading(rpm, False, confidence, len(intervals) + 1)
+
+    def getRPM(self):
+        return self.getReading().rpm
+
+class SimulatedEdgeSource(object):
+    """Feeds a Tachometer with edges from a fan spinning at a given RPM
+
+    Timestamps come from a fake clock, so it runs as fast as it can. bounce
+    adds a second edge shortly after some pulses and miss drops pulses.
+    """
+    def __init__(self, pulses_per_rev=2, jitter=0.02, bounce=0.0, miss=0.0, seed=None):
+        self.now = 0.0
+        self.pulses_per_rev = pulses_per_rev
+        self.jitter = jitter
+        self.bounce = bounce
+        self.miss = miss
+        self.random = random.Random(seed)
+        self.tach = None
+
+    def clock(self):
+        return self.now
+
+    def attach(self, tach):
+        tach.clock = self.clock
+        self.tach = tach
+        return tach
+
+    def run(self, rpm, duration):
+        end = self.now + duration
+        if rpm <= 0:
+            self.now = end
+            return
+        period = 60.0 / (rpm * self.pulses_per_rev)
+        while self.now + period <= end:
+            self.now += period * (1.0 + self.random.uniform(-self.jitter, self.jitter))
+            if self.random.random() < self.miss:
+                continue
+            self.tach.edge()
+            if self.random.random() < self.bounce:
+                saved = self.now
+                self.now += period * 0.01
+                self.tach.edge()
+                self.now = saved
+        self.now = end
+
+if __name__ == "__main__":
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    source = SimulatedEdgeSource(bounce=0.1, miss=0.05, seed=1)
+    tach = source.attach(Tachometer())
+    for rpm in [600, 1500, 3000, 0]:
+        source.run(rpm, 2.0)
+        log.info("Fan at %d RPM measured %s" % (rpm, str(tach.getReading())))
+
+    start_time = time.time()
+    runs = 100000
+    for x in range(runs):
+        tach.edge()
+    log.info("Edge callback takes %.2f us" % ((time.time()-start_time)*1e6/runs))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import threading
+import numpy as np
+from collections import namedtuple
+
+class StatusSnapshot(namedtuple("StatusSnapshot", ["timestamp",
+                                                    "ambient_sample_time",
+                                                    "ambient_temp",
+                                                    "meat_temp",
+                                                    "fan_duty_cycle",
+                                                    "fan_speed",
+                                                    "target_ambient_temp",
+                                                    "max_ambient_temp",
+                                                    "min_ambient_temp",
+                                                    "p_term",
+                                                    "i_term",
+                                                    "d_term",
+                                                    "pid_output",
+                                                    "sequence"])):
+    """Immutable controller status; fields are in TelemetryHistory.FIELD_NAMES order
+
+    Also indexable by field name, so code written against the old status dict
+    keeps working. sequence increases by one with every published snapshot.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._fields
+
+    def sample(self):
+        """The values stored by TelemetryHistory.append"""
+        return tuple.__getitem__(self, slice(0, -1))
+
+class TelemetryHistory(object):
+    """Fixed capacity ring buffer of controller status samples
+
+    Storage is a single preallocated NumPy structured array of twice the
+    capacity. Every sample is written to slot i and slot i+capacity, so the
+    newest n samples are always contiguous and window() can return a view
+    without copying. Appending only writes into existing rows.
+    """
+    FIELDS = [("timestamp", "f8"),
+              ("ambient_sample_time", "f8"),
+              ("ambient_temp", "f4"),
+              ("meat_temp", "f4"),
+              ("fan_duty_cycle", "f4"),
+              ("fan_speed", "f4"),
+              ("target_ambient_temp", "f4"),
+              ("max_ambient_temp", "f4"),
+              ("min_ambient_temp", "f4"),
+              ("p_term", "f4"),
+              ("i_term", "f4"),
+              ("d_term", "f4"),
+              ("pid_output", "f4")]
+    FIELD_NAMES = tuple(name for name, dtype in FIELDS)
+    DTYPE = np.dtype(FIELDS)
+
+    def __init__(self, capacity=24*60*60):
+        self.capacity = capacity
+        self._buf = np.zeros(2*capacity, dtype=TelemetryHistory.DTYPE)
+        self._head = -1
+        self._count = 0
+        self.append_lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, *values):
+        """Stores one sample; values are in FIELD_NAMES order"""
+        with self.append_lock:
+            head = self._head + 1
+            if head == self.capacity:
+                head = 0
+            self._buf[head] = values
+            self._buf[head + self.capacity] = values
+            self._head = head
+            if self._count < self.capacity:
+                self._count += 1
+
+    def latest(self):
+        """Newest sample as a NumPy record, indexable by field name, or None when empty"""
+        if self._count == 0:
+            return None
+        return self._buf[self._head + self.capacity]
+
+    def window(self, n=None):
+        """Zero-copy view of the newest n samples, oldest first"""
+        if n == None or n > self._count:
+            n = self._count
+        end = self._head + self.capacity + 1
+        return self._buf[end-n:end]
+
+    def since(self, timestamp):
+        """Zero-copy view of every sample taken at or after timestamp"""
+        win = self.window()
+        start = np.searchsorted(win["timestamp"], timestamp, side="left")
+        return win[start:]
+
+    def column(self, name, n=None):
+        return self.window(n)[name]
+
+if __name__ == "__main__":
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    history = TelemetryHistory()
+    log.info("Allocated %d bytes for %d samples" % (history._buf.nbytes, history.capacity))
+    start_time = time.time()
+    runs = 2*history.capacity + 17
+    for x in range(runs):
+        history.append(x, x, 225.0, 150.0, 40.0, 0.0, 235, 265, 205, 1.0, 2.0, 0.0, 3.0)
+    log.info("%d appends took %.2f us each" % (runs, (time.time()-start_time)*1e6/runs))
+    log.info("Latest status %s" % str(history.latest()))
+    log.info("Last 5 timestamps %s" % str(history.column("timestamp", 5)))
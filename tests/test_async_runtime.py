@@ -0,0 +1,34 @@
+import asyncio
+import logging
+
+from clocks import ScaledClock
+from async_runtime import AsyncRuntime
+
+class FlakyStatusController(object):
+    """Controller whose first status update raises"""
+    def __init__(self):
+        self.clock = ScaledClock(1000.0)
+        self.status_sleep_time = 1
+        self.updates = 0
+        self.logged = []
+
+    def update_status(self):
+        self.updates += 1
+        if self.updates == 1:
+            raise IOError("Meat probe went away")
+        return self.updates
+
+    def log_status(self, status):
+        self.logged.append(status)
+
+def test_status_logger_survives_a_failed_update():
+    controller = FlakyStatusController()
+    runtime = AsyncRuntime(controller, log=logging.getLogger("test_async_runtime"))
+    async def runFor(seconds):
+        task = asyncio.ensure_future(runtime._statusLogger())
+        await asyncio.sleep(seconds)
+        assert not task.done()
+        task.cancel()
+    asyncio.run(runFor(0.05))
+    assert controller.updates > 2
+    assert controller.logged[:2] == [2, 3]
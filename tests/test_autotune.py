@@ -0,0 +1,107 @@
+import json
+import logging
+import math
+from collections import deque
+
+import pytest
+
+from autotune import RelayAutotune, AutotuneResult, TuningProfiles, tuningGains
+
+LOG = logging.getLogger("test_autotune")
+
+def relayExperiment(tuner, rate=0.01, dead_time=20.0, dt=0.1, start=230.0, hold=50.0, limit=4*60*60):
+    """Integrating plant with dead time: dT/dt = rate * (duty - hold) seconds earlier"""
+    temp = start
+    delayed = deque([hold] * int(round(dead_time / dt)))
+    now = 0.0
+    while not tuner.finished and now < limit:
+        duty = tuner.update(temp, now)
+        delayed.append(duty)
+        temp += rate * (delayed.popleft() - hold) * dt
+        now += dt
+    return tuner.result
+
+def test_relay_finds_ku_and_pu_of_a_known_plant():
+    hysteresis, d, rate, dead_time = 2.0, 50.0, 0.01, 20.0
+    tuner = RelayAutotune(235.0, high_duty=100, low_duty=0, hysteresis=hysteresis, cycles=3, log=LOG)
+    result = relayExperiment(tuner, rate=rate, dead_time=dead_time)
+    assert result != None
+    #The pit runs on for dead_time past each switch at setpoint +/- hysteresis
+    amplitude = hysteresis + rate * d * dead_time
+    period = 4 * dead_time + 4 * hysteresis / (rate * d)
+    assert result.amplitude == pytest.approx(amplitude, rel=0.02)
+    assert result.pu == pytest.approx(period, rel=0.02)
+    assert result.ku == pytest.approx(4 * d / (math.pi * math.sqrt(amplitude ** 2 - hysteresis ** 2)), rel=0.03)
+    #Symmetric relay around the holding duty
+    assert result.bias == pytest.approx(50.0, abs=1.0)
+
+def test_gives_up_without_oscillation():
+    tuner = RelayAutotune(235.0, max_time=600, log=LOG)
+    #Fan has no effect: the pit never crosses the setpoint
+    for now in range(700):
+        tuner.update(100.0, float(now))
+    assert tuner.finished
+    assert tuner.result == None
+
+def test_tuning_rules():
+    assert tuningGains(10.0, 100.0, "ziegler_nichols") == pytest.approx((6.0, 6.0 / 50.0, 6.0 * 12.5))
+    Kp, Ki, Kd = tuningGains(10.0, 100.0, "tyreus_luyben_pi")
+    assert Kp == pytest.approx(10.0 / 3.2)
+    assert Ki == pytest.approx(Kp / 220.0)
+    assert Kd == 0.0
+
+def test_profile_round_trip(tmp_path):
+    path = str(tmp_path / "profiles.json")
+    result = AutotuneResult(4.8, 300.0, 5.2, 21.5, 3)
+    profiles = TuningProfiles(path, log=LOG)
+    saved = profiles.save("kamado", result, tuned_at=1000.0)
+    profiles.save("drum", AutotuneResult(2.0, 500.0, 9.0, 35.0, 3), rule="ziegler_nichols_pi", tuned_at=2000.0)
+    assert not (tmp_path / "profiles.json.tmp").exists()
+
+    loaded = TuningProfiles(path, log=LOG)
+    assert loaded.names() == ["drum", "kamado"]
+    entry = loaded.get("kamado")
+    assert entry == saved
+    assert (entry["Kp"], entry["Ki"], entry["Kd"]) == pytest.approx(result.gains())
+    assert entry["bias"] == 21.5
+    assert loaded.get("drum")["rule"] == "ziegler_nichols_pi"
+    with pytest.raises(KeyError):
+        loaded.get("offset")
+    with open(path) as f:
+        assert json.load(f)["kamado"]["tuned_at"] == 1000.0
+
+def test_controller_loads_a_profile(tmp_path):
+    import bbq_controller
+    profiles = TuningProfiles(str(tmp_path / "profiles.json"), log=LOG)
+    profiles.save("kamado", AutotuneResult(4.8, 300.0, 5.2, 21.5, 3))
+    bbq = bbq_controller.BBQController(log=LOG, simulator=True)
+    bbq.load_profile(TuningProfiles(profiles.path, log=LOG), "kamado")
+    Kp, Ki, Kd = AutotuneResult(4.8, 300.0, 5.2, 21.5, 3).gains()
+    assert (bbq.pid.Kp, bbq.pid.Ki, bbq.pid.Kd) == pytest.approx((Kp, Ki, Kd))
+    #Integrator preloaded to the bias and bounded at integral_headroom times it
+    assert bbq.pid.Ki * bbq.pid.ITerm == pytest.approx(21.5)
+    assert bbq.pid.Ki * bbq.pid.windup_guard == pytest.approx(bbq.integral_headroom * 21.5)
+
+def test_controller_times_the_relay_on_the_monotonic_clock():
+    import bbq_controller
+    from therm_sampler import ThermReading
+    bbq = bbq_controller.BBQController(log=LOG, simulator=True)
+    bbq.target_ambient_temp = 235.0
+    bbq.start_autotune(hysteresis=2.0, cycles=3)
+    tuner = bbq.autotune
+    rate, dead_time, dt = 0.01, 20.0, 0.5
+    temp = 230.0
+    delayed = deque([50.0] * int(round(dead_time / dt)))
+    wall, monotonic, sequence = 1000000.0, 0.0, 0
+    while not tuner.finished and monotonic < 4*60*60:
+        sequence += 1
+        bbq.run_pid(ThermReading(wall, temp, sequence, monotonic))
+        delayed.append(bbq.fan.getDutyCycle())
+        temp += rate * (delayed.popleft() - 50.0) * dt
+        monotonic += dt
+        wall += dt
+        if sequence == 800:
+            #NTP steps the wall clock back an hour mid experiment
+            wall -= 3600.0
+    assert tuner.result != None
+    assert tuner.result.pu == pytest.approx(4 * dead_time + 4 * 2.0 / (rate * 50.0), rel=0.03)
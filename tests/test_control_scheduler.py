@@ -0,0 +1,78 @@
+import logging
+
+import pytest
+
+from clocks import RealClock
+from control_scheduler import SampleScheduler
+from therm_sampler import ThermReading
+
+class StubClock(RealClock):
+    def __init__(self):
+        self.wall = 1000000.0
+        self.mono = 0.0
+
+    def time(self):
+        return self.wall
+
+    def monotonic(self):
+        return self.mono
+
+class ScriptedSampler(object):
+    """Hands out a fixed series of wait_for_reading results, then stops the scheduler"""
+    def __init__(self, clock, script):
+        self.clock = clock
+        self.script = list(script)
+        self.scheduler = None
+
+    def latest(self):
+        return None
+
+    def wake(self):
+        pass
+
+    def wait_for_reading(self, sequence, timeout=None):
+        if not self.script:
+            self.scheduler._enable = False
+            return None
+        reading = self.script.pop(0)
+        if reading != None:
+            #The step finishes 10ms after the reading was taken
+            self.clock.wall = reading.timestamp + 0.01
+            self.clock.mono = reading.monotonic + 0.01
+        return reading
+
+def runScript(script, period=1.0):
+    clock = StubClock()
+    sampler = ScriptedSampler(clock, script)
+    steps = []
+    scheduler = SampleScheduler(sampler, steps.append, period, log=logging.getLogger("test_control_scheduler"), clock=clock)
+    sampler.scheduler = scheduler
+    scheduler._enable = True
+    scheduler.run_scheduler()
+    return scheduler, steps
+
+def test_deadlines_and_skipped_samples():
+    scheduler, steps = runScript([ThermReading(1000.0, 225.0, 1, 0.0),
+                                  #Wall clock stepped back an hour: neither a miss nor a negative latency
+                                  ThermReading(-2599.0, 225.0, 2, 1.0),
+                                  #Nothing within the deadline: one miss, not another when the reading comes
+                                  None,
+                                  ThermReading(-2595.0, 225.0, 3, 5.0),
+                                  #Two samples never reached the scheduler
+                                  ThermReading(-2594.0, 225.0, 6, 6.0),
+                                  #2s after the last one with 1.5s allowed
+                                  ThermReading(-2592.0, 225.0, 7, 8.0)])
+    assert [reading.sequence for reading in steps] == [1, 2, 3, 6, 7]
+    stats = scheduler.getStats()
+    assert stats["steps"] == 5
+    assert stats["missed_deadlines"] == 2
+    assert stats["skipped_samples"] == 2
+    assert stats["last_latency"] == pytest.approx(0.01)
+    assert stats["max_latency"] == pytest.approx(0.01)
+
+def test_wall_clock_jump_forward_is_not_a_miss():
+    scheduler, steps = runScript([ThermReading(1000.0, 225.0, 1, 0.0),
+                                  ThermReading(4601.0, 225.0, 2, 1.0),
+                                  ThermReading(4602.0, 225.0, 3, 2.0)])
+    assert scheduler.missed_deadlines == 0
+    assert scheduler.skipped_samples == 0
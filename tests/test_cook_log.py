@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+from cook_log import CookLogWriter, readCookLog
+
+def record(x):
+    return (x, x, 225.0, 150.0, 40.0, 0.0, 235, 265, 205, 1.0, 2.0, 0.0, 3.0)
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / "cook.bbqlog")
+
+def test_records_round_trip(log_path):
+    writer = CookLogWriter(log_path, batch_records=7)
+    for x in range(20):
+        writer.write(record(x))
+    writer.close()
+    records = readCookLog(log_path)
+    assert records["timestamp"].tolist() == list(range(20))
+    assert records["ambient_temp"].tolist() == [225.0] * 20
+
+def test_writes_after_close_are_dropped(log_path):
+    writer = CookLogWriter(log_path)
+    writer.write(record(0))
+    writer.close()
+    writer.write(record(1))
+    writer.flush()
+    writer.close()
+    assert len(readCookLog(log_path)) == 1
+
+def test_close_while_another_thread_writes(log_path):
+    writer = CookLogWriter(log_path, batch_records=1)
+    errors = []
+    def writeAll():
+        try:
+            for x in range(5000):
+                writer.write(record(x))
+        except Exception as e:
+            errors.append(e)
+    thread = threading.Thread(target=writeAll)
+    thread.start()
+    writer.close()
+    thread.join()
+    assert errors == []
+    assert readCookLog(log_path)["timestamp"].tolist() == list(range(len(readCookLog(log_path))))
+
+class BrokenLog(object):
+    def write(self, values):
+        raise IOError("No space left on device")
+
+class BrokenUploader(object):
+    connected = False
+    def enqueue(self, values):
+        raise IOError("Spool is read-only")
+
+def test_log_status_survives_broken_sinks():
+    import bbq_controller
+    bbq = bbq_controller.BBQController(simulator=True)
+    bbq.sensors.getProbe("ambient").sampler.sample()
+    status = bbq.update_status()
+    bbq.cook_log = BrokenLog()
+    bbq.uploader = BrokenUploader()
+    bbq.log_status(status)
+    assert bbq.local_status
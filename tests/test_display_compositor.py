@@ -0,0 +1,77 @@
+import logging
+
+from clocks import RealClock
+from display_compositor import DisplayCompositor
+
+class StubFramebuffer(object):
+    def __init__(self):
+        self.lines = {}
+        self.dirty = False
+
+    def setLine(self, slot, text, x=0, y=0):
+        self.lines[slot] = text
+        self.dirty = True
+
+    def setCursor(self, x0, x1, y):
+        pass
+
+    def isDirty(self):
+        return self.dirty
+
+    def frame(self):
+        self.dirty = False
+        return dict(self.lines)
+
+class StubRenderer(object):
+    def __init__(self):
+        self.frames = []
+
+    def renderFrame(self, frame):
+        self.frames.append(frame)
+        return 1
+
+class SteppedClock(RealClock):
+    def __init__(self):
+        self.wall = 1000000.0
+        self.mono = 0.0
+
+    def time(self):
+        return self.wall
+
+    def monotonic(self):
+        return self.mono
+
+def makeCompositor(clock=None):
+    if clock == None:
+        clock = RealClock()
+    return DisplayCompositor(StubFramebuffer(), StubRenderer(), fps=10, log=logging.getLogger("test_display_compositor"), clock=clock)
+
+def test_failed_update_does_not_stop_the_compositor():
+    compositor = makeCompositor()
+    compositor.start()
+    try:
+        def clearPanel():
+            raise IOError("I2C write failed")
+        compositor.submit(clearPanel)
+        compositor.setLine("header", "12:00:00 Good")
+        assert compositor.sync()
+        assert compositor.compositor_thread.is_alive()
+        assert compositor.renderer.frames[-1] == {"header": "12:00:00 Good"}
+        #setLine and the sync waiter; the failed update is not counted
+        assert compositor.updates_applied == 2
+    finally:
+        compositor.stop()
+
+def test_wall_clock_step_does_not_hold_flushes():
+    clock = SteppedClock()
+    compositor = makeCompositor(clock)
+    compositor.setLine(0, "one")
+    compositor.composite()
+    assert len(compositor.renderer.frames) == 1
+    #NTP sets the wall clock back an hour; the next frame is still due 1/fps later
+    clock.wall -= 3600.0
+    clock.mono += 0.1
+    compositor.setLine(0, "two")
+    wake_at = compositor.composite()
+    assert compositor.renderer.frames[-1] == {0: "two"}
+    assert wake_at <= clock.mono + 0.2
@@ -0,0 +1,61 @@
+import pytest
+
+from feed_forward import CookerModel, DutyDither
+
+def test_interval_mean_duty_has_no_lag():
+    model = CookerModel(interval=10.0)
+    model.update(200.0, 0, 0.0)
+    #40% for the first 4 seconds, then 90% for the next 6
+    for now in range(1, 5):
+        model.update(200.0, 40, float(now))
+    for now in range(5, 11):
+        model.update(200.0, 90, float(now))
+    assert model.inputs[0] == pytest.approx((40 * 4 + 90 * 6) / 10.0)
+
+def test_learns_the_steady_state_duty():
+    #T[k+1] = 0.9 T[k] + 0.5 u[k] + 8: holding 200F takes 24% duty
+    model = CookerModel(interval=1.0, input_taps=1, min_samples=10)
+    temp = 150.0
+    model.update(temp, 0, 0.0)
+    for k in range(200):
+        duty = 20 + (k * 7) % 30
+        temp = 0.9 * temp + 0.5 * duty + 8.0
+        model.update(temp, duty, float(k + 1))
+    assert model.ready()
+    assert model.steadyStateDuty(200.0) == pytest.approx(24.0, abs=0.1)
+
+def test_dither_keeps_the_mean_duty():
+    dither = DutyDither(min_duty_cycle=25, period=20.0)
+    duties = [dither.convert(10.0, float(now)) for now in range(200)]
+    assert set(duties) == set([0, 25])
+    assert sum(duties) / float(len(duties)) == pytest.approx(10.0)
+    assert dither.convert(60.0, 200.0) == 60
+
+class ConstantPID(object):
+    """Stand-in PID whose output is fixed, so the dither alone sets the duty"""
+    def __init__(self, output):
+        self.output = output
+        self.SetPoint = 235.0
+        self.PTerm = self.ITerm = self.DTerm = 0.0
+        self.Ki = self.Kd = 0.0
+
+    def update(self, feedback_value, dt=None):
+        pass
+
+def test_controller_feed_forward_ignores_wall_clock_steps():
+    import logging
+    import bbq_controller
+    from therm_sampler import ThermReading
+    bbq = bbq_controller.BBQController(log=logging.getLogger("test_feed_forward"), simulator=True, pid=ConstantPID(10.0))
+    bbq.start_feed_forward(dither_period=20.0)
+    wall = 1000000.0
+    duties = []
+    for now in range(400):
+        if now == 100:
+            #NTP steps the wall clock back an hour
+            wall -= 3600.0
+        bbq.run_pid(ThermReading(wall + now, 230.0, now + 1, float(now)))
+        duties.append(bbq.fan.getDutyCycle())
+    assert bbq.feed_forward.last_time == 399.0
+    #Dithering carries on through the step at the same mean duty
+    assert sum(duties[100:]) / 300.0 == pytest.approx(10.0, abs=0.5)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from frame_recorder import FrameRecorder, readFrames
+
+def makeFrame(x):
+    frame = np.zeros((8, 128), dtype=np.uint8)
+    frame[x % 8, x % 128] = 0xff
+    frame[0, 0] = x
+    return frame
+
+def test_dump_round_trip(tmp_path):
+    recorder = FrameRecorder(capacity=10)
+    for x in range(4):
+        recorder.record(makeFrame(x), 100.0 + x)
+    path = str(tmp_path / "frames.bin")
+    assert recorder.dump(path) == 4
+    timestamps, frames = readFrames(path)
+    assert timestamps.tolist() == [100.0, 101.0, 102.0, 103.0]
+    for x in range(4):
+        assert np.array_equal(frames[x], makeFrame(x))
+
+def test_dump_round_trip_after_the_ring_wraps(tmp_path):
+    recorder = FrameRecorder(capacity=5)
+    for x in range(13):
+        recorder.record(makeFrame(x), 100.0 + x)
+    path = str(tmp_path / "frames.bin")
+    assert recorder.dump(path) == 5
+    timestamps, frames = readFrames(path)
+    #Only the last capacity frames survive, oldest first
+    assert timestamps.tolist() == [108.0, 109.0, 110.0, 111.0, 112.0]
+    for idx, x in enumerate(range(8, 13)):
+        assert np.array_equal(frames[idx], makeFrame(x))
+
+def test_empty_dump_and_bad_magic(tmp_path):
+    path = str(tmp_path / "frames.bin")
+    assert FrameRecorder().dump(path) == 0
+    timestamps, frames = readFrames(path)
+    assert len(timestamps) == 0 and frames.shape == (0, 8, 128)
+    with open(path, "r+b") as f:
+        f.write(b"NOTAREC!")
+    with pytest.raises(ValueError):
+        readFrames(path)
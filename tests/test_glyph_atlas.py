@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("PIL")
+from PIL import Image, ImageDraw, ImageFont
+
+from glyph_atlas import GlyphAtlas, TextFramebuffer
+from oled_renderer import packImage
+
+HEADER = "18:42:07 Good"
+MENU = ["> Current Temp: 225.0",
+        "  Target Temp: 235",
+        "  Enable: Off",
+        "  Options",
+        "  Wifi: jiffy/guest, 90%"]
+
+@pytest.fixture(scope="module")
+def font():
+    return ImageFont.load_default()
+
+def pilFrame(font, lines, cursor=None):
+    image = Image.new('1', (128, 64))
+    draw = ImageDraw.Draw(image)
+    for text, x, y in lines:
+        draw.text((x, y), text, font=font, fill=255)
+    if cursor != None:
+        x0, x1, y = cursor
+        draw.line((x0, y, x1, y), fill=255)
+    return packImage(image)
+
+def test_menu_matches_pil(font):
+    fb = TextFramebuffer(GlyphAtlas(font))
+    lines = [(HEADER, 0, 0)] + [(text, 0, idx * 8 + 16) for idx, text in enumerate(MENU)]
+    for slot, (text, x, y) in enumerate(lines):
+        fb.setLine(slot, text, x, y)
+    fb.setCursor(0, 5, 25)
+    assert np.array_equal(fb.frame(), pilFrame(font, lines, (0, 5, 25)))
+
+@pytest.mark.parametrize("text, x", [("/,;", 4), ("/,;", 0), ("a/x\\]", 10), ("ffff", 120), ("jW_", 60)])
+def test_overhanging_glyphs_match_pil(font, text, x):
+    fb = TextFramebuffer(GlyphAtlas(font))
+    fb.setLine(0, text, x, 20)
+    assert np.array_equal(fb.frame(), pilFrame(font, [(text, x, 20)]))
+
+def test_unchanged_line_is_skipped(font):
+    fb = TextFramebuffer(GlyphAtlas(font))
+    assert fb.setLine(0, "  Options", 0, 16)
+    fb.frame()
+    assert not fb.setLine(0, "  Options", 0, 16)
+    assert not fb.isDirty()
+    assert fb.lines_skipped == 1
@@ -0,0 +1,81 @@
+import logging
+
+from clocks import RealClock
+from gpio_output import CachedOutput, RelayGovernor
+from hal import FakeGPIO
+
+class StepClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_repeated_writes_are_suppressed():
+    gpio = FakeGPIO()
+    output = CachedOutput(gpio.pwmWrite, gpio.digitalWrite)
+    assert output.pwmWrite(18, 64)
+    assert not output.pwmWrite(18, 64)
+    assert output.pwmWrite(18, 65)
+    assert output.digitalWrite(27, 1)
+    assert not output.digitalWrite(27, 1)
+    #The same value on another pin is a different register
+    assert output.pwmWrite(19, 65)
+    assert gpio.callCount("pwmWrite") == 3
+    assert gpio.callCount("digitalWrite") == 1
+    assert output.getStats() == {"writes_performed": 4, "writes_avoided": 2}
+    output.invalidate(18)
+    assert output.pwmWrite(18, 65)
+    assert not output.digitalWrite(27, 1)
+
+def test_relay_waits_off_delay_before_turning_off():
+    clock = StepClock()
+    relay = RelayGovernor(off_delay=30.0, min_toggle_interval=0.0, clock=clock)
+    assert relay.update(True)
+    #Demand drops out at 1s and blips back at 20s, which restarts the delay
+    for now in range(1, 50):
+        clock.now = float(now)
+        assert relay.update(now == 20)
+    clock.now = 50.0
+    assert relay.update(False)
+    clock.now = 51.0
+    assert not relay.update(False)
+    assert relay.toggles == 2
+
+def test_relay_toggles_at_most_every_min_toggle_interval():
+    clock = StepClock()
+    relay = RelayGovernor(off_delay=0.0, min_toggle_interval=10.0, clock=clock)
+    assert relay.update(True)
+    clock.now = 1.0
+    assert relay.update(False)
+    assert relay.toggles_suppressed == 1
+    clock.now = 10.0
+    assert not relay.update(False)
+    clock.now = 12.0
+    assert not relay.update(True)
+    clock.now = 20.0
+    assert relay.update(True)
+    assert relay.toggles == 3
+
+class SteppedClock(RealClock):
+    def __init__(self):
+        self.mono = 0.0
+
+    def monotonic(self):
+        return self.mono
+
+def test_fan_uses_the_controllers_clock():
+    from fan_controller import PWMFanController
+    clock = SteppedClock()
+    gpio = FakeGPIO()
+    fan = PWMFanController(logging.getLogger("test_gpio_output"), gpio=gpio, clock=clock)
+    fan.setDutyCycle(40)
+    assert fan.power_state == 1
+    clock.mono += 5.0
+    fan.setDutyCycle(0)
+    #The off delay runs on the injected clock, so a scaled clock shortens it too
+    clock.mono += fan.relay.off_delay
+    fan.setDutyCycle(0)
+    assert fan.power_state == 0
+    gpio.edge(PWMFanController.TACH_PIN)
+    assert fan.tach._edges[0] == clock.mono
@@ -0,0 +1,61 @@
+import pytest
+
+from metrics import Histogram, MetricsRegistry, NULL_METRIC
+
+def test_bucket_boundaries():
+    hist = Histogram("step_seconds", lowest=1.0, highest=1024.0)
+    #Eight linear buckets per power of two, each closed below
+    for value, idx in ((0.5, 0), (1.0, 0), (1.01, 1), (1.124, 1), (1.125, 2), (1.99, 8), (2.0, 9), (3.0, 13), (1000.0, 80)):
+        before = list(hist.counts)
+        hist.observe(value)
+        assert [i for i in range(len(hist.counts)) if hist.counts[i] != before[i]] == [idx], value
+    assert hist._upperBound(0) == 1.0
+    assert hist._upperBound(1) == 1.125
+    assert hist._upperBound(9) == 2.25
+    assert hist._upperBound(80) == 1024.0
+
+def test_values_past_highest_go_to_the_inf_bucket():
+    hist = Histogram("step_seconds", lowest=1.0, highest=1024.0)
+    hist.observe(5000.0)
+    assert hist.counts[-1] == 1
+    assert hist._upperBound(len(hist.counts) - 1) == float("inf")
+    #Reported as the largest value seen rather than a made up bound
+    assert hist.percentile(1.0) == 5000.0
+
+def test_count_sum_and_percentiles():
+    hist = Histogram("step_seconds")
+    for x in range(1, 1001):
+        hist.observe(x * 1e-6)
+    assert hist.count == 1000
+    assert hist.sum == pytest.approx(500500e-6)
+    assert hist.max == 1000e-6
+    #Within one sub-bucket (12.5%) above the exact value
+    for q, exact in ((0.5, 500e-6), (0.9, 900e-6), (0.99, 990e-6)):
+        assert exact <= hist.percentile(q) <= exact * 1.125
+    assert hist.percentile(1.0) == 1000e-6
+
+def test_exposition_text():
+    registry = MetricsRegistry(enabled=True)
+    hist = registry.histogram("bbq_read_seconds", 'Read time\\with "quotes"\nand a newline', labels={"sensor": 'a"b\\c\nd'})
+    hist.observe(0.5)
+    hist.observe(float("inf"))
+    registry.counter("bbq_edges_total", "Edges").inc(3)
+    lines = registry.exposition().splitlines()
+    assert lines[0] == "# HELP bbq_edges_total Edges"
+    assert lines[1] == "# TYPE bbq_edges_total counter"
+    assert lines[2] == "bbq_edges_total 3.0"
+    assert lines[3] == '# HELP bbq_read_seconds Read time\\\\with "quotes"\\nand a newline'
+    assert lines[4] == "# TYPE bbq_read_seconds summary"
+    labels = 'sensor="a\\"b\\\\c\\nd"'
+    sample, value = lines[5].rsplit(" ", 1)
+    assert sample == 'bbq_read_seconds{%s,quantile="0.5"}' % labels
+    assert 0.5 <= float(value) <= 0.5 * 1.125
+    assert lines[6] == 'bbq_read_seconds{%s,quantile="0.9"} +Inf' % labels
+    assert lines[9] == 'bbq_read_seconds_sum{%s} +Inf' % labels
+    assert lines[10] == 'bbq_read_seconds_count{%s} 2.0' % labels
+    assert len(lines) == 11
+
+def test_disabled_registry_hands_out_the_null_metric():
+    registry = MetricsRegistry()
+    assert registry.histogram("bbq_read_seconds") is NULL_METRIC
+    assert registry.exposition() == "\n"
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from hal import FakeSSD1306
+from oled_renderer import DirtyPageRenderer, SSD1306_COLUMNADDR, SSD1306_PAGEADDR
+
+def setWindow(disp, col_start, col_end, page_start, page_end):
+    for c in (SSD1306_COLUMNADDR, col_start, col_end, SSD1306_PAGEADDR, page_start, page_end):
+        disp.command(c)
+
+def test_gram_pointer_wraps_inside_the_window():
+    disp = FakeSSD1306()
+    setWindow(disp, 10, 13, 2, 3)
+    #Two pages of four columns, then wrapped back to the window's first byte
+    disp.writeData(bytearray(range(1, 11)))
+    assert disp.gram[2, 10:14].tolist() == [9, 10, 3, 4]
+    assert disp.gram[3, 10:14].tolist() == [5, 6, 7, 8]
+    assert disp.gram[1].sum() == 0 and disp.gram[4].sum() == 0
+    assert disp.gram[2, 9] == 0 and disp.gram[2, 14] == 0
+
+def test_only_changed_spans_are_sent():
+    disp = FakeSSD1306()
+    renderer = DirtyPageRenderer(disp)
+    frame = np.zeros((8, 128), dtype=np.uint8)
+    assert renderer.renderFrame(frame) == 1024
+    assert renderer.renderFrame(frame) == 0
+    #A cursor underline: one page, six columns
+    frame[4, 18:24] = 0x02
+    assert renderer.renderFrame(frame) == 6
+    frame[0, 0] = 0xff
+    frame[0, 127] = 0xff
+    frame[7, 64] = 0x80
+    assert renderer.renderFrame(frame) == 128 + 1
+    assert renderer.getStats()["frames_skipped"] == 1
+    assert np.array_equal(disp.gram, frame)
+
+def test_random_frames_keep_gram_in_sync():
+    rng = np.random.RandomState(7)
+    disp = FakeSSD1306()
+    renderer = DirtyPageRenderer(disp)
+    frame = np.zeros((8, 128), dtype=np.uint8)
+    for x in range(50):
+        for y in range(rng.randint(0, 5)):
+            frame[rng.randint(8), rng.randint(128)] = rng.randint(256)
+        renderer.renderFrame(frame)
+        assert np.array_equal(disp.gram, frame)
+
+def test_invalidate_resends_everything():
+    disp = FakeSSD1306()
+    renderer = DirtyPageRenderer(disp)
+    frame = np.ones((8, 128), dtype=np.uint8)
+    renderer.renderFrame(frame)
+    renderer.invalidate()
+    assert renderer.renderFrame(frame) == 1024
+    renderer.invalidate(blank=True)
+    assert renderer.renderFrame(frame) == 1024
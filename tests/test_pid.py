@@ -0,0 +1,125 @@
+import pytest
+
+from pid_controller import PID
+from scheduled_pid import ScheduledPID
+from clocks import RealClock
+
+class SteppedClock(RealClock):
+    """Clock set by hand; time() and monotonic() move independently"""
+    def __init__(self, wall=1000.0, monotonic=0.0):
+        self.wall = wall
+        self.mono = monotonic
+
+    def time(self):
+        return self.wall
+
+    def monotonic(self):
+        return self.mono
+
+    def sleep(self, seconds):
+        self.wall += seconds
+        self.mono += seconds
+
+def makePID(clock, Kp=1.0, Ki=0.5, Kd=2.0, pid_class=PID):
+    if pid_class == PID:
+        pid = PID(Kp, Ki, Kd, clock=clock)
+    else:
+        pid = pid_class(clock=clock)
+    pid.SetPoint = 100.0
+    return pid
+
+def test_explicit_dt_ignores_the_clock():
+    pid = makePID(lambda: 0.0)
+    pid.update(90.0, 2.0)
+    assert pid.ITerm == pytest.approx(20.0)
+    assert pid.DTerm == pytest.approx(5.0)
+    assert pid.output == pytest.approx(10.0 + 0.5 * 20.0 + 2.0 * 5.0)
+    pid.update(94.0, 4.0)
+    assert pid.last_time == pytest.approx(6.0)
+    assert pid.DTerm == pytest.approx(-1.0)
+
+def test_dt_is_measured_on_the_clock():
+    clock = SteppedClock()
+    pid = makePID(clock.monotonic)
+    clock.mono += 3.0
+    pid.update(96.0)
+    assert pid.ITerm == pytest.approx(12.0)
+    assert pid.last_time == pytest.approx(3.0)
+
+def test_clock_stepping_back_restarts_the_time_base():
+    times = [100.0]
+    pid = makePID(lambda: times[0], Kd=0.0)
+    pid.setWindup(1000.0)
+    times[0] = 102.0
+    pid.update(90.0)
+    output = pid.output
+    times[0] = 50.0
+    pid.update(0.0)
+    #Nothing integrated or recomputed for the backwards step
+    assert pid.output == output
+    assert pid.ITerm == pytest.approx(20.0)
+    times[0] = 51.0
+    pid.update(90.0)
+    assert pid.ITerm == pytest.approx(30.0)
+
+def test_update_many_matches_update():
+    temps = [70.0, 90.0, 120.0, 180.0, 230.0, 240.0, 236.0]
+    one = makePID(lambda: 0.0)
+    expected = []
+    for temp in temps:
+        one.update(temp, 1.5)
+        expected.append(one.output)
+    many = makePID(lambda: 0.0)
+    assert many.update_many(temps, dt=1.5) == pytest.approx(expected)
+    assert many.ITerm == pytest.approx(one.ITerm)
+
+def replayOneByOne(temps, intervals):
+    pid = makePID(lambda: 0.0)
+    outputs = []
+    for idx in range(len(temps)):
+        pid.update(temps[idx], intervals[idx])
+        outputs.append(pid.output)
+    return pid, outputs
+
+def test_update_many_takes_numpy_arrays():
+    import numpy as np
+    temps = [70.0, 90.0, 120.0, 180.0, 230.0, 240.0, 236.0]
+    intervals = [1.0, 2.0, 1.0, 0.5, 3.0, 1.0, 2.0]
+    one, expected = replayOneByOne(temps, intervals)
+    many = makePID(lambda: 0.0)
+    assert many.update_many(np.array(temps), dt=np.array(intervals)) == pytest.approx(expected)
+    assert many.ITerm == pytest.approx(one.ITerm)
+    many = makePID(lambda: 0.0)
+    assert many.update_many(np.array(temps), dt=np.float64(1.5)) == pytest.approx(replayOneByOne(temps, [1.5] * 7)[1])
+
+def test_update_many_replays_a_cook_log(tmp_path):
+    from cook_log import CookLogWriter, readCookLog
+    temps = [70.0, 90.0, 120.0, 180.0, 230.0, 240.0, 236.0]
+    intervals = [0.0, 2.0, 1.0, 0.5, 3.0, 1.0, 2.0]
+    path = str(tmp_path / "cook.bbqlog")
+    writer = CookLogWriter(path)
+    now = 1000.0
+    for idx in range(len(temps)):
+        now += intervals[idx]
+        writer.write((now, now, temps[idx], 150.0, 40.0, 0.0, 235, 265, 205, 0.0, 0.0, 0.0, 0.0))
+    writer.close()
+    records = readCookLog(path)
+    one, expected = replayOneByOne(temps, intervals)
+    for pid_class in (PID, ScheduledPID):
+        replay = makePID(lambda: 0.0, pid_class=pid_class)
+        outputs = replay.update_many(records["ambient_temp"], timestamps=records["timestamp"])
+        if pid_class == PID:
+            assert outputs == pytest.approx(expected)
+        assert len(outputs) == len(temps)
+        assert replay.last_time == pytest.approx(now)
+
+def test_controller_pid_ignores_wall_clock_steps():
+    import bbq_controller
+    clock = SteppedClock()
+    bbq = bbq_controller.BBQController(simulator=True, clock=clock)
+    pid = bbq.pid
+    clock.mono += 2.0
+    clock.wall -= 3600.0
+    pid.update(230.0)
+    assert pid.last_time == pytest.approx(2.0)
+    assert pid.ITerm == pytest.approx(2.0 * (bbq.target_ambient_temp - 230.0))
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from pid_controller import PID
+from pid_sweep import BatchPID, responseMetrics, replay, sweep
+
+def test_metrics_of_a_known_step_response():
+    temps = [[200.0, 230.0, 245.0, 240.0, 236.0, 235.0, 235.0, 235.0],
+             #Never settles: still outside the band at the end
+             [200.0, 210.0, 220.0, 225.0, 228.0, 229.0, 229.5, 229.9],
+             #Inside the band throughout, never above the setpoint
+             [234.0, 233.0, 234.0, 235.0, 235.0, 235.0, 235.0, 235.0]]
+    metrics = responseMetrics(np.array(temps), 235.0, 2.0)
+    assert metrics["overshoot"].tolist() == [10.0, 0.0, 0.0]
+    #Last outside +/-5F at sample 2, so settled from 3 * dt
+    assert metrics["settling_time"].tolist() == [6.0, np.inf, 0.0]
+    assert metrics["iae"].tolist() == pytest.approx([(35 + 5 + 10 + 5 + 1) * 2.0,
+                                                     (35 + 25 + 15 + 10 + 7 + 6 + 5.5 + 5.1) * 2.0,
+                                                     (1 + 2 + 1) * 2.0])
+
+def test_batch_matches_the_scalar_pid():
+    gains = [(6.0, 0.02, 0.0), (2.0, 0.01, 5.0), (10.0, 0.05, 1.0)]
+    temps = [70.0 + 3.0 * x for x in range(60)] + [250.0 - 0.5 * x for x in range(60)]
+    batch = BatchPID(*zip(*gains), setpoint=235.0)
+    outputs = replay(batch, temps, 2.0)
+    for idx in range(len(gains)):
+        pid = PID(*gains[idx], clock=lambda: 0.0)
+        pid.SetPoint = 235.0
+        expected = []
+        for temp in temps:
+            pid.update(temp, 2.0)
+            expected.append(pid.output)
+        assert outputs[idx].tolist() == pytest.approx(expected)
+
+def test_sweep_ranks_by_iae():
+    results = sweep([1.0, 6.0, 20.0], [0.0, 0.02], duration=2*60*60)
+    assert len(results["iae"]) == 6
+    assert np.all(np.diff(results["iae"]) >= 0)
+    #Each row keeps its own gains and metrics: rerunning one candidate alone gives the same numbers
+    for row in (0, 5):
+        alone = sweep([results["Kp"][row]], [results["Ki"][row]], duration=2*60*60)
+        for key in ("iae", "overshoot", "settling_time"):
+            assert alone[key][0] == pytest.approx(results[key][row])
+    #A Kp of 1 barely opens the fan, so those candidates rank last whatever Ki is
+    assert results["Kp"][-2:].tolist() == [1.0, 1.0]
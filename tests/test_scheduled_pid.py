@@ -0,0 +1,164 @@
+import logging
+
+import pytest
+
+from scheduled_pid import ScheduledPID, GainBand
+
+BANDS = (GainBand(25.0, 8.0, 0.0, 0.0),
+         GainBand(-10.0, 1.5, 0.005, 0.0),
+         GainBand(float("-inf"), 2.5, 0.005, 0.0))
+
+def makePID(bands=BANDS, **kwargs):
+    pid = ScheduledPID(bands=bands, clock=lambda: 0.0, log=logging.getLogger("test_scheduled_pid"), **kwargs)
+    pid.SetPoint = 235.0
+    return pid
+
+def hold(pid, temp, seconds):
+    for x in range(int(seconds)):
+        pid.update(temp, 1.0)
+
+def test_band_changes_need_hysteresis():
+    pid = makePID(hysteresis=2.0)
+    assert pid.band == 2
+    #Error 9: inside the near band's edge (-10) but not past it by the hysteresis
+    hold(pid, 235.0 + 9.0, 1)
+    assert pid.band == 2
+    hold(pid, 235.0 + 7.0, 1)
+    assert pid.band == 1
+    assert (pid.Kp, pid.Ki) == (1.5, 0.005)
+    #Back up to error 24 and 26: the far band needs 27
+    hold(pid, 235.0 - 26.0, 1)
+    assert pid.band == 1
+    hold(pid, 235.0 - 27.5, 1)
+    assert pid.band == 0
+    assert pid.Kp == 8.0
+    #And down again only below 23
+    hold(pid, 235.0 - 24.0, 1)
+    assert pid.band == 0
+    hold(pid, 235.0 - 22.0, 1)
+    assert pid.band == 1
+
+def test_band_change_keeps_the_integral_contribution():
+    pid = makePID(bands=(GainBand(-10.0, 1.5, 0.005, 0.0), GainBand(float("-inf"), 2.5, 0.01, 0.0)),
+                  disturbance_rate=float("inf"))
+    hold(pid, 230.0, 100)
+    assert pid.band == 0
+    contribution = pid.Ki * pid.ITerm
+    hold(pid, 235.0 + 12.5, 1)
+    assert pid.band == 1
+    #One more second of integration at the new gain on top of the same contribution
+    assert pid.Ki * pid.ITerm == pytest.approx(contribution + 0.01 * -12.5)
+
+def test_disturbance_freezes_the_integrator():
+    pid = makePID(slope_window=30.0, disturbance_rate=0.5, settle_band=10.0)
+    unfrozen = makePID(slope_window=30.0, disturbance_rate=float("inf"))
+    for p in (pid, unfrozen):
+        hold(p, 233.0, 60)
+    assert not pid.disturbance
+    #Lid open: the pit falls 1F/s, away from the setpoint, staying in the near band
+    temp = 233.0
+    for x in range(20):
+        temp -= 1.0
+        pid.update(temp, 1.0)
+        unfrozen.update(temp, 1.0)
+    assert pid.band == 1
+    assert pid.disturbance
+    assert pid.disturbance_count == 1
+    frozen = pid.ITerm
+    assert frozen < unfrozen.ITerm
+    hold(pid, temp, 30)
+    assert pid.band == 1
+    assert pid.ITerm == frozen
+    #Released once the pit is back within settle_band
+    hold(pid, 230.0, 1)
+    assert not pid.disturbance
+    hold(pid, 230.0, 1)
+    assert pid.ITerm > frozen
+
+def test_slope_tracks_a_ramp():
+    pid = makePID(slope_window=30.0, disturbance_rate=float("inf"))
+    temp = 150.0
+    for x in range(60):
+        temp += 0.25
+        pid.update(temp, 1.0)
+    assert pid.slope == pytest.approx(0.25)
+    assert pid.PTerm == pytest.approx(pid.Kp * (235.0 - temp - 0.25 * pid.horizon))
+
+def test_manual_gains_scale_every_band():
+    pid = makePID(bands=(GainBand(25.0, 8.0, 0.0, 0.0),
+                         GainBand(-10.0, 2.0, 0.005, 0.0),
+                         GainBand(float("-inf"), 3.0, 0.01, 0.0)))
+    pid.setKp(4.0)
+    pid.setKi(0.01)
+    pid.setKd(1.0)
+    #Gains given for the near band; the others keep their ratio to it
+    assert [b.Kp for b in pid.bands] == pytest.approx([16.0, 4.0, 6.0])
+    assert [b.Ki for b in pid.bands] == pytest.approx([0.0, 0.01, 0.02])
+    assert [b.Kd for b in pid.bands] == [0.0, 1.0, 0.0]
+    assert (pid.band, pid.Kp, pid.Ki) == (2, 6.0, 0.02)
+    #And stay applied when the band changes
+    hold(pid, 235.0, 1)
+    assert (pid.band, pid.Kp, pid.Ki, pid.Kd) == (1, 4.0, 0.01, 1.0)
+    hold(pid, 235.0 - 30.0, 1)
+    assert (pid.band, pid.Kp, pid.Ki) == (0, 16.0, 0.0)
+
+def test_controller_gains_and_bias_reach_a_scheduled_pid():
+    import bbq_controller
+    pid = makePID()
+    bbq = bbq_controller.BBQController(log=logging.getLogger("test_scheduled_pid"), simulator=True, pid=pid)
+    bbq.set_pid_gains(3.0, 0.009, 0.0, bias=30.0)
+    assert pid.band == 2
+    assert pid.bands[1].Kp == pytest.approx(3.0)
+    assert pid.Kp == pytest.approx(5.0)
+    #The preload is the bias under the active band's Ki and survives the move to the near band
+    assert pid.Ki * pid.ITerm == pytest.approx(30.0)
+    pid.SetPoint = 235.0
+    pid.update(235.0, 1.0)
+    assert pid.band == 1
+    assert pid.Ki == pytest.approx(0.009)
+    assert pid.Ki * pid.ITerm == pytest.approx(30.0)
+
+def test_update_many_takes_numpy_arrays():
+    import numpy as np
+    temps = np.linspace(180.0, 240.0, 50)
+    intervals = np.full(50, 2.0)
+    one = makePID()
+    expected = []
+    for temp in temps:
+        one.update(temp, 2.0)
+        expected.append(one.output)
+    assert makePID().update_many(temps, dt=intervals) == pytest.approx(expected)
+    assert makePID().update_many(temps, dt=2.0) == pytest.approx(expected)
+    replay = makePID()
+    assert len(replay.update_many(temps, timestamps=np.arange(50) * 2.0)) == 50
+    assert replay.last_time == 98.0
+
+def lidOpenResponse(pid, target=235.0):
+    from smoker_sim import simulateLoop, recoveryMetrics
+    times, temps, duties = simulateLoop(pid, hours=3.0, target_temp=target,
+                                        events={7200: lambda model, now: model.openLid(now, 180)})
+    result = recoveryMetrics(times, temps, target, 7380)
+    result["startup_overshoot"] = max(temps[:7200]) - target
+    return result
+
+def test_simulator_overshoot_and_recovery_improve():
+    from pid_controller import PID
+    log = logging.getLogger("test_scheduled_pid")
+    fixed = []
+    #BBQController's gains, with its windup guard and with the one ScheduledPID uses
+    for windup in (20.0, 25000.0):
+        pid = PID(6, 0.02, 0.0, clock=lambda: 0.0)
+        pid.setWindup(windup)
+        fixed.append(lidOpenResponse(pid))
+    scheduled = lidOpenResponse(ScheduledPID(clock=lambda: 0.0, log=log))
+    unfrozen = lidOpenResponse(ScheduledPID(disturbance_rate=float("inf"), clock=lambda: 0.0, log=log))
+    for result in fixed:
+        assert scheduled["startup_overshoot"] < result["startup_overshoot"]
+        assert scheduled["overshoot"] < result["overshoot"]
+        #Neither fixed PID settles back within 5F of the target after the lid closes
+        assert result["recovery_time"] == None
+    assert scheduled["startup_overshoot"] < 2.0
+    assert scheduled["recovery_time"] < 600
+    #The freeze trims the overshoot after the lid closes, at the cost of a slightly slower recovery
+    assert scheduled["overshoot"] < unfrozen["overshoot"]
+    assert scheduled["recovery_time"] < 1.1 * unfrozen["recovery_time"]
@@ -0,0 +1,46 @@
+import logging
+import time
+
+from hal import FakeThermometer
+from sensor_manager import SensorManager
+
+def makeManager():
+    return SensorManager(log=logging.getLogger("test_sensor_manager"))
+
+def test_slow_probe_does_not_delay_a_fast_one():
+    manager = makeManager()
+    fast = FakeThermometer("28-000000000001", conversion_time=0.02)
+    slow = FakeThermometer("28-000000000002", conversion_time=1.0)
+    manager.addProbe(fast, name="pit", interval=0.1)
+    manager.addProbe(slow, name="meat", interval=0.1)
+    manager.start()
+    try:
+        time.sleep(1.5)
+    finally:
+        manager.stop()
+    #Serially the pit would get one read per meat conversion, two at most
+    assert fast.read_count >= 8
+    assert slow.read_count <= 2
+
+def test_probes_sample_concurrently_at_their_own_intervals():
+    manager = makeManager()
+    sensors = [FakeThermometer("28-00000000000%d" % x, conversion_time=0.5) for x in range(3)]
+    for sensor in sensors:
+        manager.addProbe(sensor, interval=10.0)
+    start_time = time.time()
+    manager.start()
+    try:
+        #Three 0.5s conversions in parallel finish well before 1.5s
+        while any(sensor.read_count == 0 for sensor in sensors) and time.time() - start_time < 5:
+            time.sleep(0.01)
+        elapsed = time.time() - start_time
+        time.sleep(0.5)
+        counts = [sensor.read_count for sensor in sensors]
+    finally:
+        manager.stop()
+    assert elapsed < 1.2
+    #Not due again for 10s
+    assert counts == [1, 1, 1]
+    readings = manager.read_all()
+    assert sorted(readings) == [sensor.id for sensor in sensors]
+    assert all(reading.sequence == 1 for reading in readings.values())
@@ -0,0 +1,101 @@
+import json
+import logging
+import socket
+import time
+
+import pytest
+
+from clocks import REAL_CLOCK
+from status_server import StatusServer
+
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    from httplib import HTTPConnection
+
+class StubController(object):
+    def __init__(self):
+        self.clock = REAL_CLOCK
+        self.status = None
+        self.history = None
+        self.target = None
+
+    def get_status(self, sequence):
+        return None
+
+    def set_target_ambient_temp(self, value):
+        self.target = value
+
+def startServer(**kwargs):
+    server = StatusServer(StubController(), port=0, log=logging.getLogger("test_status_server"), **kwargs)
+    server.start()
+    return server
+
+@pytest.fixture
+def server():
+    server = startServer(allow_writes=True)
+    try:
+        yield server
+    finally:
+        server.stop()
+
+@pytest.fixture
+def read_only_server():
+    server = startServer()
+    try:
+        yield server
+    finally:
+        server.stop()
+
+def post(server, body, length):
+    conn = HTTPConnection("127.0.0.1", server.port, timeout=5)
+    try:
+        conn.putrequest("POST", "/target")
+        conn.putheader("Content-Type", "application/json")
+        conn.putheader("Content-Length", length)
+        conn.endheaders()
+        conn.send(body)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read().decode("utf-8"))
+    finally:
+        conn.close()
+
+def waitFor(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+def test_post_sets_the_target(server):
+    body = b'{"target": 240}'
+    assert post(server, body, str(len(body))) == (200, {"target": 240})
+    assert server.controller.target == 240
+
+def test_defaults_to_localhost_and_read_only(read_only_server):
+    assert read_only_server.host == "127.0.0.1"
+    body = b'{"target": 240}'
+    status, response = post(read_only_server, body, str(len(body)))
+    assert status == 403
+    assert "disabled" in response["error"]
+    assert read_only_server.controller.target == None
+
+def test_bad_content_length_is_a_client_error(server):
+    for length in ("abc", "-5", "1.5"):
+        status, body = post(server, b"{}", length)
+        assert status == 400
+        assert "Content-Length" in body["error"]
+    assert server.controller.target == None
+
+def test_stream_count_returns_to_zero(server):
+    clients = []
+    for x in range(8):
+        sock = socket.create_connection(("127.0.0.1", server.port), timeout=5)
+        sock.sendall(b"GET /stream?rate=10 HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        sock.recv(1024)
+        clients.append(sock)
+    waitFor(lambda: server.streams == 8)
+    #Streams only notice a closed client when they write, so stop the server to end them
+    for sock in clients:
+        sock.close()
+    server.running = False
+    waitFor(lambda: server.streams == 0)
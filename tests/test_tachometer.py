@@ -0,0 +1,51 @@
+import pytest
+
+from tachometer import Tachometer, SimulatedEdgeSource
+
+class EdgeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def feed(tach, clock, intervals):
+    for interval in intervals:
+        clock.now += interval
+        tach.edge()
+
+def test_ring_wraps_to_the_newest_edges():
+    clock = EdgeClock()
+    tach = Tachometer(capacity=8, window=100.0, stall_timeout=100.0, clock=clock)
+    #Slow edges first; after wrapping only the last 8 (fast) edges may count
+    feed(tach, clock, [0.1] * 13 + [0.02] * 8)
+    intervals, last_edge = tach._recentIntervals(clock.now)
+    assert len(intervals) == 7
+    assert intervals == pytest.approx([0.02] * 7)
+    assert last_edge == pytest.approx(clock.now)
+    reading = tach.getReading()
+    assert reading.rpm == pytest.approx(60.0 / (0.02 * 2))
+    assert reading.edges == 8
+
+def test_wraparound_many_times_over():
+    clock = EdgeClock()
+    tach = Tachometer(capacity=16, window=1.0, clock=clock)
+    feed(tach, clock, [0.01] * 1000)
+    assert tach._count == 1000
+    assert tach.getReading().rpm == pytest.approx(3000.0)
+
+def test_window_limits_the_edges_used():
+    clock = EdgeClock()
+    tach = Tachometer(capacity=256, window=0.5, clock=clock)
+    feed(tach, clock, [0.05] * 20 + [0.025] * 20)
+    assert tach.getReading().rpm == pytest.approx(1200.0)
+
+def test_stall_and_bounce():
+    source = SimulatedEdgeSource(jitter=0.0, bounce=0.3, seed=3)
+    tach = source.attach(Tachometer())
+    source.run(1500, 2.0)
+    assert tach.getReading().rpm == pytest.approx(1500.0, rel=0.01)
+    source.run(0, 2.0)
+    reading = tach.getReading()
+    assert reading.stalled
+    assert reading.rpm == 0.0
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from telemetry import TelemetryHistory, StatusSnapshot
+
+def record(x):
+    return (x, x, 225.0, 150.0, 40.0, 0.0, 235, 265, 205, 1.0, 2.0, 0.0, 3.0)
+
+def fill(history, timestamps):
+    for x in timestamps:
+        history.append(*record(x))
+
+def test_ring_keeps_the_newest_samples_in_order():
+    history = TelemetryHistory(capacity=8)
+    assert history.latest() == None
+    assert len(history.window()) == 0
+    fill(history, range(5))
+    assert history.column("timestamp").tolist() == [0, 1, 2, 3, 4]
+    #Wrapped more than once over
+    fill(history, range(5, 21))
+    assert len(history) == 8
+    assert history.column("timestamp").tolist() == list(range(13, 21))
+    assert history.column("timestamp", 3).tolist() == [18, 19, 20]
+    assert history.latest()["timestamp"] == 20
+    #Every window is a view into the buffer, not a copy
+    assert history.window().base is history._buf
+
+def test_since_across_the_wrap_point():
+    history = TelemetryHistory(capacity=10)
+    fill(history, range(0, 150, 10))
+    #The ring holds 50..140 and its head is in the middle of the buffer
+    assert history._head != history.capacity - 1
+    assert history.since(95)["timestamp"].tolist() == [100, 110, 120, 130, 140]
+    assert history.since(100)["timestamp"].tolist() == [100, 110, 120, 130, 140]
+    assert history.since(0)["timestamp"].tolist() == list(range(50, 150, 10))
+    assert len(history.since(141)) == 0
+
+def test_default_capacity_holds_a_day_at_one_hertz():
+    history = TelemetryHistory()
+    assert history.capacity == 24 * 60 * 60
+    #Two rows per sample so the newest day is always contiguous
+    assert history._buf.nbytes == 2 * history.capacity * TelemetryHistory.DTYPE.itemsize
+    fill(history, range(history.capacity + 100))
+    assert len(history) == history.capacity
+    timestamps = history.column("timestamp")
+    assert timestamps[0] == 100
+    assert timestamps[-1] == history.capacity + 99
+    assert np.all(np.diff(timestamps) == 1)
+    assert len(history.since(history.capacity + 99 - 3600)) == 3601
+
+def test_snapshot_sample_round_trips_through_the_history():
+    snapshot = StatusSnapshot(*(record(7.0) + (3,)))
+    assert snapshot["ambient_temp"] == 225.0
+    assert snapshot.get("nope") == None
+    history = TelemetryHistory(capacity=4)
+    history.append(*snapshot.sample())
+    assert history.latest().tolist() == pytest.approx(snapshot.sample())
@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+from hal import FakeThermometer
+from therm_sampler import ThermSampler, SysfsThermSensor, ThermReadError, DEGREES_C, DEGREES_F
+
+def writeSlave(base, sensor_id, crc, millicelsius):
+    device = base / sensor_id
+    device.mkdir(exist_ok=True)
+    (device / "w1_slave").write_text("72 01 4b 46 7f ff 0e 10 57 : crc=aa %s\n72 01 4b 46 7f ff 0e 10 57 t=%d\n" % (crc, millicelsius))
+
+def test_sysfs_sensor_parses_w1_slave(tmp_path):
+    sensor = SysfsThermSensor("28-000000000001", str(tmp_path))
+    writeSlave(tmp_path, sensor.id, "YES", 23125)
+    assert sensor.get_temperature(DEGREES_C) == pytest.approx(23.125)
+    assert sensor.get_temperature(DEGREES_F) == pytest.approx(73.625)
+    writeSlave(tmp_path, sensor.id, "NO", 23125)
+    with pytest.raises(ThermReadError):
+        sensor.get_temperature()
+
+def test_sample_publishes_a_new_reading():
+    sensor = FakeThermometer("28-000000000001", celsius=100.0)
+    sampler = ThermSampler(sensor, unit=DEGREES_F)
+    assert sampler.latest() == None
+    first = sampler.sample()
+    assert first.temperature == pytest.approx(212.0)
+    assert first.sequence == 1
+    assert sampler.latest() is first
+    sensor.setTemperature(0.0)
+    second = sampler.sample()
+    assert second.sequence == 2
+    assert second.timestamp >= first.timestamp
+    assert sampler.latest().temperature == pytest.approx(32.0)
+
+def test_failed_read_keeps_the_last_reading():
+    sensor = FakeThermometer("28-000000000001", celsius=50.0)
+    sampler = ThermSampler(sensor, unit=DEGREES_C)
+    reading = sampler.sample()
+    sensor.fail = True
+    assert sampler.sample() == None
+    assert sampler.error_count == 1
+    #The stale reading stays published, and readers can tell by its sequence
+    assert sampler.latest() is reading
+    assert sampler.wait_for_reading(reading.sequence, timeout=0.05) == None
+
+def test_wait_for_reading():
+    sampler = ThermSampler(FakeThermometer("28-000000000001"))
+    reading = sampler.sample()
+    #Already newer than what the caller has seen: no wait
+    assert sampler.wait_for_reading(0, timeout=0) is reading
+    published = []
+    thread = threading.Thread(target=lambda: published.append(sampler.wait_for_reading(reading.sequence, timeout=5)))
+    thread.start()
+    newer = sampler.sample()
+    thread.join(5)
+    assert published == [newer]
+
+def test_wake_releases_waiters():
+    sampler = ThermSampler(FakeThermometer("28-000000000001"))
+    result = []
+    thread = threading.Thread(target=lambda: result.append(sampler.wait_for_reading(0, timeout=5)))
+    thread.start()
+    threading.Timer(0.05, sampler.wake).start()
+    thread.join(5)
+    assert result == [None]
+
+def test_background_thread_keeps_sampling():
+    sensor = FakeThermometer("28-000000000001", celsius=20.0, conversion_time=0.01)
+    sampler = ThermSampler(sensor, unit=DEGREES_C, interval=0.02)
+    sampler.start()
+    try:
+        first = sampler.wait_for_reading(0, timeout=2)
+        assert first != None
+        sensor.setTemperature(30.0)
+        reading = first
+        while reading.temperature != 30.0:
+            reading = sampler.wait_for_reading(reading.sequence, timeout=2)
+            assert reading != None
+        assert reading.sequence > first.sequence
+    finally:
+        sampler.stop()
+    assert sampler.sampler_thread == None
@@ -0,0 +1,165 @@
+import json
+import os
+import gzip
+import io
+import threading
+
+import pytest
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+from uploader import StatusUploader
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    #Each uploader holds a keep-alive connection open; serve them side by side
+    daemon_threads = True
+
+def record(x):
+    return (x, x, 225.0, 150.0, 40.0, 0.0, 235, 265, 205, 1.0, 2.0, 0.0, 3.0)
+
+class StubServer(object):
+    """Logging endpoint that records every timestamp it accepts
+
+    fail is the number of requests to reject with 503 before accepting;
+    on_request runs inside each request, before the response is sent.
+    """
+    def __init__(self, fail=0, on_request=None):
+        self.fail = fail
+        self.on_request = on_request
+        self.requests = 0
+        self.received = []
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                owner.requests += 1
+                if owner.on_request != None:
+                    owner.on_request()
+                if owner.requests <= owner.fail:
+                    status = 503
+                else:
+                    status = 200
+                    payload = json.loads(gzip.GzipFile(fileobj=io.BytesIO(body)).read().decode("utf-8"))
+                    owner.received.extend(int(row[0]) for row in payload["records"])
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d/status" % self.httpd.server_port
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def closeUploader(uploader):
+    if uploader != None:
+        uploader._close()
+        uploader.spool.close()
+
+@pytest.fixture
+def spool_path(tmp_path):
+    return str(tmp_path / "upload.spool")
+
+def test_records_enqueued_during_upload_survive_compaction(spool_path):
+    uploader = None
+    extra = list(range(40, 45))
+    def enqueueDuringUpload():
+        while extra:
+            uploader.enqueue(record(extra.pop(0)))
+    server = StubServer(on_request=enqueueDuringUpload)
+    try:
+        uploader = StatusUploader(server.url, spool_path, batch_size=100, compact_bytes=0)
+        for x in range(40):
+            uploader.enqueue(record(x))
+        assert uploader.upload() == 40
+        assert uploader.pending() == 5
+        assert uploader.upload() == 5
+        assert uploader.pending() == 0
+        assert sorted(server.received) == list(range(45))
+    finally:
+        closeUploader(uploader)
+        server.close()
+
+def test_failed_batch_is_resent(spool_path):
+    server = StubServer(fail=1)
+    uploader = StatusUploader(server.url, spool_path, batch_size=10)
+    try:
+        for x in range(25):
+            uploader.enqueue(record(x))
+        with pytest.raises(IOError):
+            uploader.upload()
+        assert uploader.pending() == 25
+        assert uploader.upload() == 25
+        assert uploader.pending() == 0
+        assert server.received == list(range(25))
+    finally:
+        closeUploader(uploader)
+        server.close()
+
+def test_cursor_survives_restart(spool_path):
+    server = StubServer()
+    uploader = StatusUploader(server.url, spool_path, batch_size=10)
+    restarted = None
+    try:
+        for x in range(15):
+            uploader.enqueue(record(x))
+        uploader.upload()
+        uploader.enqueue(record(15))
+        closeUploader(uploader)
+        restarted = StatusUploader(server.url, spool_path, batch_size=10)
+        assert restarted.pending() == 1
+        restarted.upload()
+        assert server.received == list(range(16))
+    finally:
+        closeUploader(restarted)
+        server.close()
+
+def test_compaction_starts_a_fresh_spool(spool_path):
+    server = StubServer()
+    uploader = StatusUploader(server.url, spool_path, batch_size=100, compact_bytes=0)
+    try:
+        for x in range(50):
+            uploader.enqueue(record(x))
+        uploader.upload()
+        assert uploader.sent == 0
+        assert uploader.pending() == 0
+        uploader.enqueue(record(50))
+        uploader.upload()
+        assert server.received == list(range(51))
+    finally:
+        closeUploader(uploader)
+        server.close()
+
+def test_stale_cursor_after_a_crash_during_compaction(spool_path):
+    server = StubServer()
+    uploader = StatusUploader(server.url, spool_path, batch_size=100)
+    restarted = None
+    try:
+        for x in range(30):
+            uploader.enqueue(record(x))
+        uploader.upload()
+        closeUploader(uploader)
+        #The old code crashed here: the spool replaced, the cursor still at 30
+        os.remove(spool_path)
+        restarted = StatusUploader(server.url, spool_path, batch_size=100)
+        for x in range(30, 35):
+            restarted.enqueue(record(x))
+        assert restarted.pending() == 5
+        restarted.upload()
+        assert server.received == list(range(35))
+    finally:
+        closeUploader(restarted)
+        server.close()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import threading
+from collections import namedtuple
+
+from clocks import REAL_CLOCK
+import metrics
+
+# Same unit constants as w1thermsensor so either sensor class can be sampled
+DEGREES_C = 0x01
+DEGREES_F = 0x02
+KELVIN = 0x03
+
+#timestamp is wall time for logs and status; monotonic is for measuring time between readings
+ThermReading = namedtuple("ThermReading", ["timestamp", "temperature", "sequence", "monotonic"])
+
+class ThermReadError(Exception):
+    pass
+
+def convertTemperature(celsius, unit):
+    if unit == DEGREES_C:
+        return celsius
+    elif unit == DEGREES_F:
+        return celsius * 9.0 / 5.0 + 32.0
+    elif unit == KELVIN:
+        return celsius + 273.15
+    raise ValueError("Unknown temperature unit %s" % str(unit))
+
+class SysfsThermSensor(object):
+    """DS18B20 read straight from the kernel w1-therm sysfs file
+
+    Reading w1_slave is what triggers the conversion in the kernel driver,
+    so get_temperature blocks for the full conversion time (~750ms at 12 bits).
+    """
+    BASE_DIRECTORY = "/sys/bus/w1/devices"
+    SLAVE_FILE = "w1_slave"
+
+    def __init__(self, sensor_id, base_directory=None):
+        self.id = sensor_id
+        if base_directory == None:
+            base_directory = SysfsThermSensor.BASE_DIRECTORY
+        self.sensorpath = os.path.join(base_directory, sensor_id, SysfsThermSensor.SLAVE_FILE)
+
+    def _readSlaveFile(self):
+        with open(self.sensorpath, "r") as f:
+            return f.readlines()
+
+    def get_temperature(self, unit=DEGREES_C):
+        lines = self._readSlaveFile()
+        if len(lines) < 2 or not lines[0].strip().endswith("YES"):
+            raise ThermReadError("CRC check failed for sensor %s" % self.id)
+        idx = lines[1].find("t=")
+        if idx < 0:
+            raise ThermReadError("No temperature in w1_slave for sensor %s" % self.id)
+        celsius = int(lines[1][idx+2:].strip()) / 1000.0
+        return convertTemperature(celsius, unit)
+
+class ThermSampler(object):
+    """Runs 1-Wire conversions on a background thread and publishes the newest reading
+
+    The next conversion is started as soon as the previous one is read, so the
+    published reading is never older than one conversion period. Readers get the
+    latest ThermReading through a single reference read and never wait on sensor I/O.
+    """
+    def __init__(self, sensor, unit=DEGREES_F, interval=0.0, log=None, clock=REAL_CLOCK):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.clock = clock
+        self.sensor = sensor
+        self.unit = unit
+        self.interval = interval
+        self.error_count = 0
+        self.last_conversion_time = 0.0
+
+        self._latest = None
+        self._sequence = 0
+        self._new_reading = threading.Condition(threading.Lock())
+        self._stop_event = threading.Event()
+        self.sampler_thread = None
+
+        labels = {"sensor": getattr(sensor, "id", "unknown")}
+        self._read_time = metrics.REGISTRY.histogram("bbq_therm_read_seconds", "Time spent in get_temperature", labels)
+        self._read_errors = metrics.REGISTRY.counter("bbq_therm_read_errors_total", "Failed thermometer reads", labels)
+
+    def start(self):
+        if self.sampler_thread:
+            self.log.warn("Sampler thread already started; skipping")
+            return
+        self._stop_event.clear()
+        self.sampler_thread = threading.Thread(target=self.run_sampler)
+        self.sampler_thread.daemon = True
+        self.sampler_thread.start()
+
+    def stop(self):
+        if not self.sampler_thread:
+            self.log.warn("Sampler thread already stopped; skipping")
+            return
+        self._stop_event.set()
+        self.sampler_thread.join(2)
+        self.sampler_thread = None
+
+    def sample(self):
+        """Runs one blocking conversion and publishes it; returns the new reading or None"""
+        start_time = self.clock.monotonic()
+        perf_start = metrics.PERF_CLOCK()
+        try:
+            temp = self.sensor.get_temperature(self.unit)
+        except Exception as e:
+            self.error_count += 1
+            self._read_errors.inc()
+            self.log.error("Could not read thermometer: %s" % str(e))
+            return None
+        self._read_time.observeSince(perf_start)
+        now = self.clock.time()
+        monotonic_now = self.clock.monotonic()
+        self.last_conversion_time = monotonic_now - start_time
+        self._sequence += 1
+        reading = ThermReading(now, temp, self._sequence, monotonic_now)
+        # Single reference swap; readers see either the old or the new reading
+        with self._new_reading:
+            self._latest = reading
+            self._new_reading.notify_all()
+        return reading
+
+    def run_sampler(self):
+        while not self._stop_event.is_set():
+            start_time = self.clock.monotonic()
+            self.sample()
+            remaining = self.interval - (self.clock.monotonic() - start_time)
+            if remaining > 0:
+                self._stop_event.wait(self.clock.timeout(remaining))
+
+    def latest(self):
+        return self._latest
+
+    def wait_for_reading(self, last_sequence, timeout=None):
+        """Blocks until a reading newer than last_sequence is published
+
+        Returns the reading, or None if the timeout expired or wake() was called.
+        """
+        reading = self._latest
+        if reading != None and reading.sequence > last_sequence:
+            return reading
+        with self._new_reading:
+            reading = self._latest
+            if reading == None or reading.sequence <= last_sequence:
+                self._new_reading.wait(self.clock.timeout(timeout))
+                reading = self._latest
+        if reading != None and reading.sequence > last_sequence:
+            return reading
+        return None
+
+    def wake(self):
+        """Releases every thread blocked in wait_for_reading"""
+        with self._new_reading:
+            self._new_reading.notify_all()
+
+if __name__ == "__main__":
+
+    from hal import FakeThermometer
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    sensor = FakeThermometer("28-000000000001", conversion_time=0.75)
+    sampler = ThermSampler(sensor, log=log)
+    sampler.start()
+    try:
+        for x in range(10):
+            sensor.setTemperature(100.0 + x)
+            start_time = time.time()
+            reading = sampler.latest()
+            log.info("Latest reading %s fetched in %.1f us" % (str(reading), (time.time()-start_time)*1e6))
+            time.sleep(0.5)
+    finally:
+        sampler.stop()
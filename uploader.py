@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+import os, time, sys
+import logging
+import threading
+import random
+import json
+import gzip
+import io
+try:
+    import http.client as httplib
+    from urllib.parse import urlparse
+except ImportError:
+    import httplib
+    from urlparse import urlparse
+
+from cook_log import CookLogWriter, readCookLog
+from clocks import REAL_CLOCK
+
+class StatusUploader(object):
+    """Sends status records to a remote logging endpoint in batches
+
+    enqueue() only appends to a local spool file (a cook log), so the control
+    loop never waits on the network. A background thread POSTs everything not
+    yet acknowledged as gzipped JSON over one keep-alive connection, and
+    remembers how far it got in a small cursor file, so records survive both
+    network outages and restarts. Failures back off exponentially with
+    jitter, up to max_backoff seconds.
+    """
+    def __init__(self, url, spool_path, batch_size=300, interval=30.0, max_backoff=600.0,
+                 compact_bytes=1024*1024, headers=None, timeout=10.0, log=None, clock=REAL_CLOCK):
+        if log != None:
+            self.log = log
+        else:
+            self.log = logging.getLogger(__name__)
+        self.clock = clock
+        self.url = urlparse(url)
+        self.spool_path = spool_path
+        self.cursor_path = spool_path + ".sent"
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.compact_bytes = compact_bytes
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+
+        self.spool_lock = threading.Lock()
+        self.spool = CookLogWriter(spool_path, fsync_interval=interval, log=self.log, clock=clock)
+        #A cursor past the end of the spool belongs to a spool that has since been replaced
+        spooled = len(readCookLog(spool_path))
+        self.sent = self._readCursor()
+        if self.sent > spooled:
+            self.log.warn("Upload cursor %d is past the %d spooled records; starting from 0" % (self.sent, spooled))
+            self.sent = 0
+        self._conn = None
+        self._stop_event = threading.Event()
+        self.uploader_thread = None
+
+        self.connected = False
+        self.failures = 0
+        self.batches_sent = 0
+        self.records_sent = 0
+        self.bytes_sent = 0
+
+    def start(self):
+        if self.uploader_thread:
+            self.log.warn("Uploader thread already started; skipping")
+            return
+        self._stop_event.clear()
+        self.uploader_thread = threading.Thread(target=self.run_uploader)
+        self.uploader_thread.daemon = True
+        self.uploader_thread.start()
+
+    def stop(self):
+        if not self.uploader_thread:
+            self.log.warn("Uploader thread already stopped; skipping")
+            return
+        self._stop_event.set()
+        self.uploader_thread.join(2)
+        self.uploader_thread = None
+        with self.spool_lock:
+            self.spool.flush(sync=True)
+        self._close()
+
+    def enqueue(self, values):
+        """Spools one record; values are in TelemetryHistory field order"""
+        with self.spool_lock:
+            self.spool.write(values)
+
+    def _readCursor(self):
+        try:
+            with open(self.cursor_path) as f:
+                return int(f.read().strip() or 0)
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def _writeCursor(self, sent):
+        tmp_path = self.cursor_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("%d\n" % sent)
+        os.rename(tmp_path, self.cursor_path)
+        self.sent = sent
+
+    def _compact(self):
+        #Everything in the spool is acknowledged; start a fresh one so it does not grow forever
+        with self.spool_lock:
+            #Records enqueued during the upload may still sit in the writer's buffer;
+            #count them too, or closing the writer would put them in a file we delete
+            self.spool.flush()
+            if len(readCookLog(self.spool_path)) != self.sent:
+                return
+            self.spool.close()
+            #Cursor first: a crash before the new spool exists resends acknowledged records
+            #rather than skipping new ones
+            self._writeCursor(0)
+            os.remove(self.spool_path)
+            self.spool = CookLogWriter(self.spool_path, fsync_interval=self.interval, log=self.log, clock=self.clock)
+
+    def _connection(self):
+        if self._conn == None:
+            if self.url.scheme == "https":
+                self._conn = httplib.HTTPSConnection(self.url.hostname, self.url.port, timeout=self.timeout)
+            else:
+                self._conn = httplib.HTTPConnection(self.url.hostname, self.url.port, timeout=self.timeout)
+        return self._conn
+
+    def _close(self):
+        if self._conn != None:
+            self._conn.close()
+            self._conn = None
+
+    def _encode(self, records):
+        payload = json.dumps({"fields": list(records.dtype.names),
+                              "records": [list(row) for row in records.tolist()]}, separators=(",", ":"))
+        out = io.BytesIO()
+        with gzip.GzipFile(fileobj=out, mode="wb") as f:
+            f.write(payload.encode("utf-8"))
+        return out.getvalue()
+
+    def _post(self, body):
+        headers = {"Content-Type": "application/json",
+                   "Content-Encoding": "gzip",
+                   "Connection": "keep-alive"}
+        headers.update(self.headers)
+        conn = self._connection()
+        try:
+            conn.request("POST", self.url.path or "/", body, headers)
+            response = conn.getresponse()
+            response.read()
+        except Exception:
+            #The server may have dropped the idle connection; never reuse a broken one
+            self._close()
+            raise
+        if response.status >= 300:
+            raise IOError("Upload rejected with HTTP %d" % response.status)
+
+    def upload(self):
+        """Sends every unsent record; returns the number sent, raises on failure"""
+        with self.spool_lock:
+            self.spool.flush()
+        records = readCookLog(self.spool_path)
+        sent = 0
+        while self.sent < len(records):
+            batch = records[self.sent:self.sent + self.batch_size]
+            body = self._encode(batch)
+            self._post(body)
+            self._writeCursor(self.sent + len(batch))
+            sent += len(batch)
+            self.batches_sent += 1
+            self.records_sent += len(batch)
+            self.bytes_sent += len(body)
+        if sent and os.path.getsize(self.spool_path) > self.compact_bytes:
+            self._compact()
+        return sent
+
+    def run_uploader(self):
+        delay = self.interval
+        while not self._stop_event.is_set():
+            try:
+                sent = self.upload()
+                if sent:
+                    self.log.debug("Uploaded %d status records" % sent)
+                self.connected = True
+                self.failures = 0
+                delay = self.interval
+            except Exception as e:
+                self.connected = False
+                self.failures += 1
+                delay = min(self.max_backoff, self.interval * 2 ** min(self.failures, 16))
+                delay *= random.uniform(0.5, 1.0)
+                self.log.warn("Upload failed (%s); retrying in %.0fs" % (str(e), delay))
+            self._stop_event.wait(self.clock.timeout(delay))
+
+    def pending(self):
+        """Number of spooled records not yet acknowledged by the server"""
+        with self.spool_lock:
+            self.spool.flush()
+        return len(readCookLog(self.spool_path)) - self.sent
+
+    def getStats(self):
+        return {"connected": self.connected,
+                "failures": self.failures,
+                "batches_sent": self.batches_sent,
+                "records_sent": self.records_sent,
+                "bytes_sent": self.bytes_sent}
+
+if __name__ == "__main__":
+
+    try:
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+    except ImportError:
+        from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+    log = logging.getLogger(__name__)
+    log.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
+
+    #Local stub of the logging endpoint; rejects the first two batches to show the backoff
+    received = []
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            status = 503 if len(received) < 2 else 200
+            received.append(json.loads(gzip.GzipFile(fileobj=io.BytesIO(body)).read().decode("utf-8")))
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), StubHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    spool_path = "/tmp/uploader_demo.bbqlog"
+    for path in (spool_path, spool_path + ".sent"):
+        if os.path.exists(path):
+            os.remove(path)
+    uploader = StatusUploader("http://127.0.0.1:%d/status" % server.server_port, spool_path, batch_size=100, interval=0.05, log=log)
+    uploader.start()
+    start_time = time.time()
+    for x in range(1000):
+        uploader.enqueue((x, x, 225.0, 150.0, 40.0, 0.0, 235, 265, 205, 1.0, 2.0, 0.0, 3.0))
+    log.info("Enqueued 1000 records in %.2f ms" % ((time.time()-start_time)*1e3))
+    while uploader.pending() and time.time() - start_time < 10:
+        time.sleep(0.05)
+    uploader.stop()
+    server.shutdown()
+    log.info("%d requests, %d pending, stats %s" % (len(received), uploader.pending(), str(uploader.getStats())))